@@ -2,6 +2,7 @@ __all__ = [
     "dynamic_calculation_setups",
     "calculation_setups",
     "config",
+    "consumers_of",
     "Database",
     "databases",
     "DataStore",
@@ -9,7 +10,9 @@ __all__ = [
     "extract_brightway_databases",
     "get_activity",
     "get_node",
+    "get_nodes",
     "get_id",
+    "get_ids",
     "geomapping",
     "IndexManager",
     "JsonWrapper",
@@ -63,12 +66,12 @@ config.p = preferences
 
 from .serialization import JsonWrapper
 from .backends import Database
-from .utils import get_activity, get_node
+from .utils import get_activity, get_node, get_nodes
 from .data_store import DataStore, ProcessedDataStore
 from .method import Method
 from .search import Searcher, IndexManager
 from .weighting_normalization import Weighting, Normalization
-from .backends import get_id, Node, Edge
+from .backends import consumers_of, get_id, get_ids, Node, Edge
 from .compat import prepare_lca_inputs, Mapping, databases
 from .backends.wurst_extraction import extract_brightway_databases
 
@@ -7,14 +7,27 @@ from .base import (  # SQLiteBackend just for backwards compatibility
     Database,
     SQLiteBackend,
 )
-from .schema import ActivityDataset, ExchangeDataset, get_id
+from .schema import (
+    EXCHANGE_COLUMN_TRIGGERS,
+    EXISTING_DATA_INDICES,
+    INDICES,
+    NODE_ID_TRIGGERS,
+    ActivityDataset,
+    ChangeLog,
+    ExchangeDataset,
+    get_id,
+    get_ids,
+)
 
 sqlite3_lci_db = SubstitutableDatabase(
     projects.dir / "lci" / "databases.db",
-    [ActivityDataset, ExchangeDataset, Database],
+    [ActivityDataset, ExchangeDataset, ChangeLog, Database],
+    setup_sql=list(EXISTING_DATA_INDICES.values())
+    + list(NODE_ID_TRIGGERS.values())
+    + list(EXCHANGE_COLUMN_TRIGGERS.values()),
 )
 
-from .proxies import Activity, Exchange
+from .proxies import Activity, Exchange, consumers_of
 
 config.sqlite3_databases.append(
     (
@@ -1,29 +1,34 @@
 import copy
-import functools
 import itertools
 import os
-import pickle
 import pprint
 import random
 import sqlite3
 import warnings
 from collections import defaultdict
+from collections.abc import Mapping
 from datetime import datetime
+from time import time
 from typing import Callable, List, Optional
 
 import numpy as np
 import pandas as pd
 import pyprind
-from bw_processing import (
-    clean_datapackage_name,
-    create_datapackage,
-    load_datapackage,
-    safe_filename,
-)
-from fs.zipfs import ZipFS
+from bw_processing import clean_datapackage_name, create_datapackage, safe_filename
+from bw_processing.utils import dictionary_formatter
+from numpy.lib.recfunctions import repack_fields
 from peewee import BooleanField, DoesNotExist, Model, TextField, fn
 
 from .. import config, geomapping, projects
+from ..datapackages import (
+    DEFAULT_CHUNKSIZE,
+    add_column_index,
+    add_persistent_vector_from_blocks,
+    datapackage_cache,
+    open_datapackage,
+    processed_filename,
+    processed_filesystem,
+)
 from ..errors import (
     DuplicateNode,
     InvalidExchange,
@@ -32,14 +37,28 @@ from ..errors import (
     WrongDatabase,
 )
 from ..query import Query
+from ..query import operators as query_operators
 from ..search import IndexManager, Searcher
-from ..sqlite import JSONField
+from ..sqlite import JSONField, decode_blob
 from ..utils import as_uncertainty_dict, get_geocollection, get_node
 from .iotable import IOTableActivity, IOTableExchanges
 from .proxies import Activity
-from .schema import ActivityDataset, ExchangeDataset, get_id
+from .schema import (
+    _SQL_CHUNK_SIZE,
+    INDICES,
+    NODE_ID_TRIGGERS,
+    OBSOLETE_INDICES,
+    ActivityDataset,
+    ChangeLog,
+    ExchangeDataset,
+    node_cache,
+    node_id_sql,
+)
 from .utils import (
+    VECTOR_DTYPE,
+    add_vector_array,
     check_exchange_amount,
+    datapackage_vector_as_array,
     dict_as_activitydataset,
     dict_as_exchangedataset,
     get_csv_data_dict,
@@ -47,6 +66,306 @@ from .utils import (
 )
 
 _VALID_KEYS = {"location", "name", "product", "type"}
+# Reprocess the whole database if more than this fraction of its nodes changed
+_INCREMENTAL_PROCESSING_LIMIT = 0.2
+
+# Rows inserted at a time when writing databases
+_WRITE_BATCH_SIZE = 10000
+# Rows fetched at a time when building processed arrays
+_FETCH_BATCH_SIZE = 50000
+
+# Node ids of the input and output of an edge ``e``. Edges without node ids, e.g. in
+# projects opened read-only before ``populate_exchange_node_ids_40``, fall back to
+# the ``(database, code)`` columns.
+_EDGE_NODE_IDS = {
+    side: "COALESCE(e.{0}_id, {1})".format(side, node_id_sql(side, "e."))
+    for side in ("input", "output")
+}
+_EXCHANGE_SQL = """SELECT {{columns}}
+        FROM exchangedataset as e
+        LEFT JOIN activitydataset as a ON a.id = {input}
+        LEFT JOIN activitydataset as b ON b.id = {output}
+        WHERE e.output_database = ?
+        AND e.type IN ({{types}})""".format(
+    **_EDGE_NODE_IDS
+)
+# Columns used by ``exchange_data_iterator``. The ``data`` blob is only needed if the numeric columns aren't populated.
+_EXCHANGE_DICT_COLUMNS = """CASE WHEN e.amount IS NULL THEN e.data END, a.id, b.id, e.input_database, e.input_code, e.output_database, e.output_code,
+        e.amount, e.uncertainty_type, e.loc, e.scale, e.shape, e.minimum, e.maximum, e.negative"""
+# Columns in the order of ``VECTOR_DTYPE``, so rows can be copied directly into processed arrays
+_EXCHANGE_ARRAY_COLUMNS = """a.id, b.id, e.amount, e.uncertainty_type, COALESCE(e.loc, e.amount),
+        e.scale, e.shape, e.minimum, e.maximum, e.negative, e.type IN ({flip_types})"""
+# Exchanges which don't need to be deserialized or checked in Python
+_COMPLETE_EXCHANGE = "e.amount IS NOT NULL AND a.id IS NOT NULL AND b.id IS NOT NULL"
+# Suffix of the datapackage resource names for each matrix
+_VECTOR_LABELS = {
+    "biosphere_matrix": " biosphere matrix",
+    "technosphere_matrix": " technosphere matrix",
+}
+_BIOSPHERE_TYPES = ("biosphere",)
+_TECHNOSPHERE_POSITIVE_TYPES = ("production", "substitution", "generic production")
+_TECHNOSPHERE_NEGATIVE_TYPES = ("technosphere", "generic consumption")
+# Edge DataFrame columns of ``edges_to_dataframe``, and the node attribute of each
+# column from ``Database._node_metadata``
+_EDGE_DATAFRAME_COLUMNS = [
+    "target_id",
+    "target_database",
+    "target_code",
+    "target_name",
+    "target_reference_product",
+    "target_location",
+    "target_unit",
+    "target_type",
+    "source_id",
+    "source_database",
+    "source_code",
+    "source_name",
+    "source_product",
+    "source_location",
+    "source_unit",
+    "source_categories",
+    "edge_amount",
+    "edge_type",
+]
+# Default columns of ``Database.iter_nodes_dataframes``, and the columns stored in
+# ``ActivityDataset`` columns which are categorical
+_NODE_DATAFRAME_COLUMNS = [
+    "id",
+    "database",
+    "code",
+    "name",
+    "reference product",
+    "location",
+    "unit",
+    "type",
+]
+_NODE_CATEGORICAL_COLUMNS = ["database", "location", "type"]
+# Column order of ``_iotable_edges_to_dataframe``
+_IOTABLE_EDGE_DATAFRAME_COLUMNS = [
+    "target_id",
+    "source_id",
+    "edge_amount",
+    "edge_type",
+    "target_database",
+    "target_code",
+    "target_name",
+    "target_location",
+    "target_unit",
+    "target_type",
+    "target_reference_product",
+    "source_database",
+    "source_code",
+    "source_name",
+    "source_location",
+    "source_unit",
+    "source_categories",
+    "source_product",
+]
+_EDGE_NODE_COLUMNS = {
+    "target_database": "database",
+    "target_code": "code",
+    "target_name": "name",
+    "target_reference_product": "reference product",
+    "target_location": "location",
+    "target_unit": "unit",
+    "target_type": "type",
+    "source_database": "database",
+    "source_code": "code",
+    "source_name": "name",
+    "source_product": "reference product",
+    "source_location": "location",
+    "source_unit": "unit",
+    "source_categories": "categories",
+}
+_EDGE_CATEGORICAL_COLUMNS = [
+    "target_database",
+    "target_name",
+    "target_reference_product",
+    "target_location",
+    "target_unit",
+    "target_type",
+    "source_database",
+    "source_code",
+    "source_name",
+    "source_product",
+    "source_location",
+    "source_unit",
+    "source_categories",
+    "edge_type",
+]
+# Numeric edge columns fetched by ``Database._sqlite_edge_arrays``; ``edge_type`` is
+# an index in the sorted edge types
+_EDGE_ARRAY_DTYPE = [
+    ("target_id", np.int64),
+    ("source_id", np.int64),
+    ("edge_amount", np.float64),
+    ("edge_type", np.int32),
+]
+# Pages of edges, by ``e.id``, so that no read cursor stays open between pages
+_EDGE_ARRAY_SQL = """SELECT COALESCE(b.id, -1), COALESCE(a.id, -1), {{amount}}, {{type}}, e.id
+        FROM exchangedataset as e
+        LEFT JOIN activitydataset as a ON a.id = {input}
+        LEFT JOIN activitydataset as b ON b.id = {output}
+        WHERE e.output_database = ?
+        AND e.amount IS {{condition}}
+        AND e.id > ? AND e.id <= ?
+        ORDER BY e.id
+        LIMIT ?""".format(
+    **_EDGE_NODE_IDS
+)
+
+
+def _columns_as_uncertainty_dict(
+    amount, uncertainty_type, loc, scale, shape, minimum, maximum, negative
+):
+    """Build the uncertainty dictionary for ``bw_processing`` from numeric ``ExchangeDataset`` columns"""
+    return {
+        "amount": amount,
+        "uncertainty_type": uncertainty_type,
+        "loc": amount if loc is None else loc,
+        "scale": np.NaN if scale is None else scale,
+        "shape": np.NaN if shape is None else shape,
+        "minimum": np.NaN if minimum is None else minimum,
+        "maximum": np.NaN if maximum is None else maximum,
+        "negative": bool(negative),
+    }
+
+
+def _quoted(values):
+    return ", ".join("'{}'".format(x) for x in values)
+
+
+def _append_rows(array, filled, rows):
+    """Copy ``rows`` into the structured ``array`` starting at ``filled``, growing the array if needed.
+
+    Returns the (possibly new) array and the number of filled rows."""
+    if filled + len(rows) > len(array):
+        grown = np.zeros(max(2 * len(array), filled + len(rows)), dtype=array.dtype)
+        grown[:filled] = array[:filled]
+        array = grown
+    array[filled : filled + len(rows)] = rows
+    return array, filled + len(rows)
+
+
+def _as_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def _with_string_values(df):
+    """Replace values in object and categorical columns of ``df`` which aren't strings (e.g. tuple locations) with their string representation.
+
+    The categories of categorical columns are converted, not the values of each row, so columns with the same categories are converted to the same categories."""
+    df = df.copy(deep=False)
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            if all(isinstance(value, str) for value in categories):
+                continue
+            # Different values could have the same string representation
+            mapping, strings = pd.factorize(
+                np.array([_as_string(value) for value in categories], dtype=object)
+            )
+            codes = series.cat.codes.to_numpy()
+            codes = np.where(codes < 0, -1, mapping.take(np.maximum(codes, 0)))
+            df[column] = pd.Categorical.from_codes(codes, strings)
+        elif series.dtype == object:
+            if all(value is None or isinstance(value, str) for value in series):
+                continue
+            df[column] = series.map(_as_string, na_action="ignore")
+    return df
+
+
+def _dataset_from_row(dct):
+    """Get the key and dataset (with an empty list of exchanges) from an ``ActivityDataset`` row dictionary"""
+    data = dct["data"]
+    COLUMNS = {"code", "database", "location", "name", "type"}
+    data.update({key: dct.get(key) for key in COLUMNS})
+    data["reference product"] = dct.get("product")
+    data["exchanges"] = []
+    return (dct["database"], dct["code"]), data
+
+
+def _exchange_from_row(exc):
+    """Get the edge dataset from an ``ExchangeDataset`` row dictionary"""
+    data = exc["data"]
+    data["type"] = exc["type"]
+    data["input"] = (exc["input_database"], exc["input_code"])
+    data["output"] = (exc["output_database"], exc["output_code"])
+    return data
+
+
+_QUERY_COLUMNS = {
+    "code": ActivityDataset.code,
+    "database": ActivityDataset.database,
+    "location": ActivityDataset.location,
+    "name": ActivityDataset.name,
+    "reference product": ActivityDataset.product,
+    "type": ActivityDataset.type,
+}
+
+
+def _filter_as_sql(filter_):
+    """Translate ``filter_`` into an equivalent condition on ``ActivityDataset`` columns.
+
+    Returns ``None`` if the filter can only be evaluated in Python, e.g. for custom functions, case-insensitive functions, or non-string values. ``location`` is stored as JSON, so only equality and membership are translated for it."""
+    column = _QUERY_COLUMNS.get(getattr(filter_, "key", None))
+    operator_, value = getattr(filter_, "operator", None), getattr(
+        filter_, "value", None
+    )
+    if column is None or operator_ is None:
+        return None
+    is_text = column is not ActivityDataset.location
+
+    if isinstance(value, str):
+        if operator_ in ("==", "is"):
+            return column == value
+        elif operator_ in ("!=", "<>", "not"):
+            return column.is_null() | (column != value)
+        elif not is_text:
+            return None
+        elif operator_ in ("<", "<=", ">", ">="):
+            return query_operators[operator_](column, value)
+        elif operator_ == "has":
+            return fn.instr(column, value) > 0
+        elif operator_ == "in":
+            return fn.instr(value, column) > 0
+    elif (
+        operator_ == "in"
+        and isinstance(value, (list, tuple, set, frozenset))
+        and 0 < len(value) <= _SQL_CHUNK_SIZE
+        and all(isinstance(obj, str) for obj in value)
+    ):
+        return column << list(value)
+    return None
+
+
+def _searchable_datasets(filepath, database):
+    """Iterate over the nodes of ``database`` with the fields needed for the search index.
+
+    Opens its own connection to the SQLite file ``filepath``, so it can be consumed in another thread, even if the current project changes."""
+    location_field = ActivityDataset.location
+    connection = sqlite3.connect(filepath)
+    try:
+        for data, code, location, name, product in connection.execute(
+            "SELECT data, code, location, name, product FROM activitydataset WHERE database = ?",
+            (database,),
+        ):
+            ds = decode_blob(data)
+            ds.update(
+                database=database,
+                code=code,
+                location=location_field.python_value(location)
+                if location is not None
+                else None,
+                name=name,
+            )
+            ds["reference product"] = product
+            yield ds
+    finally:
+        connection.close()
 
 
 class Database(Model):
@@ -153,8 +472,19 @@ class Database(Model):
         return bool(cls.select().where(cls.name == name).count())
 
     @classmethod
-    def set_dirty(cls, name):
+    def set_dirty(cls, name, nodes=None):
+        """Mark database ``name`` as needing to be processed.
+
+        ``nodes`` is an optional iterable of node ids whose edges have changed. If given, the next call to ``process`` can rebuild only the matrix columns of these nodes; otherwise the whole database will be reprocessed."""
         cls.update(dirty=True).where(cls.name == name).execute()
+        if nodes is None:
+            rows = [{"database": name, "node": None}]
+        else:
+            rows = [{"database": name, "node": node} for node in set(nodes)]
+        for index in range(0, len(rows), _SQL_CHUNK_SIZE):
+            ChangeLog.insert_many(
+                rows[index : index + _SQL_CHUNK_SIZE]
+            ).on_conflict_ignore().execute()
 
     ### Generic LCI backend methods
     ###############################
@@ -164,22 +494,145 @@ class Database(Model):
 
         Internal links within the database will be updated to match the new database name, i.e. ``("old name", "some id")`` will be converted to ``("new name", "some id")`` for all exchanges.
 
+        Nodes and edges are copied within SQLite, without loading them in Python. If this database is processed, the processed arrays are copied with the new node ids instead of being rebuilt. The search index is rebuilt from the copied nodes, as it stores database names.
+
         Args:
             * *name* (str): Name of the new database. Must not already exist.
 
         """
         assert not Database.exists(name), ValueError("This database exists")
-        data = self.relabel_data(copy.deepcopy(self.load()), name)
+        if self.backend != "sqlite" or self._filters:
+            # Only copy what ``load`` returns
+            data = self.relabel_data(copy.deepcopy(self.load()), name)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                new_database = self.__class__(name)
+                new_database.register(
+                    format="Brightway2 copy",
+                )
+
+            new_database.write(data)
+            return new_database
+
+        from . import sqlite3_lci_db
+
+        new_database = self.__class__(name)
+        new_database.backend = self.backend
+        new_database.geocollections = self.geocollections
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            new_database = self.__class__(name)
             new_database.register(
                 format="Brightway2 copy",
             )
 
-        new_database.write(data)
+        def columns(model, replace):
+            fields = [
+                field for field in model._meta.sorted_fields if not field.primary_key
+            ]
+            return (
+                ", ".join('"{}"'.format(field.column_name) for field in fields),
+                ", ".join(
+                    replace.get(field.column_name, field.column_name)
+                    for field in fields
+                ),
+            )
+
+        with sqlite3_lci_db.atomic():
+            target, source = columns(ActivityDataset, {"database": "?"})
+            sqlite3_lci_db.execute_sql(
+                """INSERT INTO activitydataset ({}) SELECT {} FROM activitydataset
+                WHERE database = ? ORDER BY id""".format(
+                    target, source
+                ),
+                (name, self.name),
+            )
+            target, source = columns(
+                ExchangeDataset,
+                {
+                    "input_database": """CASE WHEN input_database = ? AND input_code IN (
+                        SELECT code FROM activitydataset WHERE database = ?
+                    ) THEN ? ELSE input_database END""",
+                    "output_database": "?",
+                },
+            )
+            sqlite3_lci_db.execute_sql(
+                """INSERT INTO exchangedataset ({}) SELECT {} FROM exchangedataset
+                WHERE output_database = ? AND output_code IN (
+                    SELECT code FROM activitydataset WHERE database = ?
+                ) ORDER BY id""".format(
+                    target, source
+                ),
+                (self.name, self.name, name, name, self.name, self.name),
+            )
+
+        if self.dirty or not self._copy_processed(new_database):
+            Database.set_dirty(name)
+            new_database.process()
+        new_database.make_searchable(reset=True)
         return new_database
 
+    def _copy_processed(self, new_database):
+        """Write the processed datapackage of ``new_database``, a copy of this database, by changing the node ids in the processed arrays of this database.
+
+        Returns ``False`` if this database doesn't have the needed processed arrays."""
+        fp = self.dirpath_processed() / self.filename_processed()
+        if not fp.exists():
+            return False
+        existing = open_datapackage(fp)
+        try:
+            arrays = {
+                matrix: datapackage_vector_as_array(
+                    existing, clean_datapackage_name(self.name + label)
+                )
+                for matrix, label in _VECTOR_LABELS.items()
+            }
+        except KeyError:
+            return False
+        finally:
+            existing.fs.close()
+
+        def node_ids(database):
+            qs = (
+                ActivityDataset.select(ActivityDataset.id)
+                .where(ActivityDataset.database == database)
+                .order_by(ActivityDataset.id)
+            )
+            return np.array([x for (x,) in qs.tuples()], dtype=np.int64)
+
+        # Nodes were copied in id order, so the new ids are in the same order
+        old_ids, new_ids = node_ids(self.name), node_ids(new_database.name)
+
+        def remap(values):
+            if not len(old_ids):
+                return
+            index = np.searchsorted(old_ids, values).clip(0, len(old_ids) - 1)
+            found = old_ids[index] == values
+            values[found] = new_ids[index[found]]
+
+        fp = new_database.dirpath_processed() / new_database.filename_processed()
+        dp = create_datapackage(
+            fs=processed_filesystem(fp),
+            name=clean_datapackage_name(new_database.name),
+            sum_intra_duplicates=True,
+            sum_inter_duplicates=False,
+        )
+        new_database._add_geomapping_vector(dp)
+        for matrix, array in arrays.items():
+            remap(array["row"])
+            remap(array["col"])
+            add_vector_array(
+                dp,
+                array,
+                matrix,
+                clean_datapackage_name(new_database.name + _VECTOR_LABELS[matrix]),
+            )
+        dp.finalize_serialization()
+
+        new_database.depends = self.depends
+        new_database.dirty = False
+        new_database.save()
+        return True
+
     def dirpath_processed(self):
         return projects.dir / "processed"
 
@@ -193,7 +646,7 @@ class Database(Model):
         return safe_filename(self.name)
 
     def filename_processed(self):
-        return clean_datapackage_name(self.filename + ".zip")
+        return processed_filename(self.filename)
 
     def filepath_processed(self, clean=True):
         if self.dirty and clean:
@@ -201,7 +654,7 @@ class Database(Model):
         return self.dirpath_processed() / self.filename_processed()
 
     def datapackage(self):
-        return load_datapackage(ZipFS(self.filepath_processed()))
+        return datapackage_cache.get(self.filepath_processed())
 
     def find_dependents(self, data=None, ignore=None):
         """Get sorted list of direct dependent databases (databases linked from exchanges).
@@ -251,8 +704,48 @@ class Database(Model):
         return extended
 
     def query(self, *queries):
-        """Search through the database."""
-        return Query(*queries)(self.load())
+        """Search through the database.
+
+        ``Filter`` objects on node columns (``name``, ``reference product``, ``location``, ``type``, ``code``, ``database``) using pre-defined functions and string values are evaluated in SQL. The remaining filters are evaluated in Python, on nodes without their exchanges. Only the nodes in the result are loaded with their exchanges."""
+        conditions, residual = [], []
+        for filter_ in queries:
+            condition = _filter_as_sql(filter_)
+            if condition is None:
+                residual.append(filter_)
+            else:
+                conditions.append(condition)
+
+        qs = self._get_queryset()
+        if conditions:
+            qs = qs.where(*conditions)
+        result = Query(*residual)(
+            _dataset_from_row(dct) for dct in qs.dicts().iterator()
+        )
+        self._add_exchanges(result.result, codes=[key[1] for key in result])
+        return result
+
+    def iter_datasets(self):
+        """Iterate over ``(key, dataset)`` pairs, with the same datasets as ``load()``, without loading the whole database into memory.
+
+        Nodes and exchanges are read with two cursors ordered by node code, and merged."""
+        exchanges = (
+            _exchange_from_row(exc)
+            for exc in ExchangeDataset.select()
+            .where(ExchangeDataset.output_database == self.name)
+            .order_by(ExchangeDataset.output_code)
+            .dicts()
+            .iterator()
+        )
+        exc = next(exchanges, None)
+        qs = self._get_queryset().order_by(ActivityDataset.code)
+        for dct in qs.dicts().iterator():
+            key, ds = _dataset_from_row(dct)
+            while exc is not None and exc["output"][1] < key[1]:
+                exc = next(exchanges, None)
+            while exc is not None and exc["output"][1] == key[1]:
+                ds["exchanges"].append(exc)
+                exc = next(exchanges, None)
+            yield key, ds
 
     def relabel_data(self, data, new_name):
         """Relabel database keys and exchanges.
@@ -333,6 +826,9 @@ class Database(Model):
 
         old_name, new_name = self.name, name
         with sqlite3_lci_db.transaction():
+            # Node ids don't change, so the triggers which update the exchange
+            # node ids would only slow this down
+            self._drop_node_id_triggers()
             ActivityDataset.update(database=new_name).where(
                 ActivityDataset.database == old_name
             ).execute()
@@ -342,6 +838,18 @@ class Database(Model):
             ExchangeDataset.update(output_database=new_name).where(
                 ExchangeDataset.output_database == old_name
             ).execute()
+            # Exchanges which already linked to missing nodes in ``new_name``
+            for side in ("input", "output"):
+                sqlite3_lci_db.execute_sql(
+                    "UPDATE exchangedataset SET {side}_id = {id} WHERE {side}_database = ? AND {side}_id IS NULL".format(
+                        side=side, id=node_id_sql(side, "exchangedataset.")
+                    ),
+                    (new_name,),
+                )
+            self._create_node_id_triggers()
+            ChangeLog.delete().where(ChangeLog.database == old_name).execute()
+        node_cache.invalidate(old_name)
+        node_cache.invalidate(new_name)
         self.name = new_name
         self.save()
         self.process()
@@ -444,23 +952,82 @@ class Database(Model):
         from . import sqlite3_lci_db
 
         with sqlite3_lci_db.transaction():
-            sqlite3_lci_db.execute_sql('DROP INDEX IF EXISTS "activitydataset_key"')
-            sqlite3_lci_db.execute_sql('DROP INDEX IF EXISTS "exchangedataset_input"')
-            sqlite3_lci_db.execute_sql('DROP INDEX IF EXISTS "exchangedataset_output"')
+            for name in itertools.chain(INDICES, OBSOLETE_INDICES):
+                sqlite3_lci_db.execute_sql('DROP INDEX IF EXISTS "{}"'.format(name))
 
     def _add_indices(self):
         from . import sqlite3_lci_db
 
         with sqlite3_lci_db.transaction():
-            sqlite3_lci_db.execute_sql(
-                'CREATE UNIQUE INDEX IF NOT EXISTS "activitydataset_key" ON "activitydataset" ("database", "code")'
-            )
-            sqlite3_lci_db.execute_sql(
-                'CREATE INDEX IF NOT EXISTS "exchangedataset_input" ON "exchangedataset" ("input_database", "input_code")'
-            )
-            sqlite3_lci_db.execute_sql(
-                'CREATE INDEX IF NOT EXISTS "exchangedataset_output" ON "exchangedataset" ("output_database", "output_code")'
-            )
+            self._create_indices()
+
+    def _create_indices(self):
+        from . import sqlite3_lci_db
+
+        for sql in INDICES.values():
+            sqlite3_lci_db.execute_sql(sql)
+
+    def _drop_node_id_triggers(self):
+        from . import sqlite3_lci_db
+
+        for name in NODE_ID_TRIGGERS:
+            sqlite3_lci_db.execute_sql('DROP TRIGGER IF EXISTS "{}"'.format(name))
+
+    def _create_node_id_triggers(self):
+        from . import sqlite3_lci_db
+
+        for sql in NODE_ID_TRIGGERS.values():
+            sqlite3_lci_db.execute_sql(sql)
+
+    def _update_node_ids(self):
+        """Set ``input_id`` and ``output_id`` of all exchanges which link to nodes in this database.
+
+        Used instead of the node id triggers when writing whole databases."""
+        from . import sqlite3_lci_db
+
+        sqlite3_lci_db.execute_sql(
+            "UPDATE exchangedataset SET input_id = {}, output_id = {} WHERE output_database = ?".format(
+                node_id_sql("input", "exchangedataset."),
+                node_id_sql("output", "exchangedataset."),
+            ),
+            (self.name,),
+        )
+        sqlite3_lci_db.execute_sql(
+            "UPDATE exchangedataset SET input_id = {} WHERE input_database = ? AND output_database != ?".format(
+                node_id_sql("input", "exchangedataset.")
+            ),
+            (self.name, self.name),
+        )
+
+    @staticmethod
+    def analyze():
+        """Update the statistics used by the SQLite query planner to choose indices.
+
+        Called after large writes; call manually after many small changes."""
+        from . import sqlite3_lci_db
+
+        sqlite3_lci_db.execute_sql("ANALYZE")
+
+    def _flush_rows(self, model, rows):
+        """Insert ``rows`` (dictionaries of field values) into the table of ``model``.
+
+        Uses a prepared statement with ``executemany``; building a multi-row ``INSERT`` with Peewee is much slower, and limited by the maximum number of parameters per statement."""
+        from . import sqlite3_lci_db
+
+        fields = [field for field in model._meta.sorted_fields if not field.primary_key]
+        sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            model._meta.table_name,
+            ", ".join('"{}"'.format(field.column_name) for field in fields),
+            ", ".join("?" for _ in fields),
+        )
+        sqlite3_lci_db.db.cursor().executemany(
+            sql,
+            (
+                tuple(field.db_value(row.get(field.name)) for field in fields)
+                for row in rows
+            ),
+        )
+        self._rows_written += len(rows)
 
     def _efficient_write_dataset(self, index, key, ds, exchanges, activities):
         for exchange in ds.get("exchanges", []):
@@ -471,13 +1038,8 @@ class Database(Model):
             exchange["output"] = key
             exchanges.append(dict_as_exchangedataset(exchange))
 
-            # Query gets passed as INSERT INTO x VALUES ('?', '?'...)
-            # SQLite3 has a limit of 999 variables,
-            # So 6 fields * 125 is under the limit
-            # Otherwise get the following:
-            # peewee.OperationalError: too many SQL variables
-            if len(exchanges) > 125:
-                ExchangeDataset.insert_many(exchanges).execute()
+            if len(exchanges) >= _WRITE_BATCH_SIZE:
+                self._flush_rows(ExchangeDataset, exchanges)
                 exchanges = []
 
         ds = {k: v for k, v in ds.items() if k != "exchanges"}
@@ -486,59 +1048,120 @@ class Database(Model):
 
         activities.append(dict_as_activitydataset(ds))
 
-        if len(activities) > 125:
-            ActivityDataset.insert_many(activities).execute()
+        if len(activities) >= _WRITE_BATCH_SIZE:
+            self._flush_rows(ActivityDataset, activities)
             activities = []
 
-        if not getattr(config, "is_test", None):
+        if self.pbar is not None:
             self.pbar.update()
 
         return exchanges, activities
 
-    def _efficient_write_many_data(self, data, indices=True):
+    def _efficient_write_many_data(
+        self, data, indices=True, nrows=None, searchable=True
+    ):
+        """Write ``data``, an iterable of ``(key, dataset)`` pairs, in one transaction, and build the search index from the same datasets if ``searchable``.
+
+        ``nrows`` is the number of datasets, if known.
+
+        Returns the sets of geocollections and locations of the written datasets."""
         from . import sqlite3_lci_db
 
-        be_complicated = len(data) >= 100 and indices
-        if be_complicated:
-            self._drop_indices()
-        sqlite3_lci_db.db.autocommit = False
-        try:
-            sqlite3_lci_db.db.begin()
-            self.delete_data(keep_params=True, warn=False)
-            exchanges, activities = [], []
-
-            if not getattr(config, "is_test", None):
-                self.pbar = pyprind.ProgBar(
-                    len(data),
-                    title="Writing activities to SQLite3 database:",
-                    monitor=True,
-                )
+        # Maintaining indices while inserting is slower than rebuilding them,
+        # unless the new data is small compared to what is already stored
+        be_complicated = indices and (
+            nrows is None
+            or (nrows >= 100 and nrows >= ActivityDataset.select().count() // 10)
+        )
+        self._rows_written = 0
+        start = time()
+        geocollections, locations = set(), set()
 
-            for index, (key, ds) in enumerate(data.items()):
-                exchanges, activities = self._efficient_write_dataset(
-                    index, key, ds, exchanges, activities
-                )
+        with sqlite3_lci_db.pragmas(config.bulk_import_pragmas):
+            if be_complicated:
+                self._drop_indices()
+            sqlite3_lci_db.db.autocommit = False
+            search_index, search_writer = None, None
+            try:
+                sqlite3_lci_db.db.begin()
+                self._drop_node_id_triggers()
+                self.delete_data(keep_params=True, warn=False, vacuum=False)
+                if searchable:
+                    search_index = IndexManager(self.filename)
+                    search_writer = search_index.bulk_writer()
+                exchanges, activities = [], []
+
+                if not getattr(config, "is_test", None) and nrows:
+                    self.pbar = pyprind.ProgBar(
+                        nrows,
+                        title="Writing activities to SQLite3 database:",
+                        monitor=True,
+                    )
+                else:
+                    self.pbar = None
+
+                for index, (key, ds) in enumerate(data):
+                    if key[0] != self.name:
+                        raise WrongDatabase(
+                            "Can't write activity {} to database {}".format(
+                                key, self.name
+                            )
+                        )
+                    if ds.get("type", "process") == "process":
+                        geocollections.add(get_geocollection(ds.get("location")))
+                    if ds.get("location"):
+                        locations.add(ds["location"])
+                    if search_writer is not None:
+                        search_writer.add_document(
+                            **search_index._format_dataset(
+                                {**ds, "database": key[0], "code": key[1]}
+                            )
+                        )
+                    exchanges, activities = self._efficient_write_dataset(
+                        index, key, ds, exchanges, activities
+                    )
 
-            if not getattr(config, "is_test", None):
-                print(self.pbar)
+                if self.pbar is not None:
+                    print(self.pbar)
                 del self.pbar
 
-            if activities:
-                ActivityDataset.insert_many(activities).execute()
-            if exchanges:
-                ExchangeDataset.insert_many(exchanges).execute()
-            sqlite3_lci_db.db.commit()
-        except:
-            sqlite3_lci_db.db.rollback()
-            raise
-        finally:
-            sqlite3_lci_db.db.autocommit = True
-            if be_complicated:
-                self._add_indices()
+                if activities:
+                    self._flush_rows(ActivityDataset, activities)
+                if exchanges:
+                    self._flush_rows(ExchangeDataset, exchanges)
+                if be_complicated:
+                    self._create_indices()
+                self._update_node_ids()
+                self._create_node_id_triggers()
+                sqlite3_lci_db.db.commit()
+                if search_writer is not None:
+                    search_writer.commit()
+            except:
+                sqlite3_lci_db.db.rollback()
+                if search_writer is not None:
+                    search_writer.cancel()
+                raise
+            finally:
+                sqlite3_lci_db.db.autocommit = True
+                if be_complicated:
+                    self._add_indices()
+                    self.analyze()
+        sqlite3_lci_db.checkpoint()
+
+        if not getattr(config, "is_test", None):
+            elapsed = time() - start
+            print(
+                "Wrote {} rows in {:.1f} seconds ({:.0f} rows/second)".format(
+                    self._rows_written,
+                    elapsed,
+                    self._rows_written / elapsed if elapsed else 0,
+                )
+            )
+        return geocollections, locations
 
     # Public API
 
-    def write(self, data, process=True):
+    def write(self, data, process=True, index_in_background=False):
         """Write ``data`` to database.
 
         ``data`` must be a dictionary of the form::
@@ -547,45 +1170,69 @@ class Database(Model):
                 ('database name', 'dataset code'): {dataset}
             }
 
+        ``data`` can also be an iterable of ``(key, dataset)`` pairs, e.g. a generator. These datasets are written in chunks and are never all held in memory at the same time.
+
+        If ``index_in_background``, the search index is built in a background thread after the data is committed, instead of while writing. Searches wait for this thread to finish.
+
         Writing a database will first deletes all existing data."""
         if self.backend == "iotable":
             process = False
 
-        wrong_database = {key[0] for key in data}.difference({self.name})
-        if wrong_database:
-            raise WrongDatabase(
-                "Can't write activities in databases {} to database {}".format(
-                    wrong_database, self.name
+        if isinstance(data, Mapping):
+            wrong_database = {key[0] for key in data}.difference({self.name})
+            if wrong_database:
+                raise WrongDatabase(
+                    "Can't write activities in databases {} to database {}".format(
+                        wrong_database, self.name
+                    )
                 )
-            )
+            nrows = len(data)
+            data = iter(data.items())
+        else:
+            nrows = None
+            data = iter(data)
+
+        first = next(data, None)
+        if first is not None:
+            try:
+                geocollections, locations = self._efficient_write_many_data(
+                    itertools.chain([first], data),
+                    nrows=nrows,
+                    searchable=not index_in_background,
+                )
+            except:
+                self.delete_data()
+                raise
+            self.searchable = not index_in_background
+        else:
+            geocollections, locations = set(), set()
 
-        geocollections = {
-            get_geocollection(x.get("location"))
-            for x in data.values()
-            if x.get("type", "process") == "process"
-        }
         if None in geocollections:
             print(
                 "Not able to determine geocollections for all datasets. This database is not ready for regionalization."
             )
             geocollections.discard(None)
         self.geocollections = sorted(geocollections)
+        geomapping.add(locations)
 
-        geomapping.add({x["location"] for x in data.values() if x.get("location")})
-        if data:
-            try:
-                self._efficient_write_many_data(data)
-            except:
-                self.delete_data()
-                raise
-
+        # Node-level changes don't apply any more; rebuild everything
+        ChangeLog.delete().where(ChangeLog.database == self.name).execute()
+        ChangeLog.create(database=self.name, node=None)
         self.save()
-        self.make_searchable(reset=True)
+        if first is None or index_in_background:
+            self.make_searchable(reset=True, background=index_in_background)
 
         if process:
             self.process()
 
-    def write_exchanges(self, technosphere, biosphere, dependents):
+    def write_exchanges(
+        self,
+        technosphere,
+        biosphere,
+        dependents,
+        chunksize=DEFAULT_CHUNKSIZE,
+        progress=True,
+    ):
         """
 
         Write IO data directly to processed arrays.
@@ -593,7 +1240,13 @@ class Database(Model):
         Product data is stored in SQLite as normal activities.
         Exchange data is written directly to NumPy structured arrays.
 
-        Technosphere and biosphere data has format ``(row id, col id, value, flip)``.
+        Technosphere and biosphere data can be given as:
+
+        * A dictionary of arguments to ``Datapackage.add_persistent_vector``, i.e. ``indices_array``, ``data_array``, and ``flip_array``.
+        * An iterable of dictionaries with the format ``{"row": row id, "col": col id, "amount": value, "flip": flip}``. All rows are loaded into memory.
+        * An iterable of blocks, e.g. a generator. Blocks can be dictionaries of arrays, pandas ``DataFrame``, or NumPy structured arrays with ``row``, ``col``, ``amount``, and optionally ``flip`` columns, or paths to ``.npy`` or Parquet files with these columns. See ``bw2data.datapackages.iterate_vector_blocks``.
+
+        Blocks are appended to the arrays on disk in chunks of at most ``chunksize`` rows, so tables larger than the available memory can be written. If ``progress``, print the number of edges written and the throughput while writing.
 
         """
         if self.backend != "iotable":
@@ -602,7 +1255,7 @@ class Database(Model):
 
         # create empty datapackage
         dp = create_datapackage(
-            fs=ZipFS(str(self.filepath_processed()), write=True),
+            fs=processed_filesystem(self.filepath_processed()),
             name=clean_datapackage_name(self.name),
             sum_intra_duplicates=True,
             sum_inter_duplicates=False,
@@ -625,43 +1278,11 @@ class Database(Model):
             nrows=len(self),
         )
 
-        print("Adding technosphere matrix")
-        # if technosphere is a dictionary pass it's keys & values
-        if isinstance(technosphere, dict):
-            dp.add_persistent_vector(
-                matrix="technosphere_matrix",
-                name=clean_datapackage_name(self.name + " technosphere matrix"),
-                **technosphere,
-            )
-        # if it is an iterable, convert to right format
-        elif hasattr(technosphere, "__iter__"):
-            dp.add_persistent_vector_from_iterator(
-                matrix="technosphere_matrix",
-                name=clean_datapackage_name(self.name + " technosphere matrix"),
-                dict_iterator=technosphere,
-            )
-        else:
-            raise Exception(
-                f"Error: Unsupported technosphere type: {type(technosphere)}"
-            )
-
-        print("Adding biosphere matrix")
-        # if biosphere is a dictionary pass it's keys & values
-        if isinstance(biosphere, dict):
-            dp.add_persistent_vector(
-                matrix="biosphere_matrix",
-                name=clean_datapackage_name(self.name + " biosphere matrix"),
-                **biosphere,
-            )
-        # if it is an iterable, convert to right format
-        elif hasattr(biosphere, "__iter__"):
-            dp.add_persistent_vector_from_iterator(
-                matrix="biosphere_matrix",
-                name=clean_datapackage_name(self.name + " biosphere matrix"),
-                dict_iterator=biosphere,
-            )
-        else:
-            raise Exception(f"Error: Unsupported biosphere type: {type(technosphere)}")
+        for label, data in (("technosphere", technosphere), ("biosphere", biosphere)):
+            print("Adding {} matrix".format(label))
+            name = clean_datapackage_name("{} {} matrix".format(self.name, label))
+            self._add_io_vector(dp, label, name, data, chunksize, progress)
+            add_column_index(dp, name)
 
         # finalize
         print("Finalizing serialization")
@@ -670,43 +1291,96 @@ class Database(Model):
         self.depends = sorted(set(dependents).difference({self.name}))
         self.save()
 
+    def _add_io_vector(self, dp, label, name, data, chunksize, progress):
+        """Add the ``label`` matrix data of ``write_exchanges`` to the datapackage ``dp``, as the persistent vector ``name``."""
+        matrix = "{}_matrix".format(label)
+
+        if isinstance(data, (str, os.PathLike, np.ndarray, pd.DataFrame)) or (
+            isinstance(data, dict) and "row" in data
+        ):
+            # A single block
+            data = [data]
+        elif isinstance(data, dict):
+            dp.add_persistent_vector(matrix=matrix, name=name, **data)
+            return
+        elif not hasattr(data, "__iter__"):
+            raise ValueError("Unsupported {} type: {}".format(label, type(data)))
+
+        iterator = iter(data)
+        first = next(iterator, None)
+        if isinstance(first, Mapping) and np.ndim(first.get("row")) == 0:
+            dp.add_persistent_vector_from_iterator(
+                matrix=matrix,
+                name=name,
+                dict_iterator=itertools.chain([first], iterator),
+            )
+            return
+
+        start, last_report = time(), time()
+
+        def report(nrows, elapsed):
+            nonlocal last_report
+            if progress and time() - last_report >= 1:
+                last_report = time()
+                print(
+                    "{:,} {} edges written ({:,.0f} edges/s)".format(
+                        nrows, label, nrows / elapsed
+                    )
+                )
+
+        nrows = add_persistent_vector_from_blocks(
+            dp,
+            blocks=itertools.chain([first], iterator) if first is not None else [],
+            matrix=matrix,
+            name=name,
+            chunksize=chunksize,
+            progress=report,
+        )
+        elapsed = time() - start
+        print(
+            "Wrote {:,} {} edges in {:.1f} seconds ({:,.0f} edges/s)".format(
+                nrows, label, elapsed, nrows / elapsed if elapsed else 0
+            )
+        )
+
     def load(self, *args, **kwargs):
         # Should not be used, in general; relatively slow
-        def act_formatter(dct):
-            data = dct["data"]
-            COLUMNS = {"code", "database", "location", "name", "type"}
-            data.update({key: dct.get(key) for key in COLUMNS})
-            data["reference product"] = dct.get("product")
-            data["exchanges"] = []
-            return (dct["database"], dct["code"]), data
-
         activities = dict(
-            act_formatter(dct) for dct in self._get_queryset().dicts().iterator()
+            _dataset_from_row(dct) for dct in self._get_queryset().dicts().iterator()
         )
+        self._add_exchanges(activities)
+        return activities
 
-        exchange_qs = (
-            ExchangeDataset.select()
-            .where(ExchangeDataset.output_database == self.name)
-            .dicts()
-            .iterator()
-        )
+    def _add_exchanges(self, activities, codes=None):
+        """Append the exchanges of this database to the ``exchanges`` lists in ``activities``.
 
-        def exc_formatter(exc):
-            data = exc["data"]
-            data["type"] = exc["type"]
-            data["input"] = (exc["input_database"], exc["input_code"])
-            data["output"] = (exc["output_database"], exc["output_code"])
-            return data
+        Only query the exchanges of nodes with the given ``codes``, if given."""
+        if codes is None:
+            querysets = [
+                ExchangeDataset.select().where(
+                    ExchangeDataset.output_database == self.name
+                )
+            ]
+        else:
+            codes = sorted(codes)
+            querysets = [
+                ExchangeDataset.select().where(
+                    ExchangeDataset.output_database == self.name,
+                    ExchangeDataset.output_code
+                    << codes[index : index + _SQL_CHUNK_SIZE],
+                )
+                for index in range(0, len(codes), _SQL_CHUNK_SIZE)
+            ]
 
-        for exc in exchange_qs:
-            exc = exc_formatter(exc)
-            try:
-                activities[exc["output"]]["exchanges"].append(exc)
-            except KeyError:
-                # This exchange not in the reduced set of activities returned
-                # by _get_queryset
-                pass
-        return activities
+        for qs in querysets:
+            for exc in qs.dicts().iterator():
+                exc = _exchange_from_row(exc)
+                try:
+                    activities[exc["output"]]["exchanges"].append(exc)
+                except KeyError:
+                    # This exchange not in the reduced set of activities returned
+                    # by _get_queryset
+                    pass
 
     def new_activity(self, code, **kwargs):
         return self.new_node(code, **kwargs)
@@ -737,17 +1411,28 @@ class Database(Model):
         obj.update(kwargs)
         return obj
 
-    def make_searchable(self, reset=False):
+    def make_searchable(self, reset=False, background=False):
+        """Build the search index for this database.
+
+        If ``background``, the index is built in a background thread, and this method returns immediately. Searches wait for this thread to finish. If the background build fails, searches raise its error until the index is built again with this method."""
+        from . import sqlite3_lci_db
+
         if not self.id:
             raise UnknownObject(
                 "This `Database` instance is not yet saved to the SQLite database"
             )
 
-        if self.searchable and not reset:
+        # Rebuild indices whose background build failed
+        if self.searchable and not reset and IndexManager(self.filename).error is None:
             print("This database is already searchable")
             return
         IndexManager(self.filename).delete_database()
-        IndexManager(self.filename).add_datasets(self)
+        if background:
+            IndexManager(self.filename).add_datasets_in_background(
+                _searchable_datasets(sqlite3_lci_db.db.database, self.name)
+            )
+        else:
+            IndexManager(self.filename).add_datasets(self)
         self.searchable = True
         self.save()
 
@@ -760,16 +1445,21 @@ class Database(Model):
         self.delete_data()
         super().delete_instance()
 
-    def delete_data(self, keep_params=False, warn=True):
-        """Delete all data from SQLite database and Whoosh index"""
+    def delete_data(self, keep_params=False, warn=True, vacuum=True):
+        """Delete all data from SQLite database and Whoosh index.
+
+        Set ``vacuum`` to ``False`` when calling this within a transaction."""
         from . import sqlite3_lci_db
 
-        vacuum_needed = len(self) > 500
+        vacuum_needed = vacuum and len(self) > 500
 
-        ActivityDataset.delete().where(ActivityDataset.database == self.name).execute()
+        # Delete exchanges first, so the node id triggers don't update them
         ExchangeDataset.delete().where(
             ExchangeDataset.output_database == self.name
         ).execute()
+        ActivityDataset.delete().where(ActivityDataset.database == self.name).execute()
+        ChangeLog.delete().where(ChangeLog.database == self.name).execute()
+        node_cache.invalidate(self.name)
         IndexManager(self.filename).delete_database()
 
         if not keep_params:
@@ -800,19 +1490,22 @@ class Database(Model):
         if vacuum_needed:
             sqlite3_lci_db.vacuum()
 
-    def exchange_data_iterator(self, sql, dependents, flip=False):
+    def exchange_data_iterator(self, sql, dependents, flip=False, params=None):
         """Iterate over exchanges and format for ``bw_processing`` arrays.
 
         ``dependents`` is a set of dependent database names.
 
         ``flip`` means flip the numeric sign; see ``bw_processing`` docs.
 
-        Uses raw sqlite3 to retrieve data for ~2x speed boost."""
+        ``params`` are the SQL query parameters; default is the database name.
+
+        ``sql`` must return the columns ``data, row, col, input_database, input_code, output_database, output_code``, optionally followed by the numeric ``ExchangeDataset`` columns ``amount, uncertainty_type, loc, scale, shape, minimum, maximum, negative``. If ``amount`` is given, the ``data`` blob isn't deserialized.
+
+        Uses the raw sqlite3 read connection of the current thread to retrieve data for ~2x speed boost."""
         from . import sqlite3_lci_db
 
-        connection = sqlite3.connect(sqlite3_lci_db._filepath)
-        cursor = connection.cursor()
-        for line in cursor.execute(sql, (self.name,)):
+        cursor = sqlite3_lci_db.read_connection().cursor()
+        for line in cursor.execute(sql, params or (self.name,)):
             (
                 data,
                 row,
@@ -821,12 +1514,16 @@ class Database(Model):
                 input_code,
                 output_database,
                 output_code,
-            ) = line
+            ) = line[:7]
             # Modify ``dependents`` in place
             if input_database != output_database:
                 dependents.add(input_database)
-            data = pickle.loads(bytes(data))
-            check_exchange_amount(data)
+            if len(line) > 7 and line[7] is not None:
+                data = _columns_as_uncertainty_dict(*line[7:])
+            else:
+                data = decode_blob(data)
+                check_exchange_amount(data)
+                data = as_uncertainty_dict(data)
             if row is None or col is None:
                 raise UnknownObject(
                     (
@@ -838,55 +1535,150 @@ class Database(Model):
                     )
                 )
             yield {
-                **as_uncertainty_dict(data),
+                **data,
                 "row": row,
                 "col": col,
                 "flip": flip,
             }
 
-    @classmethod
-    def clean_all(cls):
-        for db in cls.select().where(cls.dirty == True):
-            db.process()
+    def _exchange_sql(
+        self, types, nodes=None, columns=_EXCHANGE_DICT_COLUMNS, condition=None
+    ):
+        """Build the SQL to retrieve ``columns`` for exchanges of ``types``, optionally limited to the output node ids ``nodes`` and to rows matching the SQL ``condition``.
+
+        Returns ``(sql, params)``."""
+        sql = _EXCHANGE_SQL.format(columns=columns, types=_quoted(types))
+        params = [self.name]
+        if condition is not None:
+            sql += "\n        AND ({})".format(condition)
+        if nodes is not None:
+            placeholders = ", ".join("?" for _ in nodes)
+            sql += (
+                "\n        AND (e.output_id IN ({0})"
+                "\n        OR e.output_id IS NULL AND e.output_code IN"
+                " (SELECT code FROM activitydataset WHERE id IN ({0})))"
+            ).format(placeholders)
+            params.extend(nodes)
+            params.extend(nodes)
+        return sql, params
+
+    def _node_chunks(self, nodes):
+        if nodes is None:
+            return [None]
+        nodes = sorted(nodes)
+        return [
+            nodes[index : index + _SQL_CHUNK_SIZE]
+            for index in range(0, len(nodes), _SQL_CHUNK_SIZE)
+        ]
 
-    def process(self, csv=False):
-        """Create structured arrays for the technosphere and biosphere matrices.
+    def _exchange_dicts(
+        self, types, dependents, flip=False, nodes=None, condition=None
+    ):
+        """Iterate over ``bw_processing`` dictionaries for exchanges of ``types``.
 
-        Uses ``bw_processing`` for array creation and metadata serialization.
+        If ``nodes`` is given, only exchanges consumed by these node ids are returned. If ``condition`` is given, only exchanges matching this SQL condition are returned."""
+        for chunk in self._node_chunks(nodes):
+            sql, params = self._exchange_sql(types, chunk, condition=condition)
+            yield from self.exchange_data_iterator(sql, dependents, flip, params)
 
-        Also creates a ``geomapping`` array, linking activities to locations. Used for regionalized calculations.
+    def _exchange_array(
+        self, types, flip_types=(), nodes=None, implicit_production=False
+    ):
+        """Build a combined vector array (with dtype ``VECTOR_DTYPE``) for exchanges of ``types``.
 
-        Use a raw SQLite3 cursor instead of Peewee for a ~2 times speed advantage.
+        Exchanges of ``flip_types`` have their numeric sign flipped. If ``nodes`` is given, only exchanges consumed by these node ids are included. If ``implicit_production`` is ``True``, also add implicit production exchanges.
 
-        """
-        if self.backend == "iotable":
-            self.dirty = False
-            self.save()
-            return
+        Exchanges with populated numeric columns are fetched in batches and copied directly into a preallocated array. Only the remaining exchanges (with data which can't be stored in these columns, or invalid exchanges which raise errors) are deserialized and formatted one by one."""
+        from . import sqlite3_lci_db
 
-        # Get number of exchanges and processes to set
-        # initial Numpy array size (still have to include)
-        # implicit production exchanges
-        dependents = set()
+        cursor = sqlite3_lci_db.read_connection().cursor()
+        try:
+            if nodes is None:
+                # Upper bound, as this count doesn't check if the nodes exist
+                (size,) = cursor.execute(
+                    "SELECT COUNT(*) FROM exchangedataset WHERE output_database = ? AND type IN ({})".format(
+                        _quoted(types)
+                    ),
+                    (self.name,),
+                ).fetchone()
+            else:
+                size = 0
+            array, filled = np.zeros(size, dtype=VECTOR_DTYPE), 0
+
+            columns = _EXCHANGE_ARRAY_COLUMNS.format(flip_types=_quoted(flip_types))
+            for chunk in self._node_chunks(nodes):
+                sql, params = self._exchange_sql(
+                    types, chunk, columns=columns, condition=_COMPLETE_EXCHANGE
+                )
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(_FETCH_BATCH_SIZE)
+                    if not rows:
+                        break
+                    array, filled = _append_rows(array, filled, rows)
+        finally:
+            cursor.close()
+
+        rows = []
+        for flip in (True, False):
+            selected = [x for x in types if (x in flip_types) == flip]
+            if selected:
+                rows.extend(
+                    dictionary_formatter(row)
+                    for row in self._exchange_dicts(
+                        selected,
+                        set(),
+                        flip=flip,
+                        nodes=nodes,
+                        condition="NOT ({})".format(_COMPLETE_EXCHANGE),
+                    )
+                )
+        if implicit_production:
+            rows.extend(
+                dictionary_formatter(row) for row in self._implicit_production(nodes)
+            )
+        if rows:
+            array, filled = _append_rows(array, filled, rows)
+        return array[:filled]
 
-        # Create geomapping array, from dataset interger ids to locations
+    def _implicit_production(self, nodes=None):
+        """Iterate over production dictionaries for ``process`` nodes without explicit production edges.
+
+        If ``nodes`` is given, only consider these node ids."""
+
+        def queryset(ids=None):
+            qs = ActivityDataset.select(ActivityDataset.id).where(
+                # Get correct database name
+                ActivityDataset.database == self.name,
+                # Only consider `process` type activities
+                ActivityDataset.type << ("process", None),
+                # But exclude activities that already have production exchanges
+                ~(
+                    ActivityDataset.code
+                    << ExchangeDataset.select(
+                        # Get codes to exclude
+                        ExchangeDataset.output_code
+                    ).where(
+                        ExchangeDataset.output_database == self.name,
+                        ExchangeDataset.type << ("production", "generic production"),
+                    )
+                ),
+            )
+            if ids is not None:
+                qs = qs.where(ActivityDataset.id << ids)
+            return qs.tuples()
+
+        for chunk in self._node_chunks(nodes):
+            for (id_,) in queryset(chunk):
+                yield {"row": id_, "amount": 1}
+
+    def _add_geomapping_vector(self, dp):
+        """Add geomapping array, from dataset integer ids to locations"""
         inv_mapping_qs = ActivityDataset.select(
             ActivityDataset.id, ActivityDataset.location
         ).where(
             ActivityDataset.database == self.name, ActivityDataset.type == "process"
         )
-
-        # self.filepath_processed checks if data is dirty,
-        # and processes if it is. This causes an infinite loop.
-        # So we construct the filepath ourselves.
-        fp = str(self.dirpath_processed() / self.filename_processed())
-
-        dp = create_datapackage(
-            fs=ZipFS(fp, write=True),
-            name=clean_datapackage_name(self.name),
-            sum_intra_duplicates=True,
-            sum_inter_duplicates=False,
-        )
         dp.add_persistent_vector_from_iterator(
             matrix="inv_geomapping_matrix",
             name=clean_datapackage_name(self.name + " inventory geomapping matrix"),
@@ -903,69 +1695,139 @@ class Database(Model):
             nrows=inv_mapping_qs.count(),
         )
 
-        BIOSPHERE_SQL = """SELECT e.data, a.id, b.id, e.input_database, e.input_code, e.output_database, e.output_code
-                FROM exchangedataset as e
-                LEFT JOIN activitydataset as a ON a.code == e.input_code AND a.database == e.input_database
-                LEFT JOIN activitydataset as b ON b.code == e.output_code AND b.database == e.output_database
-                WHERE e.output_database = ?
-                AND e.type = 'biosphere'
-        """
-        dp.add_persistent_vector_from_iterator(
-            matrix="biosphere_matrix",
-            name=clean_datapackage_name(self.name + " biosphere matrix"),
-            dict_iterator=self.exchange_data_iterator(BIOSPHERE_SQL, dependents),
-        )
+    def _changed_nodes(self):
+        """Get the set of node ids whose matrix columns need to be rebuilt.
 
-        # Figure out when the production exchanges are implicit
-        implicit_production = (
-            {"row": get_id((self.name, x[0])), "amount": 1}
-            # Get all codes
-            for x in ActivityDataset.select(ActivityDataset.code)
-            .where(
-                # Get correct database name
-                ActivityDataset.database == self.name,
-                # Only consider `process` type activities
-                ActivityDataset.type << ("process", None),
-                # But exclude activities that already have production exchanges
-                ~(
-                    ActivityDataset.code
-                    << ExchangeDataset.select(
-                        # Get codes to exclude
-                        ExchangeDataset.output_code
-                    ).where(
-                        ExchangeDataset.output_database == self.name,
-                        ExchangeDataset.type << ("production", "generic production"),
-                    )
-                ),
-            )
+        Returns ``None`` if the whole database needs to be reprocessed, either because there is no existing processed data, the changes were not tracked at the node level, or too many nodes changed."""
+        if not (self.dirpath_processed() / self.filename_processed()).exists():
+            return None
+        nodes = [
+            node
+            for (node,) in ChangeLog.select(ChangeLog.node)
+            .where(ChangeLog.database == self.name)
             .tuples()
+        ]
+        if not nodes or None in nodes:
+            return None
+        number = (
+            ActivityDataset.select()
+            .where(ActivityDataset.database == self.name)
+            .count()
         )
+        if len(nodes) > _INCREMENTAL_PROCESSING_LIMIT * number:
+            return None
+        return set(nodes)
+
+    def _find_processed_dependents(self):
+        """Get the set of other databases linked from exchanges which are used in processing"""
+        from . import sqlite3_lci_db
+
+        types = (
+            _BIOSPHERE_TYPES
+            + _TECHNOSPHERE_POSITIVE_TYPES
+            + _TECHNOSPHERE_NEGATIVE_TYPES
+        )
+        sql = """SELECT DISTINCT input_database FROM exchangedataset
+            WHERE output_database = ?
+            AND input_database != ?
+            AND type IN ({})""".format(
+            ", ".join("?" for _ in types)
+        )
+        return {
+            row[0]
+            for row in sqlite3_lci_db.execute_sql(sql, (self.name, self.name) + types)
+        }
+
+    @classmethod
+    def clean_all(cls, processes=None):
+        """Process all dirty databases.
+
+        If ``processes`` is given, build the datapackages in a pool of this many worker processes. Database metadata is still saved in this process."""
+        dirty = list(cls.select().where(cls.dirty == True))
+        if not processes:
+            for db in dirty:
+                db.process()
+            return
+
+        from ..parallel import process_in_parallel
+
+        for db in dirty:
+            if db.backend == "iotable":
+                db.process()
+        for _, name, dependents in process_in_parallel(
+            [("database", db.name) for db in dirty if db.backend != "iotable"],
+            processes,
+        ):
+            cls(name)._finish_processing(dependents)
+
+    def process(self, csv=False):
+        """Create structured arrays for the technosphere and biosphere matrices.
+
+        Uses ``bw_processing`` for array creation and metadata serialization.
+
+        Also creates a ``geomapping`` array, linking activities to locations. Used for regionalized calculations.
+
+        Use a raw SQLite3 cursor instead of Peewee for a ~2 times speed advantage.
+
+        If only some nodes were changed since the last time this database was processed (e.g. via ``Activity.save`` or ``Exchange.save``), only the matrix columns of these nodes are rebuilt, and the rest of the existing processed arrays are reused. Otherwise, or if ``csv`` is ``True``, the whole database is reprocessed.
 
-        TECHNOSPHERE_POSITIVE_SQL = """SELECT e.data, a.id, b.id, e.input_database, e.input_code, e.output_database, e.output_code
-                FROM exchangedataset as e
-                LEFT JOIN activitydataset as a ON a.code == e.input_code AND a.database == e.input_database
-                LEFT JOIN activitydataset as b ON b.code == e.output_code AND b.database == e.output_database
-                WHERE e.output_database = ?
-                AND e.type IN ('production', 'substitution', 'generic production')
-        """
-        TECHNOSPHERE_NEGATIVE_SQL = """SELECT e.data, a.id, b.id, e.input_database, e.input_code, e.output_database, e.output_code
-                FROM exchangedataset as e
-                LEFT JOIN activitydataset as a ON a.code == e.input_code AND a.database == e.input_database
-                LEFT JOIN activitydataset as b ON b.code == e.output_code AND b.database == e.output_database
-                WHERE e.output_database = ?
-                AND e.type IN ('technosphere', 'generic consumption')
         """
+        if self.backend == "iotable":
+            self.dirty = False
+            self.save()
+            return
 
-        dp.add_persistent_vector_from_iterator(
-            matrix="technosphere_matrix",
-            name=clean_datapackage_name(self.name + " technosphere matrix"),
-            dict_iterator=itertools.chain(
-                self.exchange_data_iterator(
-                    TECHNOSPHERE_NEGATIVE_SQL, dependents, flip=True
-                ),
-                self.exchange_data_iterator(TECHNOSPHERE_POSITIVE_SQL, dependents),
-                implicit_production,
+        self._finish_processing(self._write_processed(csv=csv))
+
+    def _write_processed(self, csv=False):
+        """Write the processed datapackage without modifying any SQLite data, so this can be run in a worker process with a read-only connection.
+
+        Returns the set of dependent database names."""
+        changed = None if csv else self._changed_nodes()
+        if changed is None:
+            return self._process_all(csv=csv)
+        else:
+            return self._process_changed(changed)
+
+    def _finish_processing(self, dependents):
+        """Save database metadata after the processed datapackage was written"""
+        # Remove any possibility of datetime being in different timezone or otherwise different than filesystem
+        self.dirty = False
+        self.depends = sorted(dependents)
+        self.save()
+        ChangeLog.delete().where(ChangeLog.database == self.name).execute()
+
+    def _process_all(self, csv=False):
+        """Build the complete datapackage for this database.
+
+        Returns the set of dependent database names."""
+        # self.filepath_processed checks if data is dirty,
+        # and processes if it is. This causes an infinite loop.
+        # So we construct the filepath ourselves.
+        fp = self.dirpath_processed() / self.filename_processed()
+
+        dp = create_datapackage(
+            fs=processed_filesystem(fp),
+            name=clean_datapackage_name(self.name),
+            sum_intra_duplicates=True,
+            sum_inter_duplicates=False,
+        )
+        self._add_geomapping_vector(dp)
+        add_vector_array(
+            dp,
+            self._exchange_array(_BIOSPHERE_TYPES),
+            "biosphere_matrix",
+            clean_datapackage_name(self.name + " biosphere matrix"),
+        )
+        add_vector_array(
+            dp,
+            self._exchange_array(
+                _TECHNOSPHERE_NEGATIVE_TYPES + _TECHNOSPHERE_POSITIVE_TYPES,
+                flip_types=_TECHNOSPHERE_NEGATIVE_TYPES,
+                implicit_production=True,
             ),
+            "technosphere_matrix",
+            clean_datapackage_name(self.name + " technosphere matrix"),
         )
         if csv:
             df = pd.DataFrame([get_csv_data_dict(ds) for ds in self])
@@ -982,11 +1844,57 @@ class Database(Model):
             )
 
         dp.finalize_serialization()
+        return self._find_processed_dependents()
 
-        # Remove any possibility of datetime being in different timezone or otherwise different than filesystem
-        self.dirty = False
-        self.depends = sorted(dependents)
-        self.save()
+    def _process_changed(self, nodes):
+        """Rebuild only the matrix columns for the node ids ``nodes``, reusing the rest of the existing datapackage.
+
+        Falls back to ``_process_all`` if the existing datapackage doesn't have the expected resources.
+
+        Returns the set of dependent database names."""
+        fp = self.dirpath_processed() / self.filename_processed()
+        biosphere_name = clean_datapackage_name(self.name + " biosphere matrix")
+        technosphere_name = clean_datapackage_name(self.name + " technosphere matrix")
+
+        existing = open_datapackage(fp)
+        try:
+            biosphere = datapackage_vector_as_array(existing, biosphere_name)
+            technosphere = datapackage_vector_as_array(existing, technosphere_name)
+        except KeyError:
+            return self._process_all()
+        finally:
+            existing.fs.close()
+
+        ids = np.array(sorted(nodes))
+        biosphere = np.hstack(
+            [
+                biosphere[~np.isin(biosphere["col"], ids)],
+                self._exchange_array(_BIOSPHERE_TYPES, nodes=nodes),
+            ]
+        )
+        technosphere = np.hstack(
+            [
+                technosphere[~np.isin(technosphere["col"], ids)],
+                self._exchange_array(
+                    _TECHNOSPHERE_NEGATIVE_TYPES + _TECHNOSPHERE_POSITIVE_TYPES,
+                    flip_types=_TECHNOSPHERE_NEGATIVE_TYPES,
+                    nodes=nodes,
+                    implicit_production=True,
+                ),
+            ]
+        )
+
+        dp = create_datapackage(
+            fs=processed_filesystem(fp),
+            name=clean_datapackage_name(self.name),
+            sum_intra_duplicates=True,
+            sum_inter_duplicates=False,
+        )
+        self._add_geomapping_vector(dp)
+        add_vector_array(dp, biosphere, "biosphere_matrix", biosphere_name)
+        add_vector_array(dp, technosphere, "technosphere_matrix", technosphere_name)
+        dp.finalize_serialization()
+        return self._find_processed_dependents()
 
     def search(self, string, **kwargs):
         """Search this database for ``string``.
@@ -1150,7 +2058,7 @@ class Database(Model):
             * ``edge``: The edge, including attributes of the source node
             * ``row``: The current row dict being modified.
 
-        The functions in ``formatters`` don't need to return anything, they modify ``row`` in place.
+        The functions in ``formatters`` don't need to return anything, they modify ``row`` in place. Without ``formatters``, the DataFrame is built directly from SQL queries, which is much faster than building the Wurst documents.
 
         Returns a pandas ``DataFrame``.
 
@@ -1160,9 +2068,105 @@ class Database(Model):
                 categorical=categorical, formatters=formatters
             )
         elif self.backend == "iotable":
-            return self._iotable_edges_to_dataframe()
+            return self._iotable_edges_to_dataframe(categorical=categorical)
 
-    def _iotable_edges_to_dataframe(self) -> pd.DataFrame:
+    def iter_edges_dataframes(self, chunksize: int = 100000, categorical: bool = True):
+        """Iterate over pandas DataFrames of at most ``chunksize`` database exchanges, with the same columns as ``edges_to_dataframe``.
+
+        Only one chunk of edges is held in memory at a time, together with the attributes of the nodes linked by the edges. If ``categorical``, string columns are pandas ``Categorical`` with the same categories in all DataFrames, so the chunks can be concatenated or written to the same file without changing their dtypes.
+
+        Formatters are not supported; use ``edges_to_dataframe`` instead."""
+        if self.backend == "sqlite":
+            return self._sqlite_edges_dataframes(chunksize, categorical)
+        elif self.backend == "iotable":
+            return self._iotable_edges_dataframes(chunksize, categorical)
+        raise ValueError("Unsupported backend {}".format(self.backend))
+
+    def iter_nodes_dataframes(
+        self,
+        chunksize: int = 100000,
+        columns: Optional[List[str]] = None,
+        categorical: bool = True,
+    ):
+        """Iterate over pandas DataFrames of at most ``chunksize`` database nodes, ordered by id.
+
+        Unlike ``nodes_to_dataframe``, all DataFrames have the same ``columns``: the node attributes ``id``, ``database``, ``code``, ``name``, ``reference product``, ``location``, ``unit``, and ``type`` by default.
+
+        If ``categorical``, the ``database``, ``location`` and ``type`` columns are pandas ``Categorical`` with the same categories in all DataFrames."""
+        columns = columns or _NODE_DATAFRAME_COLUMNS
+        dtypes = {}
+        if categorical:
+            for column in _NODE_CATEGORICAL_COLUMNS:
+                if column not in columns:
+                    continue
+                field = getattr(ActivityDataset, column)
+                qs = self._get_queryset().select(field).distinct().order_by()
+                values = np.array([value for (value,) in qs.tuples()], dtype=object)
+                dtypes[column] = pd.CategoricalDtype(pd.factorize(values, sort=True)[1])
+
+        last_id = 0
+        while True:
+            qs = (
+                self._get_queryset()
+                .where(ActivityDataset.id > last_id)
+                .order_by(ActivityDataset.id)
+                .limit(chunksize)
+            )
+            nodes = [self.node_class(ds) for ds in qs]
+            if not nodes:
+                break
+            last_id = nodes[-1].id
+            df = pd.DataFrame(
+                [{field: obj.get(field) for field in columns} for obj in nodes],
+                columns=columns,
+            )
+            for column, dtype in dtypes.items():
+                df[column] = df[column].astype(dtype)
+            yield df
+
+    def to_parquet(self, filepath, nodes: bool = False, chunksize: int = 100000):
+        """Write the database exchanges (or nodes, if ``nodes``) to the Parquet file ``filepath``.
+
+        The DataFrames of ``iter_edges_dataframes`` or ``iter_nodes_dataframes`` are written one by one, so the whole database is never held in memory. Categorical columns are stored as Parquet dictionaries. Values which aren't strings, like tuple locations, are stored as their string representation, which can be read back with ``retupleize_geo_strings``. Requires ``pyarrow``.
+
+        Returns the number of rows written. No file is written if there are no rows."""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet files requires `pyarrow`")
+
+        if nodes:
+            dataframes = self.iter_nodes_dataframes(chunksize=chunksize)
+        else:
+            dataframes = self.iter_edges_dataframes(chunksize=chunksize)
+
+        writer, schema, nrows = None, None, 0
+        try:
+            for df in dataframes:
+                df = _with_string_values(df)
+                if schema is None:
+                    schema = pa.Schema.from_pandas(df, preserve_index=False)
+                    # Columns without any value in the first chunk could have values later
+                    schema = pa.schema(
+                        [
+                            field.with_type(pa.string())
+                            if pa.types.is_null(field.type)
+                            else field
+                            for field in schema
+                        ]
+                    )
+                    writer = pq.ParquetWriter(str(filepath), schema)
+                writer.write_table(
+                    pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+                )
+                nrows += len(df)
+        finally:
+            if writer is not None:
+                writer.close()
+        return nrows
+
+    def _iotable_edges_to_dataframe(self, categorical: bool = True) -> pd.DataFrame:
         """Return a pandas DataFrame with all database exchanges. DataFrame columns are:
 
             target_id: int,
@@ -1191,115 +2195,327 @@ class Database(Model):
         Returns a pandas ``DataFrame``.
 
         """
-        from .. import get_activity
+        df = next(self._iotable_edges_dataframes(categorical=categorical))
+        if categorical:
+            df["edge_type"] = df["edge_type"].cat.remove_unused_categories()
+        return df
 
-        @functools.lru_cache(10000)
-        def cached_lookup(id_):
-            return get_activity(id=id_)
+    def _iotable_edges_dataframes(self, chunksize=None, categorical=True):
+        """Iterate over edges DataFrames of at most ``chunksize`` edges of this IO table, or of all edges if ``chunksize`` is ``None``. Categorical columns have the same categories in all DataFrames."""
+        print("Loading datapackage")
+        exchanges = IOTableExchanges(datapackage=self.datapackage())
+        source_ids, target_ids, edge_amounts, edge_types = exchanges.as_arrays(
+            type_codes=True
+        )
 
         print("Retrieving metadata")
-        activities = {o.id: o for o in self}
+        # Not the reference product, as for SQLite databases
+        node_columns = {**_EDGE_NODE_COLUMNS, "source_product": "product"}
+        ids, node_values = self._edge_node_columns(
+            target_ids,
+            source_ids,
+            _IOTABLE_EDGE_DATAFRAME_COLUMNS,
+            node_columns,
+            categorical,
+        )
 
-        def get(id_):
-            try:
-                return activities[id_]
-            except KeyError:
-                return cached_lookup(id_)
-
-        def metadata_dataframe(ids, prefix="target_"):
-            def dict_for_obj(obj, prefix):
-                dct = {
-                    f"{prefix}id": obj["id"],
-                    f"{prefix}database": obj["database"],
-                    f"{prefix}code": obj["code"],
-                    f"{prefix}name": obj.get("name"),
-                    f"{prefix}location": obj.get("location"),
-                    f"{prefix}unit": obj.get("unit"),
-                }
-                if prefix == "target_":
-                    dct["target_type"] = obj.get("type", "process")
-                    dct["target_reference_product"] = obj.get("reference product")
-                else:
-                    dct["source_categories"] = (
-                        "::".join(obj["categories"]) if obj.get("categories") else None
+        print("Building DataFrame")
+        starts = range(0, len(edge_amounts), chunksize) if chunksize else [0]
+        for start in starts:
+            selection = slice(start, start + chunksize if chunksize else None)
+            types = pd.Categorical.from_codes(
+                edge_types[selection], exchanges.EDGE_TYPES
+            )
+            yield self._edges_dataframe(
+                _IOTABLE_EDGE_DATAFRAME_COLUMNS,
+                edges={
+                    "target_id": target_ids[selection],
+                    "source_id": source_ids[selection],
+                    "edge_amount": edge_amounts[selection],
+                    "edge_type": types
+                    if categorical
+                    else np.asarray(types, dtype=object),
+                },
+                ids=ids,
+                node_values=node_values,
+            )
+
+    @staticmethod
+    def _edge_node_columns(
+        target_ids,
+        source_ids,
+        columns,
+        node_columns=_EDGE_NODE_COLUMNS,
+        categorical=True,
+    ):
+        """Get the node attributes of an edges DataFrame with ``columns`` for all nodes in ``target_ids`` and ``source_ids``.
+
+        ``node_columns`` maps column labels to ``_node_metadata`` attributes of the target or source node, depending on the label prefix.
+
+        Returns the sorted unique node ids, and a dictionary with the values of each column for these nodes: a tuple of integer codes and categories for columns in ``_EDGE_CATEGORICAL_COLUMNS`` if ``categorical``, and an object array otherwise. Like in ``astype("category")``, categories are only the values of nodes on the same side of the edges. Node attributes are retrieved once per node."""
+        sides = {"target": np.unique(target_ids), "source": np.unique(source_ids)}
+        ids = np.union1d(sides["target"], sides["source"])
+        metadata = Database._node_metadata(ids)
+
+        values, used = {}, {}
+        for label in columns:
+            if label not in node_columns:
+                continue
+            column = metadata[node_columns[label]].to_numpy()
+            if not (categorical and label in _EDGE_CATEGORICAL_COLUMNS):
+                values[label] = column
+                continue
+            side = label.split("_")[0]
+            if side not in used:
+                used[side] = np.isin(ids, sides[side], assume_unique=True)
+            values[label] = pd.factorize(np.where(used[side], column, None), sort=True)
+        return ids, values
+
+    @staticmethod
+    def _edges_dataframe(columns, edges, ids, node_values, masks=None):
+        """Build an edges DataFrame with ``columns`` from the edge arrays ``edges``, and the node attributes ``ids`` and ``node_values`` from ``_edge_node_columns``.
+
+        ``edges`` maps column labels to arrays, and must include ``target_id`` and ``source_id``. ``masks`` optionally maps column labels to boolean arrays; values where the array is ``False`` are missing.
+
+        Node attributes are expanded to the edges with ``take``, and categoricals are built directly from their integer codes."""
+        masks = masks or {}
+        positions = {
+            "target": np.searchsorted(ids, edges["target_id"]),
+            "source": np.searchsorted(ids, edges["source_id"]),
+        }
+        data = {}
+        for label in columns:
+            if label in edges:
+                data[label] = edges[label]
+                continue
+            side_positions = positions[label.split("_")[0]]
+            mask = masks.get(label)
+            if isinstance(node_values[label], tuple):
+                codes, categories = node_values[label]
+                codes = codes.take(side_positions)
+                if mask is not None:
+                    codes[~mask] = -1
+                data[label] = pd.Categorical.from_codes(codes, categories)
+            else:
+                column = node_values[label].take(side_positions)
+                if mask is not None:
+                    column[~mask] = None
+                data[label] = column
+        return pd.DataFrame(data)
+
+    @staticmethod
+    def _node_metadata(ids) -> pd.DataFrame:
+        """Get the node attributes used in edge DataFrames for the unique node ``ids`` as a DataFrame indexed by id, in the same order as ``ids``.
+
+        Selects only the needed ``ActivityDataset`` columns, in one query per ``_SQL_CHUNK_SIZE`` ids. Raises ``UnknownObject`` if any id doesn't exist."""
+        AD = ActivityDataset
+        ids = [int(id_) for id_ in ids]
+        rows = []
+        for index in range(0, len(ids), _SQL_CHUNK_SIZE):
+            qs = AD.select(
+                AD.id,
+                AD.database,
+                AD.code,
+                AD.name,
+                AD.location,
+                AD.product,
+                AD.type,
+                AD.data,
+            ).where(AD.id << ids[index : index + _SQL_CHUNK_SIZE])
+            for (
+                id_,
+                database,
+                code,
+                name,
+                location,
+                product,
+                type_,
+                data,
+            ) in qs.tuples():
+                rows.append(
+                    (
+                        id_,
+                        database,
+                        code,
+                        name,
+                        location,
+                        data.get("unit"),
+                        type_ or "process",
+                        product,
+                        "::".join(data["categories"])
+                        if data.get("categories")
+                        else None,
+                        data.get("product"),
                     )
-                    dct["source_product"] = obj.get("product")
-                return dct
+                )
+        if len(rows) != len(ids):
+            missing = sorted(set(ids).difference(row[0] for row in rows))
+            raise UnknownObject("Can't find nodes {}".format(missing))
+
+        columns = ["database", "code", "name", "location", "unit", "type"]
+        columns += ["reference product", "categories", "product"]
+        return pd.DataFrame.from_records(
+            rows, columns=["id"] + columns, index="id"
+        ).reindex(ids)
 
-            return pd.DataFrame(
-                [dict_for_obj(get(id_), prefix) for id_ in np.unique(ids)]
+    def _sqlite_edges_to_dataframe(
+        self, categorical: bool = True, formatters: Optional[List[Callable]] = None
+    ) -> pd.DataFrame:
+        """Build the edges DataFrame with SQL queries of the exchange columns and node attributes, without building Wurst documents.
+
+        ``formatters`` are defined for Wurst documents, so ``_wurst_edges_to_dataframe`` is used if they are given."""
+        if formatters is not None:
+            return self._wurst_edges_to_dataframe(
+                categorical=categorical, formatters=formatters
             )
 
-        def get_edge_types(exchanges):
-            arrays = []
-            for resource in exchanges.resources:
-                if resource["data"]["matrix"] == "biosphere_matrix":
-                    arrays.append(
-                        np.array(["biosphere"] * len(resource["data"]["array"]))
-                    )
-                else:
-                    arr = np.array(["technosphere"] * len(resource["data"]["array"]))
-                    arr[resource["flip"]["positive"]] = "production"
-                    arrays.append(arr)
+        df = next(self._sqlite_edges_dataframes(categorical=categorical))
+        if categorical:
+            for column in ("edge_type", "source_categories"):
+                df[column] = df[column].cat.remove_unused_categories()
+        return df
 
-            return np.hstack(arrays)
+    def _sqlite_edges_dataframes(self, chunksize=None, categorical=True):
+        """Iterate over edges DataFrames of at most ``chunksize`` edges of this database, or of all edges if ``chunksize`` is ``None``. Categorical columns have the same categories in all DataFrames."""
+        from . import sqlite3_lci_db
 
-        print("Loading datapackage")
-        exchanges = IOTableExchanges(datapackage=self.datapackage())
+        print("Retrieving edges")
+        types = self._edge_types()
+        if chunksize is None:
+            chunks = list(self._sqlite_edge_arrays(types))
+            chunks = [
+                np.concatenate(chunks)
+                if chunks
+                else np.zeros(0, dtype=_EDGE_ARRAY_DTYPE)
+            ]
+            target_ids, source_ids = chunks[0]["target_id"], chunks[0]["source_id"]
+        else:
+            chunks = self._sqlite_edge_arrays(types, chunksize)
+            target_ids, source_ids = (
+                [
+                    id_
+                    for (id_,) in sqlite3_lci_db.read_connection().execute(
+                        "SELECT DISTINCT {} FROM exchangedataset as e WHERE e.output_database = ?".format(
+                            _EDGE_NODE_IDS[side]
+                        ),
+                        (self.name,),
+                    )
+                    if id_ is not None
+                ]
+                for side in ("output", "input")
+            )
 
-        target_ids = np.hstack(
-            [resource["indices"]["array"]["col"] for resource in exchanges.resources]
-        )
-        source_ids = np.hstack(
-            [resource["indices"]["array"]["row"] for resource in exchanges.resources]
+        print("Retrieving metadata")
+        ids, node_values = self._edge_node_columns(
+            target_ids, source_ids, _EDGE_DATAFRAME_COLUMNS, categorical=categorical
         )
-        edge_amounts = np.hstack(
-            [resource["data"]["array"] for resource in exchanges.resources]
+        biosphere = types.index("biosphere") if "biosphere" in types else -1
+
+        print("Building DataFrame")
+        for edges in chunks:
+            edge_types = pd.Categorical.from_codes(edges["edge_type"], types)
+            yield self._edges_dataframe(
+                _EDGE_DATAFRAME_COLUMNS,
+                edges={
+                    "target_id": edges["target_id"],
+                    "source_id": edges["source_id"],
+                    "edge_amount": edges["edge_amount"],
+                    "edge_type": edge_types
+                    if categorical
+                    else np.asarray(edge_types, dtype=object),
+                },
+                ids=ids,
+                node_values=node_values,
+                # Categories are only given for biosphere flows
+                masks={"source_categories": edges["edge_type"] == biosphere},
+            )
+
+    def _edge_types(self):
+        """Get the sorted edge types of this database"""
+        from . import sqlite3_lci_db
+
+        return sorted(
+            type_
+            for (type_,) in sqlite3_lci_db.read_connection().execute(
+                "SELECT DISTINCT type FROM exchangedataset WHERE output_database = ?",
+                (self.name,),
+            )
         )
-        edge_types = get_edge_types(exchanges)
 
-        print("Creating metadata dataframes")
-        target_metadata = metadata_dataframe(target_ids)
-        source_metadata = metadata_dataframe(source_ids, "source_")
+    def _sqlite_edge_arrays(self, types, chunksize=_FETCH_BATCH_SIZE):
+        """Iterate over structured arrays (with dtype ``_EDGE_ARRAY_DTYPE``) of at most ``chunksize`` edges of this database.
 
-        print("Building merged dataframe")
-        df = pd.DataFrame(
-            {
-                "target_id": target_ids,
-                "source_id": source_ids,
-                "edge_amount": edge_amounts,
-                "edge_type": edge_types,
-            }
+        ``edge_type`` is the index in ``types``, the sorted edge types from ``_edge_types``. Edges with an ``amount`` column are copied directly from the query results; only the remaining edges have their ``data`` blob deserialized. Raises ``UnknownObject`` if an edge links to a node which doesn't exist.
+
+        Each chunk is a separate query which continues after the last edge id of the previous chunk, so no read transaction is held while the caller processes a chunk. Edges written concurrently may or may not be included."""
+        from . import sqlite3_lci_db
+
+        connection = sqlite3_lci_db.read_connection()
+        first_id, last_id = connection.execute(
+            "SELECT MIN(id), MAX(id) FROM exchangedataset WHERE output_database = ?",
+            (self.name,),
+        ).fetchone()
+        if first_id is None:
+            return
+        type_sql = "CASE e.type {} END".format(
+            " ".join("WHEN ? THEN {}".format(index) for index in range(len(types)))
         )
-        df = df.merge(target_metadata, on="target_id")
-        df = df.merge(source_metadata, on="source_id")
-
-        categorical_columns = [
-            "target_database",
-            "target_name",
-            "target_reference_product",
-            "target_location",
-            "target_unit",
-            "target_type",
-            "source_database",
-            "source_code",
-            "source_name",
-            "source_product",
-            "source_location",
-            "source_unit",
-            "source_categories",
-            "edge_type",
-        ]
-        print("Compressing DataFrame")
-        for column in categorical_columns:
-            if column in df.columns:
-                df[column] = df[column].astype("category")
+        for condition, amount in (
+            ("NOT NULL", "e.amount"),
+            ("NULL", "e.data"),
+        ):
+            sql = _EDGE_ARRAY_SQL.format(
+                amount=amount, type=type_sql, condition=condition
+            )
+            previous_id = first_id - 1
+            while True:
+                rows = connection.execute(
+                    sql, list(types) + [self.name, previous_id, last_id, chunksize]
+                ).fetchall()
+                if not rows:
+                    break
+                if condition == "NULL":
+                    rows = [
+                        (target, source, decode_blob(data)["amount"], type_, id_)
+                        for target, source, data, type_, id_ in rows
+                    ]
+                array = np.array(rows, dtype=_EDGE_ARRAY_DTYPE + [("id", np.int64)])
+                previous_id = int(array["id"][-1])
+                array = repack_fields(array[[name for name, _ in _EDGE_ARRAY_DTYPE]])
+                if (array["target_id"] < 0).any() or (array["source_id"] < 0).any():
+                    self._raise_unknown_edge_node()
+                yield array
+
+    def _raise_unknown_edge_node(self):
+        from . import sqlite3_lci_db
 
-        return df
+        input_database, input_code, output_database, output_code = (
+            sqlite3_lci_db.read_connection()
+            .execute(
+                _EXCHANGE_SQL.format(
+                    columns="e.input_database, e.input_code, e.output_database, e.output_code",
+                    types=_quoted(self._edge_types()),
+                )
+                + "\n        AND (a.id IS NULL OR b.id IS NULL) LIMIT 1",
+                (self.name,),
+            )
+            .fetchone()
+        )
+        raise UnknownObject(
+            (
+                "Exchange between {} and {} is invalid "
+                "- one of these objects is unknown (i.e. doesn't exist "
+                "as a process dataset)"
+            ).format(
+                (input_database, input_code),
+                (output_database, output_code),
+            )
+        )
 
-    def _sqlite_edges_to_dataframe(
+    def _wurst_edges_to_dataframe(
         self, categorical: bool = True, formatters: Optional[List[Callable]] = None
     ) -> pd.DataFrame:
+        """Build the edges DataFrame from Wurst documents, applying ``formatters`` to each row."""
         from .wurst_extraction import extract_brightway_databases
 
         result = []
@@ -1337,24 +2553,8 @@ class Database(Model):
         df = pd.DataFrame(result)
 
         if categorical:
-            categorical_columns = [
-                "target_database",
-                "target_name",
-                "target_reference_product",
-                "target_location",
-                "target_unit",
-                "target_type",
-                "source_database",
-                "source_code",
-                "source_name",
-                "source_product",
-                "source_location",
-                "source_unit",
-                "source_categories",
-                "edge_type",
-            ]
             print("Compressing DataFrame")
-            for column in categorical_columns:
+            for column in _EDGE_CATEGORICAL_COLUMNS:
                 if column in df.columns:
                     df[column] = df[column].astype("category")
 
@@ -4,10 +4,11 @@ from typing import Optional
 from warnings import warn
 
 import numpy as np
-from bw_processing import Datapackage
+from bw_processing import INDICES_DTYPE, Datapackage
 
+from ..datapackages import column_index, derived_data
 from ..errors import InvalidDatapackage
-from ..utils import get_node
+from ..utils import get_node, get_nodes
 from .proxies import Activity, Exchange, Exchanges
 
 
@@ -42,11 +43,12 @@ class ReadOnlyExchange(Mapping):
         )
 
     def __init__(self, **kwargs):
+        """``input`` and ``output`` are node ids, or already loaded nodes"""
         self.valid(dct=kwargs)
-        input_id = kwargs.pop("input")
-        output_id = kwargs.pop("output")
-        self.input = get_node(id=input_id)
-        self.output = get_node(id=output_id)
+        input_ = kwargs.pop("input")
+        output = kwargs.pop("output")
+        self.input = input_ if isinstance(input_, Activity) else get_node(id=input_)
+        self.output = output if isinstance(output, Activity) else get_node(id=output)
         self.amount = kwargs["amount"]
         self._data = kwargs
         self._data["input"] = self.input.key
@@ -65,6 +67,8 @@ class ReadOnlyExchange(Mapping):
 
 
 class IOTableExchanges(Iterable):
+    EDGE_TYPES = ("biosphere", "production", "technosphere")
+
     to_dataframe = Exchanges.to_dataframe
 
     def __init__(
@@ -101,17 +105,13 @@ class IOTableExchanges(Iterable):
             )
 
         resources = self._group_and_filter_resources(datapackage)
-        self._add_arrays_to_resources(resources, datapackage)
+        self._add_arrays_to_resources(resources, datapackage, target)
+        if target is not None:
+            datapackage.filtered = target.id
         resources = self._reduce_arrays_to_selected_types(
             resources, technosphere, production, biosphere
         )
 
-        if target is not None:
-            datapackage.filtered = target.id
-            for resource in resources:
-                mask = resource["indices"]["array"]["col"] == target.id
-                self._mask_resource_arrays(resource, mask)
-
         self.resources = resources
         self.datapackage = datapackage
         self.technosphere = technosphere
@@ -127,29 +127,63 @@ class IOTableExchanges(Iterable):
         ]
         return [obj for obj in resources if obj]
 
-    def _add_arrays_to_resources(self, resources, datapackage):
+    @staticmethod
+    def _column_index(resource, datapackage):
+        """Get the ``column_index`` of the persistent vector of ``resource``.
+
+        The index is written with the datapackage by ``write_exchanges``, and memory-mapped with directory storage. For datapackages without it, the index is computed when first needed; this holds an ``order`` array of 8 bytes per edge in memory, but not sorted copies of the datapackage arrays."""
+        group = resource["indices"]["group"]
+        names = {obj["name"] for obj in datapackage.resources}
+        if {
+            "{}.column_{}".format(group, kind)
+            for kind in ("order", "columns", "offsets")
+        } <= names:
+            return {
+                kind: datapackage.get_resource("{}.column_{}".format(group, kind))[0]
+                for kind in ("order", "columns", "offsets")
+            }
+        indices = datapackage.get_resource(resource["indices"]["name"])[0]
+        arrays = column_index(indices["col"])
+        # Shared by all copies of the datapackage
+        for array in arrays.values():
+            array.flags.writeable = False
+        return arrays
+
+    def _add_arrays_to_resources(self, resources, datapackage, target=None):
+        """Add the arrays of each resource, limited to the column ``target.id`` if ``target`` is given.
+
+        Without ``target``, the arrays are the (read-only) datapackage arrays. Otherwise, only the edges of the column are read from the datapackage arrays, using the column index of ``_column_index``. The column index is loaded once for each datapackage, and shared by all copies of a datapackage from ``datapackage_cache``."""
+        derived = derived_data(datapackage)
         for resource in resources:
-            resource["data"]["array"] = datapackage.get_resource(
-                resource["data"]["name"]
-            )[0]
-            resource["indices"]["array"] = datapackage.get_resource(
-                resource["indices"]["name"]
-            )[0]
+            indices = datapackage.get_resource(resource["indices"]["name"])[0]
+            data = datapackage.get_resource(resource["data"]["name"])[0]
             if "flip" in resource:
-                resource["flip"]["array"] = datapackage.get_resource(
-                    resource["flip"]["name"]
-                )[0]
+                flip = datapackage.get_resource(resource["flip"]["name"])[0]
             else:
-                resource["flip"] = {
-                    "array": np.zeros_like(resource["data"]["array"], dtype=bool)
-                }
+                flip = np.zeros(len(data), dtype=bool)
+
+            if target is not None:
+                key = ("IOTableExchanges", resource["indices"]["name"])
+                if key not in derived:
+                    derived[key] = self._column_index(resource, datapackage)
+                index = derived[key]
+                position = np.searchsorted(index["columns"], target.id)
+                if (
+                    position < len(index["columns"])
+                    and index["columns"][position] == target.id
+                ):
+                    order = index["order"][
+                        slice(*index["offsets"][position : position + 2])
+                    ]
+                else:
+                    order = index["order"][:0]
+                indices, data, flip = indices[order], data[order], flip[order]
 
-            # Add array indicating if values are positive after combining data and flip
-            positive_arr = np.ones_like(resource["flip"]["array"], dtype=int)
-            positive_arr[resource["flip"]["array"]] = -1
-            resource["flip"]["positive"] = (
-                resource["data"]["array"] * positive_arr
-            ) >= 0
+            resource["indices"]["array"] = indices
+            resource["data"]["array"] = data
+            resource.setdefault("flip", {})["array"] = flip
+            # Positive after combining data and flip
+            resource["flip"]["positive"] = np.where(flip, -data, data) >= 0
 
     def _reduce_arrays_to_selected_types(
         self, resources, technosphere, production, biosphere
@@ -184,38 +218,94 @@ class IOTableExchanges(Iterable):
                     self._mask_resource_arrays(resource, resource["flip"]["positive"])
         return resources
 
+    def _iter_prefetched(self):
+        # Used by ``to_dataframe``; input and output nodes are always loaded
+        return iter(self)
+
     def _mask_resource_arrays(self, resource, mask):
         resource["data"]["array"] = resource["data"]["array"][mask]
         resource["indices"]["array"] = resource["indices"]["array"][mask]
         resource["flip"]["array"] = resource["flip"]["array"][mask]
         resource["flip"]["positive"] = resource["flip"]["positive"][mask]
 
+    def _nodes(self):
+        """Load all input and output nodes of the selected edges, with one query per ``_SQL_CHUNK_SIZE`` nodes. Returns a dictionary of ``{id: node}``."""
+        ids = set()
+        for resource in self.resources:
+            ids.update(np.unique(resource["indices"]["array"]["row"]).tolist())
+            ids.update(np.unique(resource["indices"]["array"]["col"]).tolist())
+        ids = sorted(ids)
+        return dict(zip(ids, get_nodes(ids)))
+
     def __iter__(self):
+        nodes = self._nodes()
         for row, col, value in self._raw_technosphere_iterator(negative=False):
             yield ReadOnlyExchange(
-                input=row,
-                output=col,
+                input=nodes[row],
+                output=nodes[col],
                 amount=value,
                 uncertainty_type=0,
                 type="production",
             )
         for row, col, value in self._raw_technosphere_iterator(negative=True):
             yield ReadOnlyExchange(
-                input=row,
-                output=col,
+                input=nodes[row],
+                output=nodes[col],
                 amount=value,
                 uncertainty_type=0,
                 type="technosphere",
             )
         for row, col, value in self._raw_biosphere_iterator():
             yield ReadOnlyExchange(
-                input=row,
-                output=col,
+                input=nodes[row],
+                output=nodes[col],
                 amount=value,
                 uncertainty_type=0,
                 type="biosphere",
             )
 
+    def as_arrays(self, type_codes=False):
+        """Get the selected edges as NumPy arrays ``(rows, cols, amounts, types)``.
+
+        ``rows`` and ``cols`` are node ids, and ``amounts`` aren't flipped. ``types`` are the edge type labels (``production``, ``technosphere``, or ``biosphere``), or their indices in ``EDGE_TYPES`` if ``type_codes``. Edges are ordered by datapackage resource and then in the order they were written, not by type as in iteration. If all edges come from one datapackage resource and no ``target`` was given, ``rows``, ``cols`` and ``amounts`` are views of the (read-only) datapackage arrays instead of copies."""
+        rows, cols, amounts, codes = [], [], [], []
+        for resource in self.resources:
+            indices = resource["indices"]["array"]
+            rows.append(indices["row"])
+            cols.append(indices["col"])
+            amounts.append(resource["data"]["array"])
+            if resource["data"]["matrix"] == "biosphere_matrix":
+                codes.append(
+                    np.full(len(indices), self.EDGE_TYPES.index("biosphere"), np.int8)
+                )
+            else:
+                codes.append(
+                    np.where(
+                        resource["flip"]["positive"],
+                        self.EDGE_TYPES.index("production"),
+                        self.EDGE_TYPES.index("technosphere"),
+                    ).astype(np.int8)
+                )
+        if not self.resources:
+            rows, cols, amounts, codes = (
+                np.zeros(0, dtype=INDICES_DTYPE[0][1]),
+                np.zeros(0, dtype=INDICES_DTYPE[1][1]),
+                np.zeros(0, dtype=np.float64),
+                np.zeros(0, dtype=np.int8),
+            )
+        elif len(self.resources) == 1:
+            rows, cols, amounts, codes = rows[0], cols[0], amounts[0], codes[0]
+        else:
+            rows, cols, amounts, codes = (
+                np.hstack(rows),
+                np.hstack(cols),
+                np.hstack(amounts),
+                np.hstack(codes),
+            )
+        if type_codes:
+            return rows, cols, amounts, codes
+        return rows, cols, amounts, np.array(self.EDGE_TYPES)[codes]
+
     def _raw_technosphere_iterator(self, negative=True):
         tm = lambda x: any(obj["matrix"] == "technosphere_matrix" for obj in x.values())
         for resource in filter(tm, self.resources):
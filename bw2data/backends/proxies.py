@@ -1,18 +1,108 @@
 import copy
+import operator
 import uuid
 from collections.abc import Iterable
+from functools import reduce
 from typing import Callable, List, Optional
 
 import pandas as pd
+from peewee import JOIN, SQL, Tuple
 
 from .. import geomapping
-from ..errors import ValidityError
+from ..errors import UnknownObject, ValidityError
 from ..proxies import ActivityProxyBase, ExchangeProxyBase
 from ..search import IndexManager
-from .schema import ActivityDataset, ExchangeDataset
+from .schema import (
+    _SQL_CHUNK_SIZE,
+    ActivityDataset,
+    ExchangeDataset,
+    get_id,
+    get_ids,
+    node_cache,
+)
 from .utils import dict_as_activitydataset, dict_as_exchangedataset
 
 
+def _set_nodes_dirty(keys):
+    """Mark the databases of node ``keys`` as dirty, recording which nodes had their edges changed.
+
+    Nodes which don't exist (yet) cause their whole database to be marked for reprocessing."""
+    from . import Database
+
+    nodes = {}
+    for key in keys:
+        try:
+            id_ = get_id(key)
+        except UnknownObject:
+            nodes[key[0]] = None
+            continue
+        if nodes.setdefault(key[0], set()) is not None:
+            nodes[key[0]].add(id_)
+    for database, ids in nodes.items():
+        Database.set_dirty(database, ids)
+
+
+def _node_expression(keys, side):
+    """Peewee expression to select edges with any of the node ``keys`` as ``side`` (``input`` or ``output``).
+
+    Uses the indexed integer node ids. Edges without a node id are matched on the ``(database, code)`` columns; these are edges to nodes which don't exist (yet), or edges in projects where ``populate_exchange_node_ids_40`` hasn't been applied, e.g. because they were opened read-only."""
+    try:
+        ids, missing = get_ids(keys), []
+    except UnknownObject:
+        ids, missing = [], []
+        for key in keys:
+            try:
+                ids.append(get_id(key))
+            except UnknownObject:
+                missing.append(key)
+    column = getattr(ExchangeDataset, side + "_id")
+    database_column = getattr(ExchangeDataset, side + "_database")
+    code_column = getattr(ExchangeDataset, side + "_code")
+    if len(keys) == 1 and ids:
+        return (column == ids[0]) | (
+            column.is_null()
+            & (database_column == keys[0][0])
+            & (code_column == keys[0][1])
+        )
+    expressions = []
+    if ids:
+        # Inline integer ids; SQLite limits the number of query parameters
+        ids_sql = SQL("({})".format(", ".join(map(str, ids))))
+        KeyNode = ActivityDataset.alias("key_node")
+        expressions.append(column.in_(ids_sql))
+        expressions.append(
+            column.is_null()
+            & Tuple(database_column, code_column).in_(
+                KeyNode.select(KeyNode.database, KeyNode.code).where(
+                    KeyNode.id.in_(ids_sql)
+                )
+            )
+        )
+    codes = {}
+    for database, code in missing:
+        codes.setdefault(database, []).append(code)
+    for database, database_codes in codes.items():
+        for index in range(0, len(database_codes), _SQL_CHUNK_SIZE):
+            expressions.append(
+                (database_column == database)
+                & code_column.in_(database_codes[index : index + _SQL_CHUNK_SIZE])
+            )
+    if not expressions:
+        return SQL("0")
+    return reduce(operator.or_, expressions)
+
+
+def _node_join(node, side):
+    """Peewee join condition between ``ExchangeDataset`` and its ``side`` node ``node``, a (possibly aliased) ``ActivityDataset``.
+
+    Falls back to the ``(database, code)`` columns for edges without a node id, like ``_node_expression``."""
+    return (getattr(ExchangeDataset, side + "_id") == node.id) | (
+        getattr(ExchangeDataset, side + "_id").is_null()
+        & (getattr(ExchangeDataset, side + "_database") == node.database)
+        & (getattr(ExchangeDataset, side + "_code") == node.code)
+    )
+
+
 class Exchanges(Iterable):
     """Iterator for exchanges with some additional methods.
 
@@ -36,25 +126,36 @@ class Exchanges(Iterable):
         # Delete all
         exchanges.delete()
 
+    ``limit`` and ``offset`` select a page of the exchanges. With ``reverse=True``, exchanges which consume the node ``key`` are selected instead of its own exchanges, using the index on ``input_id``. ``keys`` is a list of node keys used instead of ``key``, to select the exchanges of several nodes in one query.
+
+    With ``prefetch=True``, the input and output nodes are loaded in the same query as the exchanges, and ``exc.input`` and ``exc.output`` don't need extra queries. Nodes used by several exchanges are only created once per iteration, so these exchanges share the same node objects.
+
     """
 
-    def __init__(self, key, kinds=None, reverse=False):
-        self._key, self._kinds = key, kinds
+    def __init__(
+        self,
+        key,
+        kinds=None,
+        reverse=False,
+        prefetch=False,
+        limit=None,
+        offset=None,
+        keys=None,
+    ):
+        self._keys = [key] if keys is None else [(key[0], key[1]) for key in keys]
+        self._kinds, self._prefetch = kinds, prefetch
+        self._limit, self._offset = limit, offset
         if reverse:
             self._args = [
-                ExchangeDataset.input_database == self._key[0],
-                ExchangeDataset.input_code == self._key[1],
-                # No production exchanges - these two clauses have to be together,
-                # not individually
-                ExchangeDataset.output_database
-                != self._key[0] & ExchangeDataset.output_code
-                != self._key[1],
+                _node_expression(self._keys, "input"),
+                # No production exchanges
+                ~(
+                    (ExchangeDataset.output_database == ExchangeDataset.input_database)
+                    & (ExchangeDataset.output_code == ExchangeDataset.input_code)
+                ),
             ]
         else:
-            self._args = [
-                ExchangeDataset.output_database == self._key[0],
-                ExchangeDataset.output_code == self._key[1],
-            ]
+            self._args = [_node_expression(self._keys, "output")]
         if self._kinds:
             self._args.append(ExchangeDataset.type << self._kinds)
 
@@ -64,15 +165,96 @@ class Exchanges(Iterable):
     def delete(self):
         from . import Database
 
-        Database().set_dirty(self._key[0])
-        ExchangeDataset.delete().where(*self._args).execute()
+        if self._limit is not None or self._offset:
+            args = [
+                ExchangeDataset.id << self._get_queryset().select(ExchangeDataset.id)
+            ]
+        else:
+            args = self._args
+        outputs = (
+            ActivityDataset.select(ActivityDataset.database, ActivityDataset.id)
+            .join(
+                ExchangeDataset,
+                on=_node_join(ActivityDataset, "output"),
+            )
+            .where(*args)
+            .distinct()
+            .tuples()
+        )
+        changed = {}
+        for database, id_ in outputs:
+            changed.setdefault(database, set()).add(id_)
+        for database, ids in changed.items():
+            Database.set_dirty(database, ids)
+        if not changed:
+            for database in {key[0] for key in self._keys if key[0] is not None}:
+                Database.set_dirty(database)
+        ExchangeDataset.delete().where(*args).execute()
+
+    def _paginate(self, qs):
+        if self._limit is not None:
+            qs = qs.limit(self._limit)
+        if self._offset:
+            qs = qs.offset(self._offset)
+        return qs
 
     def _get_queryset(self):
-        return ExchangeDataset.select().where(*self._args).order_by(ExchangeDataset.id)
+        return self._paginate(
+            ExchangeDataset.select().where(*self._args).order_by(ExchangeDataset.id)
+        )
 
     def __iter__(self):
-        for obj in self._get_queryset():
-            yield Exchange(obj)
+        if self._prefetch:
+            yield from self._iter_prefetched()
+        else:
+            for obj in self._get_queryset():
+                yield Exchange(obj)
+
+    def _iter_prefetched(self):
+        """Iterate over exchanges with their input and output nodes, using one query"""
+        from ..utils import _node_class
+
+        InputNode = ActivityDataset.alias("input_node")
+        OutputNode = ActivityDataset.alias("output_node")
+        qs = (
+            ExchangeDataset.select(ExchangeDataset, InputNode, OutputNode)
+            .join(
+                InputNode,
+                JOIN.LEFT_OUTER,
+                on=_node_join(InputNode, "input"),
+                attr="input_node",
+            )
+            .switch(ExchangeDataset)
+            .join(
+                OutputNode,
+                JOIN.LEFT_OUTER,
+                on=_node_join(OutputNode, "output"),
+                attr="output_node",
+            )
+            .where(*self._args)
+            .order_by(ExchangeDataset.id)
+        )
+        qs = self._paginate(qs)
+
+        nodes = {}
+
+        def node_for(document):
+            if document is None or document.id is None:
+                return None
+            if document.id not in nodes:
+                nodes[document.id] = _node_class(document.database)(document)
+                node_cache.add((document.database, document.code), document.id)
+            return nodes[document.id]
+
+        for obj in qs:
+            exc = Exchange(obj)
+            input_node = node_for(getattr(obj, "input_node", None))
+            if input_node is not None:
+                exc._input = input_node
+            output_node = node_for(getattr(obj, "output_node", None))
+            if output_node is not None:
+                exc._output = output_node
+            yield exc
 
     def __len__(self):
         return self._get_queryset().count()
@@ -120,7 +302,7 @@ class Exchanges(Iterable):
         """
         result = []
 
-        for edge in self:
+        for edge in self._iter_prefetched():
             row = {
                 "target_id": edge.output["id"],
                 "target_database": edge.output["database"],
@@ -174,6 +356,27 @@ class Exchanges(Iterable):
         return df
 
 
+def consumers_of(
+    keys,
+    kinds=("technosphere", "generic consumption"),
+    prefetch=False,
+    limit=None,
+    offset=None,
+):
+    """Get the edges which consume any of the node ``keys``, using one query. Returns ``Exchanges``.
+
+    Like ``Activity.consumers``, production edges of these nodes are excluded. ``kinds`` are the edge types to include; use ``None`` for all types."""
+    return Exchanges(
+        None,
+        kinds=kinds,
+        reverse=True,
+        prefetch=prefetch,
+        limit=limit,
+        offset=offset,
+        keys=keys,
+    )
+
+
 class Activity(ActivityProxyBase):
     def __init__(self, document=None, **kwargs):
         """Create an `Activity` proxy object.
@@ -264,6 +467,9 @@ class Activity(ActivityProxyBase):
         IndexManager(Database(self["database"]).filename).delete_dataset(self._data)
         self.exchanges().delete()
         self._document.delete_instance()
+        node_cache.invalidate(self["database"], self["code"])
+        # Other nodes can link to this node, so reprocess the whole database
+        Database.set_dirty(self["database"])
         self = None
 
     def save(self):
@@ -275,13 +481,13 @@ class Activity(ActivityProxyBase):
                 "following reasons\n\t* " + "\n\t* ".join(self.valid(why=True)[1])
             )
 
-        Database.set_dirty(self["database"])
         db = Database(self["database"])
 
         for key, value in dict_as_activitydataset(self._data).items():
             if key != "id":
                 setattr(self._document, key, value)
         self._document.save()
+        Database.set_dirty(self["database"], [self._document.id])
 
         if self.get("location") and self["location"] not in geomapping:
             geomapping.add([self["location"]])
@@ -320,6 +526,7 @@ class Activity(ActivityProxyBase):
                 ExchangeDataset.input_database == self["database"],
                 ExchangeDataset.input_code == self["code"],
             ).execute()
+        node_cache.invalidate(self["database"], self["code"])
 
         db = Database(self["database"])
         if db.searchable:
@@ -353,7 +560,11 @@ class Activity(ActivityProxyBase):
                 ExchangeDataset.input_database == old_database,
                 ExchangeDataset.input_code == self["code"],
             ).execute()
+        node_cache.invalidate(old_database, self["code"])
 
+        # Edges from other nodes can point to this node
+        Database.set_dirty(old_database)
+        Database.set_dirty(new_database)
         db = Database(old_database)
 
         if db.searchable:
@@ -363,13 +574,13 @@ class Activity(ActivityProxyBase):
         else:
             self._data["database"] = new_database
 
-    def exchanges(self):
-        return Exchanges(self.key)
+    def exchanges(self, prefetch=False):
+        return Exchanges(self.key, prefetch=prefetch)
 
-    def edges(self):
-        return self.exchanges()
+    def edges(self, prefetch=False):
+        return self.exchanges(prefetch=prefetch)
 
-    def technosphere(self, include_substitution=False):
+    def technosphere(self, include_substitution=False, prefetch=False):
         return Exchanges(
             self.key,
             kinds=(
@@ -377,20 +588,23 @@ class Activity(ActivityProxyBase):
                 if include_substitution
                 else ("technosphere",)
             ),
+            prefetch=prefetch,
         )
 
-    def biosphere(self):
+    def biosphere(self, prefetch=False):
         return Exchanges(
             self.key,
             kinds=("biosphere",),
+            prefetch=prefetch,
         )
 
-    def production(self, include_substitution=False):
+    def production(self, include_substitution=False, prefetch=False):
         return Exchanges(
             self.key,
             kinds=("production", "substitution")
             if include_substitution
             else ("production",),
+            prefetch=prefetch,
         )
 
     def rp_exchange(self):
@@ -426,11 +640,33 @@ class Activity(ActivityProxyBase):
             kinds=("substitution",),
         )
 
-    def upstream(self, kinds=("technosphere", "generic consumption")):
-        return Exchanges(self.key, kinds=kinds, reverse=True)
+    def upstream(
+        self,
+        kinds=("technosphere", "generic consumption"),
+        prefetch=False,
+        limit=None,
+        offset=None,
+    ):
+        """Get the edges which consume this node, excluding its own production edges.
 
-    def consumers(self, kinds=("technosphere", "generic consumption")):
-        return self.upstream(kinds=kinds)
+        ``kinds`` are the edge types to include; use ``None`` for all types. ``limit`` and ``offset`` select a page of edges, ordered by edge id."""
+        return Exchanges(
+            self.key,
+            kinds=kinds,
+            reverse=True,
+            prefetch=prefetch,
+            limit=limit,
+            offset=offset,
+        )
+
+    def consumers(
+        self,
+        kinds=("technosphere", "generic consumption"),
+        prefetch=False,
+        limit=None,
+        offset=None,
+    ):
+        return self.upstream(kinds=kinds, prefetch=prefetch, limit=limit, offset=offset)
 
     def new_exchange(self, **kwargs):
         return self.new_edge(**kwargs)
@@ -494,27 +730,27 @@ class Exchange(ExchangeProxyBase):
             )
 
     def save(self):
-        from . import Database
-
         if not self.valid():
             raise ValidityError(
                 "This exchange can't be saved for the "
                 "following reasons\n\t* " + "\n\t* ".join(self.valid(why=True)[1])
             )
 
-        Database.set_dirty(self["output"][0])
+        changed = [self["output"]]
+        if self._document.id is not None:
+            changed.append((self._document.output_database, self._document.output_code))
 
         for key, value in dict_as_exchangedataset(self._data).items():
             setattr(self._document, key, value)
         self._document.save()
+        _set_nodes_dirty(changed)
 
     def delete(self):
         from ..parameters import ParameterizedExchange
-        from . import Database
 
         ParameterizedExchange.delete().where(
             ParameterizedExchange.exchange == self._document.id
         ).execute()
         self._document.delete_instance()
-        Database.set_dirty(self["output"][0])
+        _set_nodes_dirty([self["output"]])
         self = None
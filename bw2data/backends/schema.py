@@ -1,11 +1,68 @@
-from peewee import DoesNotExist, Model, TextField
+import math
+import numbers
+import threading
+from collections import OrderedDict
+
+from peewee import (
+    BooleanField,
+    DoesNotExist,
+    FloatField,
+    IntegerField,
+    Model,
+    TextField,
+)
 
 from ..errors import UnknownObject
-from ..sqlite import PickleField, TupleJSONField
+from ..sqlite import CodecField, TupleJSONField
+from ..utils import POSITIVE_DISTRIBUTIONS
+
+# Numeric edge attributes copied from ``data`` into their own columns, so that
+# processing doesn't need to deserialize each edge.
+EXCHANGE_NUMERIC_FIELDS = ("loc", "scale", "shape", "minimum", "maximum")
+# All numeric ``ExchangeDataset`` columns filled from the ``data`` blob
+EXCHANGE_COLUMNS = ("amount", "uncertainty_type", "negative") + EXCHANGE_NUMERIC_FIELDS
+
+
+def _as_float(value):
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):
+        value = float(value)
+        if math.isfinite(value):
+            return value
+    raise ValueError
+
+
+def exchange_columns(data):
+    """Get values for numeric ``ExchangeDataset`` columns from edge ``data``.
+
+    If any of these values is missing or isn't a finite number, all columns are ``null``, and processing uses the ``data`` blob instead."""
+    columns = dict.fromkeys(EXCHANGE_COLUMNS)
+    try:
+        amount = _as_float(data["amount"])
+        uncertainty_type = data.get("uncertainty_type", data.get("uncertainty type", 0))
+        if not isinstance(uncertainty_type, numbers.Integral) or isinstance(
+            uncertainty_type, bool
+        ):
+            raise ValueError
+        values = {
+            field: _as_float(data[field])
+            for field in EXCHANGE_NUMERIC_FIELDS
+            if field in data
+        }
+    except (KeyError, ValueError):
+        return columns
+
+    columns.update(values)
+    columns["amount"] = amount
+    columns["uncertainty_type"] = int(uncertainty_type)
+    if "negative" in data:
+        columns["negative"] = bool(data["negative"])
+    else:
+        columns["negative"] = amount < 0 and uncertainty_type in POSITIVE_DISTRIBUTIONS
+    return columns
 
 
 class ActivityDataset(Model):
-    data = PickleField()
+    data = CodecField()
     code = TextField()
     database = TextField()
     location = TupleJSONField(null=True)
@@ -19,21 +76,310 @@ class ActivityDataset(Model):
 
 
 class ExchangeDataset(Model):
-    data = PickleField()
+    data = CodecField()
     input_code = TextField()
     input_database = TextField()
     output_code = TextField()
     output_database = TextField()
     type = TextField()
+    amount = FloatField(null=True)
+    uncertainty_type = IntegerField(null=True)
+    loc = FloatField(null=True)
+    scale = FloatField(null=True)
+    shape = FloatField(null=True)
+    minimum = FloatField(null=True)
+    maximum = FloatField(null=True)
+    negative = BooleanField(null=True)
+    # ``ActivityDataset`` ids of the input and output nodes
+    input_id = IntegerField(null=True)
+    output_id = IntegerField(null=True)
+
+    def save(self, *args, **kwargs):
+        for key, value in exchange_columns(self.data).items():
+            setattr(self, key, value)
+        if (
+            self.id is None
+            or args
+            or kwargs
+            or set(self._meta.fields).difference(self.__data__)
+        ):
+            return super().save(*args, **kwargs)
+        # An ``UPDATE`` would fire ``exchangedataset_columns_update``, which can't
+        # tell that the numeric columns were written, and resets them if unchanged.
+        # Replacing the row writes them in one statement, and the insert trigger
+        # updates the node ids.
+        type(self).replace(**self.__data__).execute()
+        self._dirty.clear()
+        return 1
+
+
+# Indices created after bulk writes; the composite ``exchangedataset`` indices
+# match the filters on output node and edge type used by ``Exchanges`` and processing
+INDICES = {
+    "activitydataset_key": 'CREATE UNIQUE INDEX IF NOT EXISTS "activitydataset_key" ON "activitydataset" ("database", "code")',
+    "exchangedataset_input": 'CREATE INDEX IF NOT EXISTS "exchangedataset_input" ON "exchangedataset" ("input_database", "input_code")',
+    "exchangedataset_output_type": 'CREATE INDEX IF NOT EXISTS "exchangedataset_output_type" ON "exchangedataset" ("output_database", "type")',
+    "exchangedataset_output_code_type": 'CREATE INDEX IF NOT EXISTS "exchangedataset_output_code_type" ON "exchangedataset" ("output_database", "output_code", "type")',
+    "exchangedataset_input_id_type": 'CREATE INDEX IF NOT EXISTS "exchangedataset_input_id_type" ON "exchangedataset" ("input_id", "type")',
+    "exchangedataset_output_id_type": 'CREATE INDEX IF NOT EXISTS "exchangedataset_output_id_type" ON "exchangedataset" ("output_id", "type")',
+}
+# ``activitydataset_key`` is unique, so it's only created by writes, which check for
+# duplicate node keys. The other indices can always be added to existing data, so
+# duplicate keys can't stop projects from opening or being updated.
+EXISTING_DATA_INDICES = {
+    name: sql for name, sql in INDICES.items() if name != "activitydataset_key"
+}
+
+_NODE_ID_SQL = """(SELECT id FROM activitydataset WHERE database = {prefix}{side}_database AND code = {prefix}{side}_code)"""
+
+
+def node_id_sql(side, prefix="NEW."):
+    """SQL expression for the id of the ``input`` or ``output`` node of an exchange row"""
+    return _NODE_ID_SQL.format(side=side, prefix=prefix)
+
+
+# Keep ``ExchangeDataset.input_id`` and ``output_id`` consistent with the text
+# node keys, which remain the reference. Dropped during bulk writes, which
+# update the ids in one statement instead.
+NODE_ID_TRIGGERS = {
+    "exchangedataset_node_ids_insert": """CREATE TRIGGER IF NOT EXISTS "exchangedataset_node_ids_insert"
+        AFTER INSERT ON exchangedataset
+        BEGIN
+            UPDATE exchangedataset SET input_id = {input}, output_id = {output} WHERE id = NEW.id;
+        END""".format(
+        input=node_id_sql("input"), output=node_id_sql("output")
+    ),
+    "exchangedataset_node_ids_update": """CREATE TRIGGER IF NOT EXISTS "exchangedataset_node_ids_update"
+        AFTER UPDATE OF input_database, input_code, output_database, output_code, input_id, output_id ON exchangedataset
+        BEGIN
+            UPDATE exchangedataset SET input_id = {input}, output_id = {output} WHERE id = NEW.id;
+        END""".format(
+        input=node_id_sql("input"), output=node_id_sql("output")
+    ),
+    "activitydataset_node_ids_insert": """CREATE TRIGGER IF NOT EXISTS "activitydataset_node_ids_insert"
+        AFTER INSERT ON activitydataset
+        BEGIN
+            UPDATE exchangedataset SET input_id = NEW.id WHERE input_database = NEW.database AND input_code = NEW.code;
+            UPDATE exchangedataset SET output_id = NEW.id WHERE output_database = NEW.database AND output_code = NEW.code;
+        END""",
+    "activitydataset_node_ids_update": """CREATE TRIGGER IF NOT EXISTS "activitydataset_node_ids_update"
+        AFTER UPDATE OF database, code ON activitydataset
+        BEGIN
+            UPDATE exchangedataset SET input_id = NULL WHERE input_id = OLD.id;
+            UPDATE exchangedataset SET output_id = NULL WHERE output_id = OLD.id;
+            UPDATE exchangedataset SET input_id = NEW.id WHERE input_database = NEW.database AND input_code = NEW.code;
+            UPDATE exchangedataset SET output_id = NEW.id WHERE output_database = NEW.database AND output_code = NEW.code;
+        END""",
+    "activitydataset_node_ids_delete": """CREATE TRIGGER IF NOT EXISTS "activitydataset_node_ids_delete"
+        AFTER DELETE ON activitydataset
+        BEGIN
+            UPDATE exchangedataset SET input_id = NULL WHERE input_id = OLD.id;
+            UPDATE exchangedataset SET output_id = NULL WHERE output_id = OLD.id;
+        END""",
+}
+# The numeric ``ExchangeDataset`` columns are only a cache of values in the ``data``
+# blob. Updates of ``data`` which don't also change these columns, like bulk updates
+# or writes by older versions, reset them so that processing falls back to the blob.
+EXCHANGE_COLUMN_TRIGGERS = {
+    "exchangedataset_columns_update": """CREATE TRIGGER IF NOT EXISTS "exchangedataset_columns_update"
+        AFTER UPDATE OF data ON exchangedataset
+        WHEN {unchanged}
+        BEGIN
+            UPDATE exchangedataset SET {reset} WHERE id = NEW.id;
+        END""".format(
+        unchanged=" AND ".join(
+            "NEW.{0} IS OLD.{0}".format(field) for field in EXCHANGE_COLUMNS
+        ),
+        reset=", ".join("{} = NULL".format(field) for field in EXCHANGE_COLUMNS),
+    ),
+}
+# Replaced by ``exchangedataset_output_code_type``
+OBSOLETE_INDICES = ("exchangedataset_output",)
+
+
+class ChangeLog(Model):
+    """Nodes whose edges changed since their database was last processed.
+
+    A row with a ``null`` node means the whole database needs to be reprocessed."""
+
+    database = TextField(index=True)
+    node = IntegerField(null=True)
+
+    class Meta:
+        indexes = ((("database", "node"), True),)
+
+
+# Stay below the SQLite default limit of 999 variables per statement
+_SQL_CHUNK_SIZE = 500
+
+
+class NodeCache:
+    """Least recently used cache of node keys, node ids, and database backends.
+
+    Entries are only valid for the SQLite database the models are currently bound to, so the cache is emptied when the project changes, or when another connection changed the database. Code which changes node keys or database names must call ``invalidate``."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        # Least recently used order is kept in ``_ids``; ``_keys`` is its inverse
+        self._ids = OrderedDict()
+        self._keys = {}
+        self._backends = {}
+        self._bound = None
+        # Connection and ``PRAGMA data_version`` when last checked, per thread
+        self._local = threading.local()
+
+    def _check_project(self):
+        database = ActivityDataset._meta.database
+        if database is not self._bound:
+            self.clear()
+            self._bound = database
+        # Other connections, e.g. in other processes, can change node keys. The data
+        # version changes when they commit, but is only comparable within one
+        # connection, so a new connection also empties the cache.
+        connection = database.connection()
+        version = (connection, connection.execute("PRAGMA data_version").fetchone()[0])
+        if getattr(self._local, "version", None) != version:
+            self.clear()
+            self._local.version = version
+
+    def clear(self):
+        self._ids.clear()
+        self._keys.clear()
+        self._backends.clear()
+
+    def add(self, key, id_):
+        self.add_many([(key, id_)])
+
+    def add_many(self, items):
+        """Cache ``(key, id)`` pairs"""
+        self._check_project()
+        for key, id_ in items:
+            # Drop stale entries, so single nodes can be invalidated without scanning
+            if self._ids.get(key, id_) != id_:
+                del self._keys[self._ids[key]]
+            if self._keys.get(id_, key) != key:
+                del self._ids[self._keys[id_]]
+            self._ids[key] = id_
+            self._ids.move_to_end(key)
+            self._keys[id_] = key
+            while len(self._ids) > self.maxsize:
+                del self._keys[self._ids.popitem(last=False)[1]]
+
+    def get_id(self, key):
+        """Get the cached id for ``key``, or ``None``"""
+        self._check_project()
+        try:
+            self._ids.move_to_end(key)
+        except KeyError:
+            return None
+        return self._ids[key]
+
+    def get_ids(self, keys):
+        """Get the cached ids for ``keys``, with ``None`` for keys which aren't cached"""
+        self._check_project()
+        ids = []
+        for key in keys:
+            try:
+                self._ids.move_to_end(key)
+            except KeyError:
+                ids.append(None)
+            else:
+                ids.append(self._ids[key])
+        return ids
+
+    def get_key(self, id_):
+        """Get the cached key for ``id_``, or ``None``"""
+        self._check_project()
+        try:
+            key = self._keys[id_]
+        except KeyError:
+            return None
+        self._ids.move_to_end(key)
+        return key
+
+    def backend(self, database):
+        """Get the backend name of ``database``. Databases which don't exist (yet) aren't cached."""
+        self._check_project()
+        try:
+            return self._backends[database]
+        except KeyError:
+            from .base import Database
+
+            try:
+                backend = Database.get(Database.name == database).backend
+            except DoesNotExist:
+                return Database(database).backend
+            self._backends[database] = backend
+            return backend
+
+    def invalidate(self, database, code=None):
+        """Remove cached entries for ``database``, or only for the node ``(database, code)`` if ``code`` is given."""
+        self._check_project()
+        if code is not None:
+            id_ = self._ids.pop((database, code), None)
+            if id_ is not None:
+                del self._keys[id_]
+            return
+        self._backends.pop(database, None)
+        for key in [key for key in self._ids if key[0] == database]:
+            del self._keys[self._ids.pop(key)]
+
+
+node_cache = NodeCache()
 
 
 def get_id(key):
     if isinstance(key, int):
         return key
     else:
+        key = (key[0], key[1])
+        id_ = node_cache.get_id(key)
+        if id_ is not None:
+            return id_
         try:
-            return ActivityDataset.get(
+            id_ = ActivityDataset.get(
                 ActivityDataset.database == key[0], ActivityDataset.code == key[1]
             ).id
         except DoesNotExist:
             raise UnknownObject
+        node_cache.add(key, id_)
+        return id_
+
+
+def get_ids(keys):
+    """Get the ids for a list of node ``keys``, in the same order.
+
+    Uses one query per database (and per ``_SQL_CHUNK_SIZE`` keys) for keys which aren't cached. Integers are returned unchanged. Raises ``UnknownObject`` if any key doesn't exist."""
+    keys = [key if isinstance(key, int) else (key[0], key[1]) for key in keys]
+    text_keys = [key for key in keys if not isinstance(key, int)]
+    found = {
+        key: id_
+        for key, id_ in zip(text_keys, node_cache.get_ids(text_keys))
+        if id_ is not None
+    }
+    missing = {}
+    for key in keys:
+        if not isinstance(key, int) and key not in found:
+            missing.setdefault(key[0], set()).add(key[1])
+
+    for database, codes in missing.items():
+        codes = sorted(codes)
+        for index in range(0, len(codes), _SQL_CHUNK_SIZE):
+            qs = ActivityDataset.select(ActivityDataset.code, ActivityDataset.id).where(
+                ActivityDataset.database == database,
+                ActivityDataset.code << codes[index : index + _SQL_CHUNK_SIZE],
+            )
+            new = {(database, code): id_ for code, id_ in qs.tuples()}
+            found.update(new)
+            node_cache.add_many(new.items())
+
+    result = []
+    for key in keys:
+        if isinstance(key, int):
+            result.append(key)
+            continue
+        id_ = found.get(key)
+        if id_ is None:
+            raise UnknownObject("Can't find node {}".format(key))
+        result.append(id_)
+    return result
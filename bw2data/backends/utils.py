@@ -2,11 +2,25 @@ import copy
 import warnings
 
 import numpy as np
+from bw_processing.array_creation import create_structured_array
+from bw_processing.constants import INDICES_DTYPE, UNCERTAINTY_DTYPE
+from bw_processing.utils import dictionary_formatter
+from numpy.lib.recfunctions import repack_fields
 
 from ..errors import InvalidExchange, UntypedExchange
 from ..meta import methods
 from ..method import Method
-from .schema import get_id
+from .schema import exchange_columns, get_id
+
+
+# Combined dtype used by ``bw_processing`` when building vectors from dictionaries
+VECTOR_DTYPE = (
+    INDICES_DTYPE + [("amount", np.float32)] + UNCERTAINTY_DTYPE + [("flip", bool)]
+)
+# Same sort order as ``bw_processing.utils.resolve_dict_iterator``
+VECTOR_SORT_ORDER = ["row", "col", "amount", "uncertainty_type"] + sorted(
+    name for name, _ in VECTOR_DTYPE[4:]
+)
 
 
 def get_csv_data_dict(ds):
@@ -43,14 +57,15 @@ def dict_as_exchangedataset(ds):
     input_ = ds.pop("input")
     output_ = ds.pop("output")
 
-    return {
-        "data": ds,
-        "input_database": input_[0],
-        "input_code": input_[1],
-        "output_database": output_[0],
-        "output_code": output_[1],
-        "type": ds.pop("type"),
-    }
+    return dict(
+        data=ds,
+        input_database=input_[0],
+        input_code=input_[1],
+        output_database=output_[0],
+        output_code=output_[1],
+        type=ds.pop("type"),
+        **exchange_columns(ds),
+    )
 
 
 def replace_cfs(old_key, new_key):
@@ -89,3 +104,58 @@ def retupleize_geo_strings(value):
     except NameError:
         # Not everything with a parentheses is a tuple.
         return value
+
+
+def dicts_as_vector_array(iterator, nrows=None):
+    """Create a combined vector array from an iterator of ``bw_processing`` row dictionaries"""
+    return create_structured_array(
+        (dictionary_formatter(row) for row in iterator), VECTOR_DTYPE, nrows=nrows
+    )
+
+
+def datapackage_vector_as_array(datapackage, name):
+    """Rebuild the combined vector array for the resource group ``name`` in ``datapackage``.
+
+    Distributions and flip arrays are only stored when needed, so fill in the defaults used in ``bw_processing.utils.dictionary_formatter`` if they are missing.
+
+    Raises ``KeyError`` if the resource group is not present."""
+    resources = {
+        obj["kind"]: index
+        for index, obj in enumerate(datapackage.resources)
+        if obj.get("group") == name
+    }
+    if "indices" not in resources or "data" not in resources:
+        raise KeyError(name)
+
+    indices = datapackage.data[resources["indices"]]
+    array = np.zeros(len(indices), dtype=VECTOR_DTYPE)
+    array["row"] = indices["row"]
+    array["col"] = indices["col"]
+    array["amount"] = datapackage.data[resources["data"]]
+    if "distributions" in resources:
+        distributions = datapackage.data[resources["distributions"]]
+        for field, _ in UNCERTAINTY_DTYPE:
+            array[field] = distributions[field]
+    else:
+        array["loc"] = array["amount"]
+        for field in ("scale", "shape", "minimum", "maximum"):
+            array[field] = np.nan
+    if "flip" in resources:
+        array["flip"] = datapackage.data[resources["flip"]]
+    return array
+
+
+def add_vector_array(datapackage, array, matrix, name, **kwargs):
+    """Sort a combined vector array and add it to ``datapackage`` as a persistent vector"""
+    array.sort(order=VECTOR_SORT_ORDER)
+    datapackage.add_persistent_vector(
+        matrix=matrix,
+        name=name,
+        data_array=array["amount"],
+        indices_array=repack_fields(array[["row", "col"]]),
+        distributions_array=repack_fields(
+            array[[field for field, _ in UNCERTAINTY_DTYPE]]
+        ),
+        flip_array=array["flip"],
+        **kwargs,
+    )
@@ -159,8 +159,10 @@ def extract_brightway_databases(
     activity_qs = ActivityDataset.select().where(
         ActivityDataset.database << database_names
     )
-    exchange_qs = ExchangeDataset.select().where(
-        ExchangeDataset.output_database << database_names
+    exchange_qs = (
+        ExchangeDataset.select()
+        .where(ExchangeDataset.output_database << database_names)
+        .order_by(ExchangeDataset.id)
     )
 
     # Retrieve all activity data
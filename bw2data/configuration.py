@@ -25,5 +25,45 @@ class Config:
         Default name is ``GLO``; change this by changing ``config.p["global_location"]``."""
         return self.p.get("global_location", "GLO")
 
+    @property
+    def field_codec(self):
+        """Get name of codec used to serialize node and edge data in SQLite databases.
+
+        Default codec is ``pickle``; change this by changing ``config.p["field_codec"]``. ``msgpack`` is available if the ``msgpack`` library is installed. Existing data is readable with any codec."""
+        return self.p.get("field_codec", "pickle")
+
+    @property
+    def bulk_import_pragmas(self):
+        """Get SQLite pragmas to use while writing whole databases, as a dictionary.
+
+        Default is no changes. Faster but less crash-safe settings are in ``bw2data.sqlite.BULK_IMPORT_PRAGMAS``; use them by changing ``config.p["bulk_import_pragmas"]``."""
+        return self.p.get("bulk_import_pragmas", {})
+
+    @property
+    def search_index_writer(self):
+        """Get keyword arguments for the Whoosh writer used to index whole databases, as a dictionary.
+
+        Default is a single process writer. Use e.g. ``{"procs": 4, "limitmb": 256, "multisegment": True}`` for Whoosh's multiprocessing writer by changing ``config.p["search_index_writer"]``."""
+        return self.p.get("search_index_writer", {})
+
+    @property
+    def datapackage_storage(self):
+        """Get storage format of processed datapackages, either ``zip`` or ``directory``.
+
+        Default is ``zip``, with compressed NumPy arrays. With ``directory``, arrays are stored as uncompressed ``.npy`` files, which are memory-mapped when loaded. Change this by changing ``config.p["datapackage_storage"]``; datapackages are stored in the new format when they are processed again."""
+        return self.p.get("datapackage_storage", "zip")
+
+    @property
+    def sqlite_connection(self):
+        """Get settings for new SQLite connections to project databases, as a dictionary.
+
+        Possible keys are ``busy_timeout`` (seconds to wait for a lock, default 5), ``cache_size`` (value of the SQLite ``cache_size`` pragma), ``journal_mode`` (e.g. ``"wal"``), and ``pool`` (maximum number of pooled connections; default is one connection per thread). Other keys, like ``synchronous``, are set as SQLite pragmas. These settings take precedence over the project settings of ``projects.set_wal``. Change these by changing ``config.p["sqlite_connection"]``; the settings are applied when a project is opened."""
+        try:
+            preferences = self.p
+        except AttributeError:
+            # Project preferences aren't loaded yet
+            return {}
+        return preferences.get("sqlite_connection", {})
+
 
 config = Config()
@@ -1,14 +1,9 @@
 import pickle
 
-from bw_processing import (
-    clean_datapackage_name,
-    create_datapackage,
-    load_datapackage,
-    safe_filename,
-)
-from fs.zipfs import ZipFS
+from bw_processing import clean_datapackage_name, create_datapackage, safe_filename
 
 from . import projects
+from .datapackages import datapackage_cache, processed_filename, processed_filesystem
 from .errors import MissingIntermediateData, UnknownObject
 from .fatomic import open as atomic_open
 
@@ -153,13 +148,13 @@ class ProcessedDataStore(DataStore):
         return projects.dir / "processed"
 
     def filename_processed(self):
-        return clean_datapackage_name(self.filename + ".zip")
+        return processed_filename(self.filename)
 
     def filepath_processed(self):
         return self.dirpath_processed() / self.filename_processed()
 
     def datapackage(self):
-        return load_datapackage(ZipFS(self.filepath_processed()))
+        return datapackage_cache.get(self.filepath_processed())
 
     def write(self, data, process=True):
         """Serialize intermediate data to disk.
@@ -194,8 +189,9 @@ class ProcessedDataStore(DataStore):
 
         """
         data = self.load()
+        self.cache_ids(data)
         dp = create_datapackage(
-            fs=ZipFS(str(self.filepath_processed()), write=True),
+            fs=processed_filesystem(self.filepath_processed()),
             name=self.filename_processed(),
             sum_intra_duplicates=True,
             sum_inter_duplicates=False,
@@ -218,6 +214,15 @@ class ProcessedDataStore(DataStore):
         """
         return
 
+    def cache_ids(self, data):
+        """Look up the integer ids of all nodes in ``data`` before processing, if necessary.
+
+        Args:
+            * *data* (object): The data
+
+        """
+        return
+
     def validate(self, data):
         """Validate data. Must be called manually."""
         self.validator(data)
@@ -0,0 +1,413 @@
+import copy
+import json
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
+import numpy as np
+from bw_processing import (
+    INDICES_DTYPE,
+    Datapackage,
+    UndefinedInterface,
+    clean_datapackage_name,
+    load_datapackage,
+)
+from bw_processing.errors import InvalidMimetype
+from bw_processing.io_helpers import file_reader
+from fs.osfs import OSFS
+from fs.zipfs import ZipFS
+
+from .configuration import config
+
+NUMPY_MEDIATYPE = "application/octet-stream"
+DEFAULT_CHUNKSIZE = 1_000_000
+
+
+def processed_filename(filename):
+    """Get the filename of a processed datapackage for the safe filename ``filename``.
+
+    Uses the storage format of ``config.datapackage_storage``: a ``.zip`` file, or a directory of ``.npy`` files."""
+    if config.datapackage_storage == "directory":
+        return clean_datapackage_name(filename)
+    return clean_datapackage_name(filename + ".zip")
+
+
+def processed_filesystem(filepath):
+    """Get a filesystem to write a new processed datapackage at ``filepath``, replacing any existing datapackage.
+
+    ``filepath`` is a ZIP file if it ends with ``.zip``, and a directory otherwise."""
+    filepath = Path(filepath)
+    datapackage_cache.evict(filepath)
+    if filepath.suffix == ".zip":
+        return ZipFS(str(filepath), write=True)
+    if filepath.is_dir():
+        # Resources of the previous datapackage could be left otherwise
+        shutil.rmtree(filepath)
+    filepath.mkdir(parents=True)
+    return OSFS(str(filepath))
+
+
+def processed_filepath(filepath):
+    """Get the path of the existing processed datapackage for ``filepath``.
+
+    Returns the datapackage in the other storage format if ``filepath`` doesn't exist, e.g. after ``config.datapackage_storage`` was changed but the datapackage wasn't processed again."""
+    filepath = Path(filepath)
+    if filepath.exists():
+        return filepath
+    if filepath.suffix == ".zip":
+        other = filepath.with_suffix("")
+    else:
+        other = filepath.with_name(filepath.name + ".zip")
+    return other if other.exists() else filepath
+
+
+def open_datapackage(filepath):
+    """Load the processed datapackage at ``filepath``, a ZIP file or a directory.
+
+    NumPy arrays in directories are memory-mapped read-only, so they are only read from disk when used."""
+    filepath = processed_filepath(filepath)
+    if not filepath.is_dir():
+        return load_datapackage(ZipFS(str(filepath)))
+
+    dp = Datapackage()
+    dp.fs = OSFS(str(filepath))
+    with open(filepath / "datapackage.json", encoding="utf-8") as f:
+        dp.metadata = json.load(f)
+    dp.data = []
+    for resource in dp.resources:
+        if resource.get("mediatype") == NUMPY_MEDIATYPE:
+            dp.data.append(
+                np.load(filepath / resource["path"], mmap_mode="r", allow_pickle=False)
+            )
+            continue
+        try:
+            dp.data.append(
+                file_reader(
+                    fs=dp.fs, resource=resource["path"], mimetype=resource["mediatype"]
+                )
+            )
+        except (InvalidMimetype, KeyError):
+            dp.data.append(UndefinedInterface())
+    return dp
+
+
+def derived_data(dp):
+    """Get a dictionary to store data derived from the arrays of the datapackage ``dp``, like sorted copies or indices.
+
+    The dictionary is shared by all copies of a datapackage returned by ``datapackage_cache``, so derived data is only computed once per datapackage file."""
+    try:
+        return dp._bw2data_derived
+    except AttributeError:
+        dp._bw2data_derived = {}
+        return dp._bw2data_derived
+
+
+def _npy_header(dtype, nrows):
+    """Header of a ``.npy`` file with ``nrows`` elements of ``dtype``.
+
+    Padded with spaces to the same size for any ``nrows``, so it can be written before the number of rows is known and replaced afterwards."""
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": (int(nrows),),
+        }
+    )
+    longest = len(header) - len(str(int(nrows))) + len(str(np.iinfo(np.int64).max))
+    # Magic string, version, and header length take 10 bytes; data is aligned to 64 bytes
+    size = -(-(10 + longest + 1) // 64) * 64
+    header = header.ljust(size - 11) + "\n"
+    return (
+        np.lib.format.magic(1, 0)
+        + len(header).to_bytes(2, "little")
+        + header.encode("latin1")
+    )
+
+
+def _block_arrays(block):
+    """Get ``(indices, data, flip)`` arrays from ``block``, which has ``row``, ``col``, ``amount``, and optionally ``flip`` columns."""
+    if isinstance(block, np.ndarray):
+        columns = block.dtype.names or ()
+    else:
+        columns = block.keys()
+    missing = {"row", "col", "amount"}.difference(columns)
+    if missing:
+        raise ValueError("Block is missing column(s): {}".format(sorted(missing)))
+
+    data = np.asarray(block["amount"], dtype=np.float64).reshape(-1)
+    indices = np.empty(len(data), dtype=INDICES_DTYPE)
+    indices["row"] = np.asarray(block["row"]).reshape(-1)
+    indices["col"] = np.asarray(block["col"]).reshape(-1)
+    if "flip" in columns:
+        flip = np.asarray(block["flip"], dtype=bool).reshape(-1)
+    else:
+        flip = np.zeros(len(data), dtype=bool)
+    if not (len(indices) == len(flip) == len(data)):
+        raise ValueError("Block columns have different lengths")
+    return indices, data, flip
+
+
+def iterate_vector_blocks(blocks, chunksize=DEFAULT_CHUNKSIZE):
+    """Iterate over ``(indices, data, flip)`` arrays of at most ``chunksize`` rows from ``blocks``.
+
+    Each element of ``blocks`` can be:
+
+    * A dictionary of arrays, a pandas ``DataFrame``, or a NumPy structured array with ``row``, ``col``, ``amount``, and optionally ``flip`` columns.
+    * The path of a ``.npy`` file with such a structured array. The file is memory-mapped.
+    * The path of a Parquet file with these columns. Requires ``pyarrow``."""
+    for block in blocks:
+        if isinstance(block, (str, Path)):
+            path = Path(block)
+            if path.suffix == ".parquet":
+                yield from _parquet_blocks(path, chunksize)
+                continue
+            block = np.load(path, mmap_mode="r", allow_pickle=False)
+
+        if isinstance(block, np.ndarray):
+            for start in range(0, max(len(block), 1), chunksize):
+                yield _block_arrays(block[start : start + chunksize])
+        elif isinstance(block, Mapping):
+            # Slices of the arrays are views
+            block = {key: np.asarray(value) for key, value in block.items()}
+            for start in range(0, max(len(block.get("amount", ())), 1), chunksize):
+                yield _block_arrays(
+                    {
+                        key: value[start : start + chunksize]
+                        for key, value in block.items()
+                    }
+                )
+        else:
+            # pandas DataFrame; only the rows of each chunk are converted
+            for start in range(0, max(len(block), 1), chunksize):
+                chunk = block.iloc[start : start + chunksize]
+                yield _block_arrays(
+                    {column: chunk[column].to_numpy() for column in chunk.columns}
+                )
+
+
+def _parquet_blocks(path, chunksize):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet files requires `pyarrow`")
+
+    parquet_file = pq.ParquetFile(path)
+    columns = [
+        column
+        for column in ("row", "col", "amount", "flip")
+        if column in parquet_file.schema_arrow.names
+    ]
+    for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+        yield _block_arrays(
+            {
+                name: batch.column(name).to_numpy(zero_copy_only=False)
+                for name in columns
+            }
+        )
+
+
+class PersistentVectorWriter:
+    """Write a persistent vector to the datapackage ``dp`` block by block, without keeping the data in memory.
+
+    Blocks are appended to ``.npy`` files in the filesystem of ``dp``; the array headers are completed by ``close``, which also adds the resources to ``dp``. Like ``Datapackage.add_persistent_vector``, the ``flip`` array is only kept if at least one value is flipped.
+
+    Usage:
+
+    .. code-block:: python
+
+        with PersistentVectorWriter(dp, matrix="technosphere_matrix", name="foo") as writer:
+            for indices, data, flip in iterate_vector_blocks(blocks):
+                writer.append(indices, data, flip)
+
+    """
+
+    KINDS = {
+        "indices": np.dtype(INDICES_DTYPE),
+        "data": np.dtype(np.float64),
+        "flip": np.dtype(bool),
+    }
+
+    def __init__(self, dp, matrix, name):
+        self.dp = dp
+        self.matrix = matrix
+        self.name = name
+        self.nrows = 0
+        self.flipped = False
+        self._files = {}
+        for kind in self.KINDS:
+            self._files[kind] = dp.fs.openbin(self._path(kind), "w")
+            self._files[kind].write(_npy_header(self.KINDS[kind], 0))
+
+    def _path(self, kind):
+        return "{}.{}.npy".format(self.name, kind)
+
+    def append(self, indices, data, flip):
+        arrays = {"indices": indices, "data": data, "flip": flip}
+        for kind, dtype in self.KINDS.items():
+            self._files[kind].write(np.ascontiguousarray(arrays[kind], dtype).tobytes())
+        self.nrows += len(data)
+        self.flipped = self.flipped or bool(flip.any())
+
+    def close(self):
+        kinds = [kind for kind in self.KINDS if kind != "flip" or self.flipped]
+        for kind, file in self._files.items():
+            file.seek(0)
+            file.write(_npy_header(self.KINDS[kind], self.nrows))
+            file.close()
+        if not self.flipped:
+            self.dp.fs.remove(self._path("flip"))
+
+        for kind in kinds:
+            self.dp.data.append(
+                file_reader(
+                    fs=self.dp.fs,
+                    resource=self._path(kind),
+                    mimetype=NUMPY_MEDIATYPE,
+                    proxy=True,
+                )
+            )
+            self.dp.resources.append(
+                {
+                    "profile": "data-resource",
+                    "format": "npy",
+                    "mediatype": NUMPY_MEDIATYPE,
+                    "name": "{}.{}".format(self.name, kind),
+                    "matrix": self.matrix,
+                    "kind": kind,
+                    "path": self._path(kind),
+                    "group": self.name,
+                    "category": "vector",
+                    "nrows": self.nrows,
+                }
+            )
+        return self.nrows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            for file in self._files.values():
+                file.close()
+
+
+def column_index(cols):
+    """Index the column ids ``cols`` of a persistent vector by column.
+
+    Returns a dictionary with the ``order`` which sorts ``cols`` (stable, so edges of a column stay in the order they were written), the sorted unique ``columns``, and the ``offsets`` of each column in ``order`` (with the number of rows at the end)."""
+    order = np.argsort(cols, kind="stable")
+    columns, starts = np.unique(np.asarray(cols)[order], return_index=True)
+    return {
+        "order": order,
+        "columns": columns,
+        "offsets": np.append(starts, len(order)),
+    }
+
+
+def add_column_index(dp, group):
+    """Add the ``column_index`` of the persistent vector ``group`` to the datapackage ``dp``, so it doesn't need to be computed when reading.
+
+    The index arrays are added as ``{group}.column_{kind}`` resources with the category ``column index``. They have no ``matrix``, so they are ignored when building matrices. Sorting the column ids holds them, and the ``order`` array, in memory while writing."""
+    indices, _ = dp.get_resource("{}.indices".format(group))
+    for kind, array in column_index(indices["col"]).items():
+        name = "{}.column_{}".format(group, kind)
+        path = "{}.npy".format(name)
+        with dp.fs.openbin(path, "w") as f:
+            np.save(f, array, allow_pickle=False)
+        dp.data.append(
+            file_reader(fs=dp.fs, resource=path, mimetype=NUMPY_MEDIATYPE, proxy=True)
+        )
+        dp.resources.append(
+            {
+                "profile": "data-resource",
+                "format": "npy",
+                "mediatype": NUMPY_MEDIATYPE,
+                "name": name,
+                "kind": kind,
+                "path": path,
+                "group": group,
+                "category": "column index",
+                "nrows": len(array),
+            }
+        )
+
+
+def add_persistent_vector_from_blocks(
+    dp, blocks, matrix, name, chunksize=DEFAULT_CHUNKSIZE, progress=None
+):
+    """Add a persistent vector to the datapackage ``dp`` from ``blocks``, see ``iterate_vector_blocks``.
+
+    Only one block at a time is held in memory. ``progress`` is an optional callable, called with the number of rows written so far and the elapsed time in seconds after each block.
+
+    Returns the number of rows written."""
+    start = time.perf_counter()
+    with PersistentVectorWriter(dp, matrix=matrix, name=name) as writer:
+        for indices, data, flip in iterate_vector_blocks(blocks, chunksize):
+            writer.append(indices, data, flip)
+            if progress is not None:
+                progress(writer.nrows, time.perf_counter() - start)
+    return writer.nrows
+
+
+class DatapackageCache:
+    """Process-wide cache of loaded processed datapackages, keyed by path and modification time.
+
+    Each call to ``get`` returns a new ``Datapackage`` object, with its own metadata, which shares the (read-only) arrays of the cached datapackage. Keeps at most ``maxsize`` datapackages."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._datapackages = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stamp(filepath):
+        if filepath.is_dir():
+            # Written last by ``finalize_serialization``
+            filepath = filepath / "datapackage.json"
+        stat = filepath.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, filepath):
+        filepath = processed_filepath(Path(filepath).absolute())
+        stamp = self._stamp(filepath)
+        with self._lock:
+            cached = self._datapackages.get(filepath)
+            if cached is not None and cached[0] == stamp:
+                self._datapackages.move_to_end(filepath)
+                return self._copy(cached[1])
+
+        dp = open_datapackage(filepath)
+        derived_data(dp)
+        for array in dp.data:
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+        with self._lock:
+            self._datapackages[filepath] = (stamp, dp)
+            self._datapackages.move_to_end(filepath)
+            while len(self._datapackages) > self.maxsize:
+                self._datapackages.popitem(last=False)
+        return self._copy(dp)
+
+    @staticmethod
+    def _copy(dp):
+        obj = copy.copy(dp)
+        obj.metadata = copy.deepcopy(dp.metadata)
+        obj.data = list(dp.data)
+        obj._modified = set()
+        return obj
+
+    def evict(self, filepath):
+        with self._lock:
+            self._datapackages.pop(Path(filepath).absolute(), None)
+
+    def clear(self):
+        with self._lock:
+            self._datapackages.clear()
+
+
+datapackage_cache = DatapackageCache()
@@ -1,5 +1,5 @@
 from . import config, geomapping, methods
-from .backends.schema import get_id
+from .backends.schema import get_id, get_ids
 from .errors import UnknownObject
 from .ia_data_store import ImpactAssessmentDataStore
 from .utils import as_uncertainty_dict, get_geocollection
@@ -38,6 +38,14 @@ class Method(ImpactAssessmentDataStore):
     validator = ia_validator
     matrix = "characterization_matrix"
 
+    def cache_ids(self, data):
+        """Look up all flow ids with a few queries, so ``process_row`` doesn't query the database for each row."""
+        try:
+            get_ids([row[0] for row in data])
+        except UnknownObject:
+            # Raised with a more helpful message in ``process_row``
+            pass
+
     def add_geomappings(self, data):
         geomapping.add({x[2] for x in data if len(x) == 3})
 
@@ -0,0 +1,49 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def _initialize_worker(project_name):
+    """Switch the worker to the parent project, and only allow reading SQLite data"""
+    from . import config, projects
+
+    if projects.current != project_name:
+        projects.set_current(project_name, writable=False, update=False)
+    for _, substitutable_db in config.sqlite3_databases:
+        substitutable_db.make_read_only()
+
+
+def _process_object(kind, name):
+    """Build the datapackage for one object in a worker process.
+
+    Returns the set of dependent databases for ``Database`` objects, and ``None`` otherwise."""
+    from . import Database, Method, Normalization, Weighting
+
+    if kind == "database":
+        return Database(name)._write_processed()
+
+    classes = {
+        "method": Method,
+        "weighting": Weighting,
+        "normalization": Normalization,
+    }
+    classes[kind](name).process()
+
+
+def process_in_parallel(objects, processes):
+    """Build datapackages for ``objects`` in a pool of ``processes`` worker processes.
+
+    ``objects`` is a list of ``(kind, name)`` tuples, where ``kind`` is one of ``database``, ``method``, ``weighting``, or ``normalization``.
+
+    Workers only write datapackage files; any changes to metadata (e.g. ``Database.dirty`` and ``Database.depends``) need to be saved by the caller. Yields ``(kind, name, result)`` tuples as the workers finish, where ``result`` is the set of dependent databases for ``database`` objects and ``None`` otherwise."""
+    from . import projects
+
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_initialize_worker,
+        initargs=(projects.current,),
+    ) as executor:
+        futures = {
+            executor.submit(_process_object, kind, name): (kind, name)
+            for kind, name in objects
+        }
+        for future in as_completed(futures):
+            yield futures[future] + (future.result(),)
@@ -14,7 +14,7 @@ from peewee import BooleanField, DoesNotExist, Model, TextField
 
 from . import config
 from .filesystem import create_dir
-from .sqlite import PickleField, SubstitutableDatabase
+from .sqlite import WAL_SETTINGS, PickleField, SubstitutableDatabase
 from .utils import maybe_path
 
 READ_ONLY_PROJECT = """
@@ -204,8 +204,29 @@ class ProjectManager(Iterable):
             obj.__init__()
 
     def _reset_sqlite3_databases(self):
+        wal = self.dataset.data.get("wal")
+        if wal:
+            settings = WAL_SETTINGS
+        elif wal is None:
+            settings = {}
+        else:
+            # Journal mode is stored in the database file
+            settings = {"journal_mode": "delete"}
         for relative_path, substitutable_db in config.sqlite3_databases:
-            substitutable_db.change_path(self.dir / relative_path)
+            substitutable_db.change_path(self.dir / relative_path, settings)
+
+    @property
+    def wal(self):
+        """Whether the SQLite databases of the current project use write-ahead logging"""
+        return bool(self.dataset.data.get("wal"))
+
+    def set_wal(self, enabled=True):
+        """Enable or disable write-ahead logging for the SQLite databases (``databases.db`` and ``parameters.db``) of the current project.
+
+        With write-ahead logging, other processes (e.g. opened with ``projects.set_current(name, writable=False)``) can read the project while it is being written. The setting is stored in the project, and the databases are reopened to apply it."""
+        self.dataset.data["wal"] = bool(enabled)
+        self.dataset.save()
+        self._reset_sqlite3_databases()
 
     ### Public API
     @property
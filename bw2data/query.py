@@ -1,4 +1,5 @@
 import collections
+import heapq
 import itertools
 import operator
 
@@ -34,10 +35,10 @@ def try_op(f, x, y):
 class Dictionaries:
     """Pretends to be a single dictionary when applying a ``Query`` to multiple databases.
 
+    Each argument can be a dictionary, an object with an ``iter_datasets`` method (like ``Database``), or an iterable of ``(key, dataset)`` pairs. Databases are streamed, not loaded into memory.
+
     Usage:
-        first_database = Database(...).load()
-        second_database = Database(...).load()
-        my_joined_dataset = Dictionaries(first_database, second_database)
+        my_joined_dataset = Dictionaries(Database(...), Database(...))
         search_results = Query(filter_1, filter_2)(my_joined_dataset)
 
     """
@@ -45,24 +46,66 @@ class Dictionaries:
     def __init__(self, *args):
         self.dicts = args
 
+    def _items(self, obj):
+        if hasattr(obj, "items"):
+            return obj.items()
+        elif hasattr(obj, "iter_datasets"):
+            return obj.iter_datasets()
+        else:
+            return obj
+
     def items(self):
-        return itertools.chain(*[x.items() for x in self.dicts])
+        return itertools.chain.from_iterable(self._items(obj) for obj in self.dicts)
 
 
 class Result:
     """A container that wraps a filtered dataset. Returned by a calling a ``Query`` object. A result object functions like a read-only dictionary; you can call ``Result[some_key]``, or ``some_key in Result``, or ``len(Result)``.
 
-    The dataset can also be sorted, using ``sort(field)``; the underlying data is then a ``collections.OrderedDict``.
+    The filtered dataset is evaluated lazily: iterating over a result only filters as much of the data as needed, and ``limit`` returns a new result with at most ``n`` entries. The dataset can also be sorted, using ``sort(field)``; the underlying data is then a ``collections.OrderedDict``.
 
     Args:
-        * *result* (dict): The filtered dataset.
+        * *result* (dict or iterable): The filtered dataset, or an iterable of ``(key, dataset)`` pairs.
 
     """
 
     def __init__(self, result):
-        self.result = result
-        if not isinstance(result, dict):
-            raise ValueError("Must pass dictionary")
+        if isinstance(result, dict):
+            self._result, self._pending = result, None
+        elif hasattr(result, "__iter__") and not isinstance(result, (str, bytes)):
+            self._result, self._pending = {}, iter(result)
+        else:
+            raise ValueError("Must pass dictionary or iterable of (key, value) pairs")
+        self._keys = list(self._result)
+
+    @property
+    def result(self):
+        for _ in self._iter_items():
+            pass
+        return self._result
+
+    @result.setter
+    def result(self, value):
+        self._result, self._pending, self._keys = value, None, list(value)
+
+    def _iter_items(self):
+        # Read from the cache first, then add to the cache from the pending iterator
+        position = 0
+        while True:
+            if position < len(self._keys):
+                key = self._keys[position]
+                yield key, self._result[key]
+                position += 1
+            elif self._pending is None:
+                return
+            else:
+                try:
+                    key, value = next(self._pending)
+                except StopIteration:
+                    self._pending = None
+                    return
+                if key not in self._result:
+                    self._keys.append(key)
+                self._result[key] = value
 
     def __str__(self):
         return "Query result with %i entries" % len(self.result)
@@ -75,28 +118,34 @@ class Result:
             ["%s: %s" % (k, v.get("name", "Unknown")) for k, v in data]
         )
 
-    def sort(self, field, reverse=False):
+    def limit(self, n):
+        """Return a new ``Result`` with at most the first ``n`` entries. Only filters as much data as needed."""
+        return Result(itertools.islice(self._iter_items(), n))
+
+    def sort(self, field, reverse=False, limit=None):
         """Sort the filtered dataset. Operates in place; does not return anything.
 
         Args:
             * *field* (str): The key used for sorting.
             * *reverse* (bool, optional): Reverse normal sorting order.
+            * *limit* (int, optional): Only keep the first ``limit`` entries. Uses a heap instead of sorting all entries.
 
         """
-        self.result = collections.OrderedDict(
-            sorted(
-                self.result.items(),
-                key=lambda t: t[1].get(field, None),
-                reverse=reverse,
-            )
-        )
+        key = lambda t: t[1].get(field, None)
+        if limit is None:
+            data = sorted(self._iter_items(), key=key, reverse=reverse)
+        elif reverse:
+            data = heapq.nlargest(limit, self._iter_items(), key=key)
+        else:
+            data = heapq.nsmallest(limit, self._iter_items(), key=key)
+        self.result = collections.OrderedDict(data)
 
     # Generic dictionary methods
     def __len__(self):
         return len(self.result)
 
     def __iter__(self):
-        return iter(self.result)
+        return (key for key, _ in self._iter_items())
 
     def keys(self):
         return self.result.keys()
@@ -104,9 +153,6 @@ class Result:
     def items(self):
         return self.result.items()
 
-    def items(self):
-        return self.result.items()
-
     def __getitem__(self, key):
         return self.result[key]
 
@@ -119,6 +165,8 @@ class Query:
 
     Filters are applied by calling the ``Query`` object, and passing the dataset to filter as the argument. Calling a ``Query`` with some data returns a ``Result`` object with the filtered dataset.
 
+    The dataset can be a dictionary, a ``Dictionaries`` object, or an iterable of ``(key, dataset)`` pairs. ``Filter`` objects are combined into one predicate, evaluated in a single lazy pass over the data.
+
     Args:
         * *filters* (filters): One or more ``Filter`` objects.
 
@@ -136,7 +184,17 @@ class Query:
         """
         self.filters.append(filter_)
 
+    def matches(self, ds):
+        """Test whether the dataset ``ds`` passes all filters"""
+        return all(filter_.matches(ds) for filter_ in self.filters)
+
     def __call__(self, data):
+        items = data.items() if hasattr(data, "items") else data
+        if all(hasattr(filter_, "matches") for filter_ in self.filters):
+            return Result((k, v) for k, v in items if self.matches(v))
+
+        # Other callables filter whole dictionaries
+        data = dict(items)
         for filter_ in self.filters:
             data = filter_(data)
         return Result(data)
@@ -175,19 +233,19 @@ class Filter:
         self.key = key
         self.function = function
         self.value = value
+        # Name of the pre-defined filter, if used; backends can translate these
+        self.operator = None if callable(function) else function
         if not callable(function):
             self.function = operators.get(function, None)
         if not self.function:
             raise ValueError("No valid function found")
 
+    def matches(self, ds):
+        """Test whether the dataset ``ds`` passes this filter"""
+        return try_op(self.function, ds.get(self.key, None), self.value)
+
     def __call__(self, data):
-        return dict(
-            (
-                (k, v)
-                for k, v in data.items()
-                if try_op(self.function, v.get(self.key, None), self.value)
-            )
-        )
+        return dict(((k, v) for k, v in data.items() if self.matches(v)))
 
 
 def NF(value):
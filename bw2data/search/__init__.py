@@ -1,2 +1,2 @@
-from .indices import IndexManager
+from .indices import IndexManager, SearcherPool, searcher_pool
 from .search import Searcher
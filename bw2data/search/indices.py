@@ -1,19 +1,29 @@
 import os
 import shutil
+import threading
+from collections import OrderedDict
 
 from whoosh import index
 
-from .. import projects
+from .. import config, projects
 from .schema import bw2_schema
 
 
 class IndexManager:
+    # Index directory path to thread building the index in the background
+    _builders = {}
+    # Index directory path to error of a failed background build, kept until the
+    # index is deleted
+    _errors = {}
+    _builders_lock = threading.Lock()
+
     def __init__(self, database_path, dir_name="whoosh"):
         self.path = os.path.join(projects.request_directory("whoosh"), database_path)
         if not os.path.exists(self.path):
             os.mkdir(self.path)
 
     def get(self):
+        self.wait()
         try:
             return index.open_dir(self.path)
         except index.EmptyIndexError:
@@ -37,18 +47,94 @@ class IndexManager:
             code=ds["code"],
         )
 
+    def bulk_writer(self, **kwargs):
+        """Get a writer for adding many datasets.
+
+        Uses the options in ``config.search_index_writer``, updated with ``kwargs``. Whoosh's multiprocessing writer is used if ``procs`` is more than one."""
+        options = {**config.search_index_writer, **kwargs}
+        if options.get("procs", 1) <= 1:
+            options.pop("multisegment", None)
+        return self.get().writer(**options)
+
     def add_dataset(self, ds):
         self.add_datasets([ds])
 
-    def add_datasets(self, datasets):
-        writer = self.get().writer()
-        for ds in datasets:
-            writer.add_document(**self._format_dataset(ds))
+    def add_datasets(self, datasets, **kwargs):
+        """Add ``datasets`` to the index in one commit.
+
+        ``kwargs`` are passed to ``bulk_writer``, e.g. ``procs`` and ``limitmb``."""
+        writer = self.bulk_writer(**kwargs)
+        try:
+            for ds in datasets:
+                writer.add_document(**self._format_dataset(ds))
+        except:
+            writer.cancel()
+            raise
         writer.commit()
 
+    def add_datasets_in_background(self, datasets, **kwargs):
+        """Add ``datasets`` to the index in a background thread, and return the thread.
+
+        ``datasets`` is consumed in the background thread, so it shouldn't depend on state which can change in the meantime, like the current project. Other calls to this ``IndexManager`` (and searches) wait until the thread is finished."""
+        self.wait()
+        thread = threading.Thread(
+            target=self._build_in_background,
+            args=(datasets,),
+            kwargs=kwargs,
+            name="search index: {}".format(os.path.basename(self.path)),
+        )
+        thread.error = None
+        with IndexManager._builders_lock:
+            IndexManager._builders[self.path] = thread
+        thread.start()
+        return thread
+
+    def _build_in_background(self, datasets, **kwargs):
+        try:
+            self.add_datasets(datasets, **kwargs)
+        except Exception as error:
+            threading.current_thread().error = error
+            with IndexManager._builders_lock:
+                IndexManager._errors[self.path] = error
+        finally:
+            # Release resources of generators in this thread, e.g. SQLite connections
+            # which can't be closed from other threads
+            if hasattr(datasets, "close"):
+                datasets.close()
+
+    def wait(self, raise_error=True):
+        """Wait until a background build of this index is finished.
+
+        If a background build failed, its error is raised if ``raise_error`` is true. The index is incomplete, so the error is raised again by every call until the index is deleted, e.g. by ``Database.make_searchable(reset=True)``."""
+        with IndexManager._builders_lock:
+            thread = IndexManager._builders.get(self.path)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+            with IndexManager._builders_lock:
+                if IndexManager._builders.get(self.path) is thread:
+                    del IndexManager._builders[self.path]
+        error = self.error
+        if raise_error and error is not None:
+            raise error
+
+    @property
+    def error(self):
+        """Error of the failed background build of this index, or ``None``"""
+        with IndexManager._builders_lock:
+            return IndexManager._errors.get(self.path)
+
     def update_dataset(self, ds):
+        self.update_datasets([ds])
+
+    def update_datasets(self, datasets):
+        """Add or replace ``datasets`` in the index in one commit"""
         writer = self.get().writer()
-        writer.update_document(**self._format_dataset(ds))
+        try:
+            for ds in datasets:
+                writer.update_document(**self._format_dataset(ds))
+        except:
+            writer.cancel()
+            raise
         writer.commit()
 
     def delete_dataset(self, ds):
@@ -56,4 +142,83 @@ class IndexManager:
         index.delete_by_term("code", ds["code"])
 
     def delete_database(self):
+        self.wait(raise_error=False)
+        searcher_pool.evict(self.path)
         shutil.rmtree(self.path)
+        with IndexManager._builders_lock:
+            IndexManager._errors.pop(self.path, None)
+
+
+class SearcherPool:
+    """Open Whoosh searchers, kept between searches, for at most ``maxsize`` indices.
+
+    Opening an index reads its segment files, so reusing an open searcher makes repeated searches much faster. A pooled searcher is refreshed when the index generation changes, and the least recently used searcher is closed when too many indices are open.
+
+    Searchers are shared between threads, so the pool counts their users. A searcher which is replaced or evicted while in use is only closed when its last user calls ``release``."""
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._searchers = OrderedDict()
+        # Number of users of searchers currently in use, by ``id``
+        self._users = {}
+        # Searchers to close when their last user releases them, by ``id``
+        self._retired = {}
+        self._lock = threading.RLock()
+
+    def get(self, manager):
+        """Get an up to date Whoosh searcher for the ``IndexManager`` ``manager``.
+
+        The searcher belongs to the pool and must not be closed by the caller; pass it to ``release`` when done."""
+        manager.wait()
+        with self._lock:
+            searcher = self._searchers.pop(manager.path, None)
+            if searcher is not None:
+                try:
+                    if not self._users.get(id(searcher)):
+                        # Closes what the refreshed searcher doesn't reuse
+                        searcher = searcher.refresh()
+                    elif not searcher.up_to_date():
+                        # ``refresh`` would close resources the other users still need
+                        self._retire(searcher)
+                        searcher = None
+                except (OSError, index.EmptyIndexError):
+                    self._retire(searcher)
+                    searcher = None
+            if searcher is None:
+                searcher = manager.get().searcher()
+            self._searchers[manager.path] = searcher
+            self._users[id(searcher)] = self._users.get(id(searcher), 0) + 1
+            while len(self._searchers) > self.maxsize:
+                self._retire(self._searchers.popitem(last=False)[1])
+            return searcher
+
+    def release(self, searcher):
+        """Give back a ``searcher`` from ``get``, closing it if it was retired meanwhile"""
+        with self._lock:
+            users = self._users.pop(id(searcher), 0) - 1
+            if users > 0:
+                self._users[id(searcher)] = users
+            elif id(searcher) in self._retired:
+                self._retired.pop(id(searcher)).close()
+
+    def _retire(self, searcher):
+        """Close ``searcher`` now, or after its last user releases it"""
+        if self._users.get(id(searcher)):
+            self._retired[id(searcher)] = searcher
+        else:
+            searcher.close()
+
+    def evict(self, path):
+        """Close and remove the searcher for the index directory ``path``, if any"""
+        with self._lock:
+            searcher = self._searchers.pop(path, None)
+            if searcher is not None:
+                self._retire(searcher)
+
+    def clear(self):
+        with self._lock:
+            while self._searchers:
+                self._retire(self._searchers.popitem()[1])
+
+
+searcher_pool = SearcherPool()
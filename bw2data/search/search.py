@@ -1,7 +1,7 @@
 from whoosh.qparser import MultifieldParser
 from whoosh.query import And, Term
 
-from .indices import IndexManager
+from .indices import IndexManager, searcher_pool
 
 
 def keysplit(strng):
@@ -14,11 +14,13 @@ class Searcher:
         self._database = database
 
     def __enter__(self):
-        self.index = IndexManager(self._database).get()
+        # Searchers are shared through ``searcher_pool``; release instead of closing on exit
+        self.searcher = searcher_pool.get(IndexManager(self._database))
+        self.index = self.searcher._ix
         return self
 
     def __exit__(self, type, value, traceback):
-        self.index.close()
+        searcher_pool.release(self.searcher)
 
     def search(
         self,
@@ -31,7 +33,7 @@ class Searcher:
         mask=None,
         node_class=None,
     ):
-        from .. import get_activity
+        from ..utils import get_nodes
 
         lowercase = lambda x: x.lower() if hasattr(x, "lower") else x
         string = lowercase(string)
@@ -54,7 +56,9 @@ class Searcher:
             "location": 3,
         }
 
-        qp = MultifieldParser(fields, self.index.schema, fieldboosts=boosts)
+        # The searcher schema is in memory; reading the index schema can race with
+        # writers removing old index files
+        qp = MultifieldParser(fields, self.searcher.schema, fieldboosts=boosts)
 
         kwargs = {"limit": limit}
         if filter is not None:
@@ -76,39 +80,37 @@ class Searcher:
             else:
                 kwargs["mask"] = And([Term(k, lowercase(v)) for k, v in mask.items()])
 
-        with self.index.searcher() as searcher:
-            if facet is None:
-                results = searcher.search(qp.parse(string), **kwargs)
-                if "mask" in kwargs or "filter" in kwargs:
-                    print(
-                        "Excluding {} filtered results".format(results.filtered_count)
-                    )
-                results = [dict(obj.items()) for obj in results]
-            else:
-                kwargs.pop("limit")
-                results = {
-                    k: [searcher.stored_fields(i) for i in v]
-                    for k, v in searcher.search(
-                        qp.parse(string), groupedby=facet, **kwargs
-                    )
-                    .groups()
-                    .items()
-                }
+        searcher = self.searcher
+        if facet is None:
+            results = searcher.search(qp.parse(string), **kwargs)
+            if "mask" in kwargs or "filter" in kwargs:
+                print("Excluding {} filtered results".format(results.filtered_count))
+            results = [dict(obj.items()) for obj in results]
+        else:
+            kwargs.pop("limit")
+            results = {
+                k: [searcher.stored_fields(i) for i in v]
+                for k, v in searcher.search(qp.parse(string), groupedby=facet, **kwargs)
+                .groups()
+                .items()
+            }
 
         if proxy and facet is not None:
-            return {
-                key: [
-                    get_activity(
-                        key=(obj["database"], obj["code"]), node_class=node_class
-                    )
-                    for obj in value
-                ]
-                for key, value in results.items()
-            }
+            nodes = iter(
+                get_nodes(
+                    [
+                        (obj["database"], obj["code"])
+                        for value in results.values()
+                        for obj in value
+                    ],
+                    node_class=node_class,
+                )
+            )
+            return {key: [next(nodes) for _ in value] for key, value in results.items()}
         elif proxy:
-            return [
-                get_activity(key=(obj["database"], obj["code"]), node_class=node_class)
-                for obj in results
-            ]
+            return get_nodes(
+                [(obj["database"], obj["code"]) for obj in results],
+                node_class=node_class,
+            )
         else:
             return results
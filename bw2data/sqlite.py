@@ -1,7 +1,87 @@
 import json
 import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
 
 from peewee import BlobField, SqliteDatabase, TextField
+from playhouse.pool import PooledSqliteDatabase
+
+from .configuration import config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Prefix for blobs not written with ``pickle``, followed by one byte for the codec id.
+# Pickled values always start with a protocol opcode, so they can't be confused.
+CODEC_MAGIC = b"BW"
+
+# Codec name: (codec id, encoding function, decoding function)
+FIELD_CODECS = {}
+
+
+def register_codec(name, codec_id, encode, decode):
+    """Register a codec to serialize ``CodecField`` values.
+
+    ``codec_id`` is an integer between 1 and 255 which is stored with each value, and must never change. ``encode`` must raise ``TypeError`` or ``ValueError`` for values it can't serialize exactly; these values are pickled instead."""
+    if not 0 < codec_id < 256:
+        raise ValueError("Codec id must be between 1 and 255")
+    if any(obj[0] == codec_id for key, obj in FIELD_CODECS.items() if key != name):
+        raise ValueError("Codec id {} already used".format(codec_id))
+    FIELD_CODECS[name] = (codec_id, encode, decode)
+
+
+def encode_blob(value, codec="pickle"):
+    """Serialize ``value`` with ``codec``. Falls back to ``pickle`` if ``codec`` can't handle ``value``."""
+    if codec != "pickle":
+        codec_id, encode, _ = FIELD_CODECS[codec]
+        try:
+            return CODEC_MAGIC + bytes([codec_id]) + encode(value)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return pickle.dumps(value, protocol=4)
+
+
+def decode_blob(value):
+    """Deserialize a blob written by ``encode_blob``, detecting the codec used."""
+    value = bytes(value)
+    if value[:2] == CODEC_MAGIC:
+        codec_id = value[2]
+        for _, (id_, _, decode) in FIELD_CODECS.items():
+            if id_ == codec_id:
+                return decode(value[3:])
+        raise ValueError("Unknown codec id {}".format(codec_id))
+    return pickle.loads(value)
+
+
+if msgpack is not None:
+    _MSGPACK_TUPLE = 1
+
+    def _msgpack_default(obj):
+        # ``strict_types`` sends tuples here instead of converting them to lists
+        if type(obj) is tuple:
+            return msgpack.ExtType(_MSGPACK_TUPLE, _msgpack_encode(list(obj)))
+        raise TypeError("Can't serialize {}".format(type(obj)))
+
+    def _msgpack_ext_hook(code, data):
+        if code == _MSGPACK_TUPLE:
+            return tuple(_msgpack_decode(data))
+        return msgpack.ExtType(code, data)
+
+    def _msgpack_encode(value):
+        return msgpack.packb(
+            value, default=_msgpack_default, strict_types=True, use_bin_type=True
+        )
+
+    def _msgpack_decode(data):
+        return msgpack.unpackb(
+            data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False
+        )
+
+    register_codec("msgpack", 1, _msgpack_encode, _msgpack_decode)
 
 
 class PickleField(BlobField):
@@ -12,29 +92,220 @@ class PickleField(BlobField):
         return pickle.loads(bytes(value))
 
 
+class CodecField(BlobField):
+    """Blob field for Python objects, serialized with a pluggable codec.
+
+    Values are written with the codec given by ``config.field_codec``. The codec is detected when reading, so values written with different codecs (including legacy pickled values) can be mixed in one table."""
+
+    def db_value(self, value):
+        return super().db_value(encode_blob(value, config.field_codec))
+
+    def python_value(self, value):
+        # ``null`` when selected through an outer join without a match
+        if value is None:
+            return None
+        return decode_blob(value)
+
+
+# Faster settings for writing whole databases. A crash during the write can corrupt the project database.
+BULK_IMPORT_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "MEMORY",
+    "cache_size": -262144,  # 256 MB
+    "temp_store": "MEMORY",
+}
+
+
+# Default settings for new connections; see ``config.sqlite_connection``
+DEFAULT_CONNECTION_SETTINGS = {
+    "busy_timeout": 5,
+    "cache_size": None,
+    "journal_mode": None,
+    "pool": None,
+}
+
+# Settings for projects with write-ahead logging; see ``ProjectManager.set_wal``
+WAL_SETTINGS = {
+    "journal_mode": "wal",
+    # Commits can be lost in a power failure, but the database can't be corrupted
+    "synchronous": "NORMAL",
+    # Checkpoint after ~40 MB instead of ~4 MB, as bulk writes produce a lot of pages
+    "wal_autocheckpoint": 10000,
+    # Truncate the log file after checkpoints instead of keeping it at its largest size
+    "journal_size_limit": 64 * 1024 * 1024,
+}
+
+
 class SubstitutableDatabase:
-    def __init__(self, filepath, tables):
+    def __init__(self, filepath, tables, setup_sql=(), settings=None):
+        """``setup_sql`` are statements (like ``CREATE INDEX IF NOT EXISTS``) executed after the tables are created.
+
+        ``settings`` override the connection settings from ``config.sqlite_connection``."""
         self._filepath = filepath
         self._tables = tables
+        self._setup_sql = setup_sql
+        self._settings = settings or {}
+        self._project_settings = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._read_connections = []
+        self._generation = 0
         self._database = self._create_database()
 
-    def _create_database(self):
-        db = SqliteDatabase(self._filepath)
+    @property
+    def settings(self):
+        """Connection settings, combining (in order of priority) the defaults, the project settings, ``config.sqlite_connection``, and the ``settings`` given when creating this object"""
+        return {
+            **DEFAULT_CONNECTION_SETTINGS,
+            **self._project_settings,
+            **config.sqlite_connection,
+            **self._settings,
+        }
+
+    def _pragmas(self, read_only=False):
+        pragmas = {}
+        for name, value in self.settings.items():
+            if value is None or name == "pool":
+                continue
+            elif name == "busy_timeout":
+                value = int(value * 1000)
+            elif name == "journal_mode" and read_only:
+                continue
+            pragmas[name] = value
+        return pragmas
+
+    def _create_database(self, read_only=False):
+        if read_only:
+            database = Path(self._filepath).absolute().as_uri() + "?mode=ro"
+        else:
+            database = self._filepath
+        # Peewee applies the pragmas to each new connection
+        kwargs = {"pragmas": self._pragmas(read_only), "uri": read_only}
+        if self.settings["pool"]:
+            # Pooled connections are reused by other threads
+            db = PooledSqliteDatabase(
+                database,
+                max_connections=self.settings["pool"],
+                check_same_thread=False,
+                # Seconds to wait for a free connection
+                timeout=self.settings["busy_timeout"],
+                **kwargs
+            )
+        else:
+            db = SqliteDatabase(database, **kwargs)
         for model in self._tables:
             model.bind(db, bind_refs=False, bind_backrefs=False)
         db.connect()
-        db.create_tables(self._tables)
+        if not read_only:
+            db.create_tables(self._tables)
+            self._add_missing_columns(db)
+            for sql in self._setup_sql:
+                db.execute_sql(sql)
         return db
 
+    def _add_missing_columns(self, db):
+        """Add nullable columns which were added to the models after the tables were created.
+
+        Older versions of ``bw2data`` ignore these columns, and leave them empty."""
+        for model in self._tables:
+            table = model._meta.table_name
+            existing = {column.name for column in db.get_columns(table)}
+            for field in model._meta.sorted_fields:
+                if field.column_name in existing or not field.null:
+                    continue
+                db.execute_sql(
+                    'ALTER TABLE "{}" ADD COLUMN "{}" {}'.format(
+                        table,
+                        field.column_name,
+                        db.field_types.get(field.field_type, field.field_type),
+                    )
+                )
+
     @property
     def db(self):
         return self._database
 
-    def change_path(self, filepath):
+    def change_path(self, filepath, project_settings=None):
+        """Connect to the SQLite file ``filepath``. ``project_settings`` are connection settings of the new project, like ``WAL_SETTINGS``."""
         self.db.close()
+        self._project_settings = project_settings or {}
+        self._close_read_connections()
         self._filepath = filepath
         self._database = self._create_database()
 
+    def make_read_only(self):
+        """Replace the current connection with a read-only connection to the same file.
+
+        Used in worker processes, which read project data but should never write it. In-memory databases are left unchanged."""
+        if str(self._filepath) == ":memory:":
+            return
+        self._database = self._create_database(read_only=True)
+
+    def connection_context(self):
+        """Context manager which opens a connection for the current thread, and closes it (or returns it to the pool) afterwards.
+
+        Threads which only read data, like web server request handlers, should use this when the ``pool`` setting is used."""
+        return self.db.connection_context()
+
+    def read_connection(self):
+        """Get a read-only ``sqlite3`` connection for raw SQL queries in the current thread.
+
+        The connection is opened once per thread, and reused until the database path changes; don't close it. It doesn't see uncommitted changes made with ``.db``."""
+        cached = getattr(self._local, "read_connection", None)
+        if cached is not None and cached[0] == self._generation:
+            return cached[1]
+
+        if str(self._filepath) == ":memory:":
+            connection = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            connection = sqlite3.connect(
+                Path(self._filepath).absolute().as_uri() + "?mode=ro",
+                uri=True,
+                # Closed from other threads in ``change_path``
+                check_same_thread=False,
+            )
+        for name, value in self._pragmas(read_only=True).items():
+            connection.execute("PRAGMA {} = {}".format(name, value))
+        with self._lock:
+            self._read_connections.append(connection)
+        self._local.read_connection = (self._generation, connection)
+        return connection
+
+    def _close_read_connections(self):
+        with self._lock:
+            self._generation += 1
+            connections, self._read_connections = self._read_connections, []
+        for connection in connections:
+            connection.close()
+
+    @contextmanager
+    def pragmas(self, pragmas):
+        """Context manager to temporarily change the ``pragmas`` given as a dictionary, e.g. ``{"synchronous": "OFF"}``.
+
+        Must not be used within a transaction, as SQLite ignores some pragmas (like ``synchronous`` and ``journal_mode``) in transactions. ``journal_mode`` isn't changed for databases using write-ahead logging, as other connections may be reading them."""
+        if "journal_mode" in pragmas and self.journal_mode == "wal":
+            pragmas = {k: v for k, v in pragmas.items() if k != "journal_mode"}
+        previous = {}
+        for name, value in pragmas.items():
+            previous[name] = self.db.execute_sql("PRAGMA {}".format(name)).fetchone()[0]
+            self.db.execute_sql("PRAGMA {} = {}".format(name, value))
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                self.db.execute_sql("PRAGMA {} = {}".format(name, value))
+
+    @property
+    def journal_mode(self):
+        return self.execute_sql("PRAGMA journal_mode").fetchone()[0].lower()
+
+    def checkpoint(self, mode="PASSIVE"):
+        """Copy changes from the write-ahead log to the database file, if write-ahead logging is used.
+
+        The default ``PASSIVE`` mode doesn't wait for readers, and is called after large writes. ``TRUNCATE`` waits (up to the busy timeout) until all changes are copied, and empties the log file."""
+        if self.journal_mode == "wal":
+            self.execute_sql("PRAGMA wal_checkpoint({})".format(mode))
+
     def atomic(self):
         return self.db.atomic()
 
@@ -56,11 +327,15 @@ class JSONField(TextField):
         return super().db_value(json.dumps(value, ensure_ascii=False, indent=2))
 
     def python_value(self, value):
+        if value is None:
+            return None
         return json.loads(value)
 
 
 class TupleJSONField(JSONField):
     def python_value(self, value):
+        if value is None:
+            return None
         data = json.loads(value)
         if isinstance(data, list):
             data = tuple(data)
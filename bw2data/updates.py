@@ -23,6 +23,7 @@ from . import (
     weightings,
 )
 from .backends import sqlite3_lci_db
+from .sqlite import decode_blob
 
 hash_re = re.compile("^[a-zA-Z0-9]{32}$")
 is_hash = lambda x: bool(hash_re.match(x))
@@ -114,6 +115,21 @@ class Updates:
             "automatic": True,
             "explanation": "bw2data 4.0 release requires migrations filename changes",
         },
+        "4.0 exchange data columns": {
+            "method": "populate_exchange_columns_40",
+            "automatic": True,
+            "explanation": "Copy numeric exchange values to their own columns for faster processing",
+        },
+        "4.0 exchange composite indices": {
+            "method": "add_exchange_indices_40",
+            "automatic": True,
+            "explanation": "Add indices on exchange output and type for faster edge queries and processing",
+        },
+        "4.0 exchange node ids": {
+            "method": "populate_exchange_node_ids_40",
+            "automatic": True,
+            "explanation": "Link exchanges to the integer ids of their input and output nodes",
+        },
     }
 
     @classmethod
@@ -234,7 +250,81 @@ class Updates:
             current.replace(target)
 
     @classmethod
-    def _reprocess_all(cls):
+    def populate_exchange_columns_40(cls, chunk_size=10000):
+        """Fill the numeric ``ExchangeDataset`` columns from the pickled ``data`` blob of existing exchanges."""
+        from .backends.schema import EXCHANGE_NUMERIC_FIELDS, exchange_columns
+
+        fields = ("amount", "uncertainty_type", "negative") + EXCHANGE_NUMERIC_FIELDS
+        SQL = "UPDATE exchangedataset SET {} WHERE id = ?".format(
+            ", ".join("{} = ?".format(field) for field in fields)
+        )
+        last_id = 0
+        with sqlite3.connect(sqlite3_lci_db.db.database) as conn:
+            while True:
+                rows = conn.execute(
+                    "SELECT id, data FROM exchangedataset WHERE id > ? AND amount IS NULL ORDER BY id LIMIT ?",
+                    (last_id, chunk_size),
+                ).fetchall()
+                if not rows:
+                    break
+                updates = []
+                for id_, data in rows:
+                    columns = exchange_columns(decode_blob(data))
+                    updates.append(tuple(columns[field] for field in fields) + (id_,))
+                conn.executemany(SQL, updates)
+                last_id = rows[-1][0]
+
+    @classmethod
+    def add_exchange_indices_40(cls):
+        """Replace the ``(output_database, output_code)`` index with composite indices including the edge type, and update the query planner statistics."""
+        from .backends.schema import EXISTING_DATA_INDICES, OBSOLETE_INDICES
+
+        with sqlite3.connect(sqlite3_lci_db.db.database) as conn:
+            for name in OBSOLETE_INDICES:
+                conn.execute('DROP INDEX IF EXISTS "{}"'.format(name))
+            for sql in EXISTING_DATA_INDICES.values():
+                conn.execute(sql)
+            conn.execute("ANALYZE")
+
+    @classmethod
+    def populate_exchange_node_ids_40(cls):
+        """Fill ``input_id`` and ``output_id`` of all exchanges, and add the triggers which keep them up to date."""
+        from .backends.schema import (
+            EXISTING_DATA_INDICES,
+            NODE_ID_TRIGGERS,
+            node_id_sql,
+        )
+
+        with sqlite3.connect(sqlite3_lci_db.db.database) as conn:
+            for name in NODE_ID_TRIGGERS:
+                conn.execute('DROP TRIGGER IF EXISTS "{}"'.format(name))
+            for sql in EXISTING_DATA_INDICES.values():
+                conn.execute(sql)
+            # Node ids are looked up by key. The unique key index is only created by
+            # writes, so use a plain index if it doesn't exist (yet).
+            lookup_index = not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'activitydataset_key'"
+            ).fetchone()
+            if lookup_index:
+                conn.execute(
+                    'CREATE INDEX "activitydataset_node_ids_40" ON "activitydataset" ("database", "code")'
+                )
+            conn.execute(
+                "UPDATE exchangedataset SET input_id = {}, output_id = {}".format(
+                    node_id_sql("input", "exchangedataset."),
+                    node_id_sql("output", "exchangedataset."),
+                )
+            )
+            if lookup_index:
+                conn.execute('DROP INDEX "activitydataset_node_ids_40"')
+            for sql in NODE_ID_TRIGGERS.values():
+                conn.execute(sql)
+
+    @classmethod
+    def _reprocess_all(cls, processes=None):
+        """Reprocess all LCIA methods, weightings, normalizations, and databases.
+
+        If ``processes`` is given, build the datapackages in a pool of this many worker processes. Database metadata is still saved in this process."""
         objects = [
             (methods, Method, "LCIA methods"),
             (weightings, Weighting, "LCIA weightings"),
@@ -242,6 +332,9 @@ class Updates:
             (databases, Database, "LCI databases"),
         ]
 
+        if processes:
+            return cls._reprocess_all_parallel(processes)
+
         for (meta, klass, name) in objects:
             if meta.list:
                 print("Updating all %s" % name)
@@ -258,3 +351,26 @@ class Updates:
 
                     pbar.update()
                 print(pbar)
+
+    @classmethod
+    def _reprocess_all_parallel(cls, processes):
+        from .parallel import process_in_parallel
+
+        objects = [("method", key) for key in methods]
+        objects.extend(("weighting", key) for key in weightings)
+        objects.extend(("normalization", key) for key in normalizations)
+        for name in databases:
+            if Database(name).backend == "iotable":
+                Database(name).process()
+            else:
+                objects.append(("database", name))
+        if not objects:
+            return
+
+        print("Updating all objects using {} processes".format(processes))
+        pbar = pyprind.ProgBar(len(objects), title="Brightway2 objects:", monitor=True)
+        for kind, name, dependents in process_in_parallel(objects, processes):
+            if kind == "database":
+                Database(name)._finish_processing(dependents)
+            pbar.update()
+        print(pbar)
@@ -1,4 +1,5 @@
 import collections
+import copy
 import itertools
 import numbers
 import os
@@ -235,6 +236,7 @@ def merge_databases(parent_db, other):
     Doesn't return anything."""
     from . import databases
     from .backends import ActivityDataset, ExchangeDataset, sqlite3_lci_db
+    from .backends.schema import node_cache
     from .database import Database
 
     assert parent_db in databases
@@ -267,7 +269,9 @@ def merge_databases(parent_db, other):
         ExchangeDataset.update(output_database=parent_db).where(
             ExchangeDataset.output_database == other
         ).execute()
+    node_cache.invalidate(other)
 
+    Database.set_dirty(parent_db)
     Database(parent_db).process()
     del databases[other]
 
@@ -389,18 +393,22 @@ def create_in_memory_zipfile_from_directory(path):
     return memory_obj
 
 
-def get_node(**kwargs):
-    from . import Database
+def _node_class(database_name):
+    """Get the node proxy class for ``database_name`` from the cached backend"""
     from .backends import Activity
-    from .backends import ActivityDataset as AD
     from .backends.iotable import IOTableActivity
+    from .backends.schema import node_cache
 
-    def node_class(database_name):
-        mapping = {
-            "sqlite": Activity,
-            "iotable": IOTableActivity,
-        }
-        return mapping[Database(database_name).backend]
+    mapping = {
+        "sqlite": Activity,
+        "iotable": IOTableActivity,
+    }
+    return mapping[node_cache.backend(database_name)]
+
+
+def get_node(**kwargs):
+    from .backends import ActivityDataset as AD
+    from .backends.schema import node_cache
 
     mapping = {
         "id": AD.id,
@@ -419,7 +427,9 @@ def get_node(**kwargs):
         except KeyError:
             continue
 
-    candidates = [node_class(obj.database)(obj) for obj in qs]
+    candidates = [_node_class(obj.database)(obj) for obj in qs]
+    for obj in candidates:
+        node_cache.add(obj.key, obj.id)
 
     extended_search = any(key not in mapping for key in kwargs)
     if extended_search:
@@ -445,6 +455,55 @@ def get_node(**kwargs):
     return candidates[0]
 
 
+def get_nodes(keys, node_class=None):
+    """Get the nodes for a list of ``(database, code)`` keys or integer node ids, in the same order.
+
+    Uses one query per database (and per ``_SQL_CHUNK_SIZE`` keys), instead of one query per key. Nodes are instances of ``node_class``, or of the proxy class of their database backend if not given. Each node has its own document, also for repeated keys. Raises ``UnknownObject`` if any key doesn't exist."""
+    from .backends import ActivityDataset as AD
+    from .backends.schema import _SQL_CHUNK_SIZE, node_cache
+
+    keys = [
+        int(key) if isinstance(key, numbers.Integral) else (key[0], key[1])
+        for key in keys
+    ]
+    codes, ids = {}, set()
+    for key in keys:
+        if isinstance(key, int):
+            ids.add(key)
+        else:
+            codes.setdefault(key[0], set()).add(key[1])
+
+    found = {}
+    for database, database_codes in codes.items():
+        database_codes = sorted(database_codes)
+        for index in range(0, len(database_codes), _SQL_CHUNK_SIZE):
+            qs = AD.select().where(
+                AD.database == database,
+                AD.code << database_codes[index : index + _SQL_CHUNK_SIZE],
+            )
+            for obj in qs:
+                found[(database, obj.code)] = obj
+    ids = sorted(ids)
+    for index in range(0, len(ids), _SQL_CHUNK_SIZE):
+        for obj in AD.select().where(AD.id << ids[index : index + _SQL_CHUNK_SIZE]):
+            found[obj.id] = obj
+    node_cache.add_many((obj.key, obj.id) for obj in found.values())
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        raise UnknownObject("Can't find nodes {}".format(missing))
+
+    nodes, used = [], set()
+    for key in keys:
+        document = found[key]
+        if id(document) in used:
+            # Nodes change the data of their document
+            document = type(document)(**copy.deepcopy(document.__data__))
+        used.add(id(document))
+        nodes.append((node_class or _node_class(document.database))(document))
+    return nodes
+
+
 def get_activity(key=None, **kwargs):
     """Support multiple ways to get exactly one activity node.
 
@@ -1,4 +1,5 @@
-from .backends.schema import get_id
+from .backends.schema import get_id, get_ids
+from .errors import UnknownObject
 from .ia_data_store import ImpactAssessmentDataStore
 from .meta import normalizations, weightings
 from .utils import as_uncertainty_dict
@@ -59,6 +60,14 @@ class Normalization(ImpactAssessmentDataStore):
     validator = normalization_validator
     matrix = "normalization_matrix"
 
+    def cache_ids(self, data):
+        """Look up all flow ids with a few queries, so ``process_row`` doesn't query the database for each row."""
+        try:
+            get_ids([row[0] for row in data])
+        except UnknownObject:
+            # Raised again for the first missing flow in ``process_row``
+            pass
+
     def process_row(self, row):
         """Given ``(flow key, amount)``, return a dictionary for array insertion."""
         return {
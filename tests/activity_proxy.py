@@ -499,3 +499,61 @@ def test_rp_exchange_value_error_only_substitution():
 
     with pytest.raises(ValueError):
         a.rp_exchange()
+
+
+@bw2test
+def test_exchanges_prefetch(monkeypatch):
+    database = DatabaseChooser("a database")
+    database.write(
+        {
+            ("a database", "foo"): {
+                "name": "foo",
+                "exchanges": [
+                    {"input": ("a database", "foo"), "amount": 1, "type": "production"},
+                    {
+                        "input": ("a database", "bar"),
+                        "amount": 2,
+                        "type": "technosphere",
+                    },
+                    {
+                        "input": ("a database", "bar"),
+                        "amount": 3,
+                        "type": "technosphere",
+                    },
+                    {
+                        "input": ("a database", "gone"),
+                        "amount": 4,
+                        "type": "technosphere",
+                    },
+                ],
+            },
+            ("a database", "bar"): {"name": "bar", "location": "CH"},
+        },
+        process=False,
+    )
+    node = get_activity(("a database", "foo"))
+    expected = [(exc.as_dict(), exc["input"]) for exc in node.exchanges()]
+
+    import bw2data.proxies
+
+    def no_lookups(*args, **kwargs):
+        raise AssertionError("Node lookup not prefetched")
+
+    monkeypatch.setattr(bw2data.proxies, "get_activity", no_lookups)
+    exchanges = list(node.exchanges(prefetch=True))
+    assert [(exc.as_dict(), exc["input"]) for exc in exchanges] == expected
+    assert exchanges[0].input is exchanges[0].output
+    assert exchanges[1].input is exchanges[2].input
+    assert exchanges[1].input["location"] == "CH"
+    assert all(exc.output is exchanges[0].output for exc in exchanges)
+    assert exchanges[0].output.id == node.id
+    with pytest.raises(AssertionError):
+        exchanges[3].input
+
+    technosphere = list(node.technosphere(prefetch=True))
+    assert [exc["amount"] for exc in technosphere] == [2, 3, 4]
+    assert technosphere[0].input is not exchanges[1].input
+    assert [
+        exc["amount"]
+        for exc in get_activity(("a database", "bar")).upstream(prefetch=True)
+    ] == [2, 3]
@@ -1,5 +1,7 @@
 import copy
 import datetime
+import itertools
+import sys
 import warnings
 
 import numpy as np
@@ -7,9 +9,20 @@ import pandas as pd
 import pytest
 from pandas.testing import assert_frame_equal, assert_series_equal
 
-from bw2data import Database, databases, geomapping, get_activity, get_id
+from bw2data import (
+    Database,
+    config,
+    consumers_of,
+    databases,
+    geomapping,
+    get_activity,
+    get_id,
+)
 from bw2data.backends import Activity as PWActivity
-from bw2data.backends import sqlite3_lci_db
+from bw2data.backends import base as backends_base
+from bw2data.backends import ChangeLog, ExchangeDataset, sqlite3_lci_db
+from bw2data.backends.schema import NODE_ID_TRIGGERS
+from bw2data.backends.utils import datapackage_vector_as_array
 from bw2data.database import Database
 from bw2data.errors import (
     DuplicateNode,
@@ -94,6 +107,46 @@ def test_copy(food):
     assert "repas" in databases
 
 
+def test_copy_in_sqlite(food):
+    food = Database("food")
+    food.new_activity(
+        code="3",
+        name="dessert",
+        location="CH",
+        exchanges=[],
+    ).save()
+    edge = get_activity(("food", "3")).new_exchange(
+        input=("food", "1"), amount=0.5, type="technosphere", uncertainty_type=2
+    )
+    edge.save()
+    # Dangling edge to a node which doesn't exist in the copied database
+    get_activity(("food", "3")).new_exchange(
+        input=("food", "missing"), amount=1, type="substitution"
+    ).save()
+    ExchangeDataset.update(type="foo").where(
+        ExchangeDataset.input_code == "missing"
+    ).execute()
+    food.process()
+
+    copied = food.copy("repas")
+    expected = food.relabel_data(copy.deepcopy(food.load()), "repas")
+    for ds in expected.values():
+        ds["database"] = "repas"
+        for exc in ds["exchanges"]:
+            exc["output"] = ("repas", exc["output"][1])
+    assert copied.load() == expected
+    assert copied.depends == food.depends == ["biosphere"]
+    assert copied.geocollections == food.geocollections
+    assert not copied.dirty
+    assert {obj["code"] for obj in copied.search("dessert")} == {"3"}
+    assert copied.search("dessert")[0]["database"] == "repas"
+
+    copied_vectors = processed_vectors(copied)
+    for vector, other in zip(reprocessed_vectors(copied), copied_vectors):
+        assert_vectors_equal(vector, other)
+    assert len(copied_vectors[0]) == len(processed_vectors(food)[0])
+
+
 @bw2test
 def test_copy_does_deepcopy():
     data = {
@@ -120,6 +173,46 @@ def test_raise_wrong_database():
         d.write(data)
 
 
+@bw2test
+def test_write_iterator(monkeypatch):
+    monkeypatch.setattr(backends_base, "_WRITE_BATCH_SIZE", 3)
+    Database("biosphere").write(biosphere)
+    food = Database("food")
+    food.write((key, ds) for key, ds in copy.deepcopy(food_data).items())
+    streamed = food.load()
+    geocollections = food.geocollections
+    vectors = processed_vectors(food)
+    assert food.searchable
+    assert {obj["code"] for obj in food.search("lunch")} == {"1"}
+
+    food.write(copy.deepcopy(food_data))
+    assert food.load() == streamed
+    assert food.geocollections == geocollections
+    for vector, other in zip(processed_vectors(food), vectors):
+        assert_vectors_equal(vector, other)
+
+
+@bw2test
+def test_write_iterator_wrong_database():
+    Database("bar").write({("bar", "1"): {"name": "old"}})
+
+    def generator():
+        yield ("bar", "2"), {}
+        yield ("foo", "1"), {}
+
+    with pytest.raises(WrongDatabase):
+        Database("bar").write(generator())
+    assert not len(Database("bar"))
+    assert not Database("bar").search("old")
+
+
+@bw2test
+def test_write_empty_iterator():
+    Database("bar").write(iter([]))
+    assert Database("bar").searchable
+    assert not len(Database("bar"))
+
+
 @bw2test
 def test_deletes_from_database():
     d = Database("biosphere")
@@ -931,6 +1024,361 @@ def test_add_geocollections_no_unable_for_product(capsys):
     assert "Not able" not in capsys.readouterr().out
 
 
+@pytest.fixture
+@bw2test
+def chain():
+    Database("biosphere").write(biosphere)
+    Database("chain").write(
+        {
+            ("chain", str(i)): {
+                "name": "node {}".format(i),
+                "location": "GLO",
+                "exchanges": [
+                    {
+                        "input": ("chain", str((i + 1) % 10)),
+                        "amount": i + 1,
+                        "type": "technosphere",
+                    },
+                    {"input": ("biosphere", "1"), "amount": i, "type": "biosphere"},
+                ],
+            }
+            for i in range(10)
+        }
+    )
+
+
+def processed_vectors(database):
+    package = database.datapackage()
+    return [
+        np.sort(
+            datapackage_vector_as_array(
+                package, "{}_{}_matrix".format(database.name, matrix)
+            ),
+            order=["row", "col", "amount"],
+        )
+        for matrix in ("technosphere", "biosphere")
+    ]
+
+
+def reprocessed_vectors(database):
+    Database.set_dirty(database.name)
+    database.process()
+    return processed_vectors(database)
+
+
+def assert_vectors_equal(first, second):
+    assert first.dtype == second.dtype
+    for field in first.dtype.names:
+        assert np.allclose(first[field], second[field], equal_nan=True)
+
+
+def no_full_processing(*args, **kwargs):
+    raise AssertionError("Full processing not expected")
+
+
+def test_process_incremental_exchange_change(chain, monkeypatch):
+    db = Database("chain")
+    assert not db.dirty
+    assert not ChangeLog.select().count()
+
+    exc = next(iter(get_activity(("chain", "3")).technosphere()))
+    exc["amount"] = 42
+    exc.save()
+
+    db = Database("chain")
+    assert db.dirty
+    assert [(o.database, o.node) for o in ChangeLog.select()] == [
+        ("chain", get_id(("chain", "3")))
+    ]
+
+    with monkeypatch.context() as m:
+        m.setattr(Database, "_process_all", no_full_processing)
+        db.process()
+    assert not ChangeLog.select().count()
+    assert not Database("chain").dirty
+
+    incremental = processed_vectors(db)
+    assert 42 in incremental[0]["amount"]
+    for first, second in zip(incremental, reprocessed_vectors(db)):
+        assert_vectors_equal(first, second)
+
+
+def test_process_incremental_new_node_and_deleted_edge(chain, monkeypatch):
+    db = Database("chain")
+    node = db.new_activity(code="new", name="new node", location="GLO")
+    node.save()
+    node.new_exchange(input=("biosphere", "2"), amount=7, type="biosphere").save()
+    next(iter(get_activity(("chain", "5")).biosphere())).delete()
+
+    with monkeypatch.context() as m:
+        m.setattr(Database, "_process_all", no_full_processing)
+        db.process()
+
+    technosphere, biosphere = processed_vectors(db)
+    assert len(biosphere) == 10
+    # Implicit production for new node
+    assert (node.id, node.id) in {(o["row"], o["col"]) for o in technosphere}
+    assert len(technosphere) == 21
+    assert Database("chain").depends == ["biosphere"]
+
+    for first, second in zip((technosphere, biosphere), reprocessed_vectors(db)):
+        assert_vectors_equal(first, second)
+
+
+def test_process_incremental_fallbacks(chain, monkeypatch):
+    db = Database("chain")
+    ids = [get_id(("chain", str(i))) for i in range(3)]
+    Database.set_dirty("chain", ids)
+    # Too many nodes changed
+    assert db._changed_nodes() is None
+
+    db.process()
+    Database.set_dirty("chain", ids[:1])
+    assert db._changed_nodes() == set(ids[:1])
+    # Changes not tracked at node level
+    Database.set_dirty("chain")
+    assert db._changed_nodes() is None
+
+    db.process()
+    Database.set_dirty("chain", ids[:1])
+    db.filepath_processed(clean=False).unlink()
+    # No existing processed data
+    assert db._changed_nodes() is None
+
+
+def test_write_requires_full_processing(chain):
+    db = Database("chain")
+    db.write(
+        {("chain", "1"): {"exchanges": [], "name": "foo"}},
+        process=False,
+    )
+    assert [(o.database, o.node) for o in ChangeLog.select()] == [("chain", None)]
+    db.process()
+    assert not ChangeLog.select().count()
+
+
+def test_clean_all_parallel(chain):
+    Database.set_dirty("biosphere")
+    Database.set_dirty("chain")
+    for name in ("biosphere", "chain"):
+        Database(name).filepath_processed(clean=False).unlink()
+
+    Database.clean_all(processes=2)
+
+    for name in ("biosphere", "chain"):
+        assert not Database(name).dirty
+        assert Database(name).filepath_processed(clean=False).is_file()
+    assert Database("chain").depends == ["biosphere"]
+    assert not ChangeLog.select().count()
+    assert len(processed_vectors(Database("chain"))[0]) == 20
+
+
+def test_process_exchange_array_batches(chain, monkeypatch):
+    db = Database("chain")
+    expected = processed_vectors(db)
+
+    # Half of the rows use the legacy path, and the rest is fetched in several batches
+    monkeypatch.setattr(backends_base, "_FETCH_BATCH_SIZE", 3)
+    ExchangeDataset.update(amount=None).where(ExchangeDataset.id % 2 == 0).execute()
+    for vector, other in zip(reprocessed_vectors(db), expected):
+        assert_vectors_equal(vector, other)
+
+
+def test_process_exchange_array_unknown_input(chain):
+    ExchangeDataset.update(input_code="missing").where(
+        ExchangeDataset.output_code == "5", ExchangeDataset.type == "technosphere"
+    ).execute()
+    with pytest.raises(UnknownObject):
+        reprocessed_vectors(Database("chain"))
+
+
+@bw2test
+def test_write_batches(monkeypatch):
+    monkeypatch.setattr(backends_base, "_WRITE_BATCH_SIZE", 7)
+    db = Database("testy")
+    db.write(
+        {
+            ("testy", str(i)): {
+                "location": "DE" if i % 2 else None,
+                "exchanges": [
+                    {"input": ("testy", str(i)), "amount": j, "type": "technosphere"}
+                    for j in range(1, 4)
+                ],
+            }
+            for i in range(30)
+        }
+    )
+    assert ExchangeDataset.select().count() == 90
+    assert len(db) == 30
+    assert get_activity(("testy", "1"))["location"] == "DE"
+    assert get_activity(("testy", "2")).get("location") is None
+    exc = next(iter(get_activity(("testy", "3")).technosphere()))
+    assert exc._document.amount == exc["amount"]
+    assert exc.input.key == ("testy", "3")
+
+
+@bw2test
+def test_rewrite_large_database():
+    data = {("testy", str(i)): {"name": str(i)} for i in range(501)}
+    Database("testy").write(data)
+    Database("testy").write(data)
+    assert len(Database("testy")) == 501
+
+
+@bw2test
+def test_write_bulk_import_pragmas(monkeypatch):
+    def synchronous():
+        return sqlite3_lci_db.execute_sql("PRAGMA synchronous").fetchone()[0]
+
+    during = []
+    original = Database._flush_rows
+    monkeypatch.setattr(
+        Database,
+        "_flush_rows",
+        lambda self, model, rows: during.append(synchronous())
+        or original(self, model, rows),
+    )
+    default = synchronous()
+    config.p["bulk_import_pragmas"] = {"synchronous": "OFF", "temp_store": "MEMORY"}
+    Database("biosphere").write(biosphere)
+    assert len(Database("biosphere")) == 2
+    assert during and set(during) == {0}
+    assert synchronous() == default != 0
+
+
+@bw2test
+def test_large_write_adds_indices_and_statistics():
+    Database("testy").write(
+        (
+            (
+                ("testy", str(i)),
+                {
+                    "exchanges": [
+                        {"input": ("testy", str(i)), "amount": 1, "type": "production"}
+                    ]
+                },
+            )
+            for i in range(100)
+        )
+    )
+    indices = {
+        name
+        for (name,) in sqlite3_lci_db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert set(backends_base.INDICES).issubset(indices)
+    assert sqlite3_lci_db.execute_sql(
+        "SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'exchangedataset'"
+    ).fetchone()[0]
+
+
+@bw2test
+def test_exchange_columns_populated():
+    Database("biosphere").write(biosphere)
+    Database("testy").write(
+        {
+            ("testy", "A"): {
+                "exchanges": [
+                    {
+                        "input": ("testy", "A"),
+                        "amount": -2,
+                        "uncertainty_type": 2,
+                        "loc": 0.5,
+                        "scale": 0.1,
+                        "type": "technosphere",
+                    },
+                    {
+                        "input": ("biosphere", "1"),
+                        "amount": 3,
+                        "uncertainty type": 4,
+                        "minimum": 1,
+                        "maximum": np.float64(5),
+                        "type": "biosphere",
+                    },
+                    {
+                        "input": ("biosphere", "2"),
+                        "amount": 1,
+                        "scale": "foo",
+                        "type": "biosphere",
+                    },
+                ]
+            }
+        },
+        process=False,
+    )
+    fields = ("amount", "uncertainty_type", "loc", "scale", "minimum", "maximum")
+    rows = {
+        obj.input_code: (tuple(getattr(obj, field) for field in fields), obj.negative)
+        for obj in ExchangeDataset.select()
+    }
+    assert rows == {
+        "A": ((-2, 2, 0.5, 0.1, None, None), True),
+        "1": ((3, 4, None, None, 1, 5), False),
+        "2": ((None,) * 6, None),
+    }
+
+    exc = next(iter(get_activity(("testy", "A")).biosphere()))
+    exc["amount"] = 7
+    exc.save()
+    assert ExchangeDataset.get(ExchangeDataset.id == exc._document.id).amount == 7
+
+
+def test_process_exchange_columns_match_data_blob(chain):
+    db = Database("chain")
+    exc = next(iter(get_activity(("chain", "4")).technosphere()))
+    exc.update({"uncertainty_type": 3, "loc": 1.5, "scale": 0.2, "negative": True})
+    exc.save()
+    expected = reprocessed_vectors(db)
+
+    ExchangeDataset.update(amount=None).execute()
+    for vector, other in zip(reprocessed_vectors(db), expected):
+        assert_vectors_equal(vector, other)
+
+
+def test_exchange_save_one_statement(chain):
+    exc = next(iter(get_activity(("chain", "4")).technosphere()))
+    exc["comment"] = "same amount"
+    exc["input"] = ("chain", "2")
+    statements = []
+    connection = sqlite3_lci_db.db.connection()
+    connection.set_trace_callback(statements.append)
+    try:
+        exc.save()
+    finally:
+        connection.set_trace_callback(None)
+
+    # The statement is traced again for each trigger program
+    writes = {
+        sql
+        for sql in statements
+        if '"exchangedataset"' in sql and not sql.startswith("SELECT")
+    }
+    assert len(writes) == 1
+    document = ExchangeDataset.get(ExchangeDataset.id == exc._document.id)
+    assert document.amount == 5
+    assert document.data["comment"] == "same amount"
+    assert document.input_id == get_id(("chain", "2"))
+
+
+def test_exchange_columns_reset_by_data_update(chain):
+    db = Database("chain")
+    exc = next(iter(get_activity(("chain", "4")).technosphere()))
+    exc["comment"] = "same amount"
+    exc.save()
+    document = ExchangeDataset.get(ExchangeDataset.id == exc._document.id)
+    assert document.amount == exc["amount"] == 5
+
+    # Bulk update of the blob, e.g. by older versions, doesn't set the numeric columns
+    ExchangeDataset.update(data={**document.data, "amount": 42}).where(
+        ExchangeDataset.id == document.id
+    ).execute()
+    document = ExchangeDataset.get(ExchangeDataset.id == document.id)
+    assert document.amount is None and document.uncertainty_type is None
+    assert 42 in reprocessed_vectors(db)[0]["amount"]
+    assert 5 not in reprocessed_vectors(db)[0]["amount"]
+
+
 @pytest.fixture
 @bw2test
 def df_fixture():
@@ -1047,6 +1495,173 @@ def test_edges_to_dataframe_formatters(df_fixture):
     assert_series_equal(df["foo"], pd.Series(["bar"] * 4, name="foo"))
 
 
+@pytest.mark.parametrize("categorical", [True, False])
+def test_edges_to_dataframe_matches_wurst_extraction(df_fixture, categorical):
+    db = Database("food")
+    df = db.edges_to_dataframe(categorical=categorical)
+    expected = db._wurst_edges_to_dataframe(categorical=categorical, formatters=[])
+    assert_frame_equal(
+        df.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+        expected.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+        check_dtype=False,
+    )
+
+
+def test_edges_to_dataframe_without_amount_columns(df_fixture):
+    expected = Database("food").edges_to_dataframe()
+    ExchangeDataset.update(amount=None).execute()
+    df = Database("food").edges_to_dataframe()
+    assert_frame_equal(
+        df.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+        expected.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+    )
+
+
+def test_edges_to_dataframe_unknown_node(df_fixture):
+    get_activity(("food", "1")).new_exchange(
+        input=("food", "missing"), amount=1, type="technosphere"
+    ).save()
+    with pytest.raises(UnknownObject):
+        Database("food").edges_to_dataframe()
+
+
+def test_edges_to_dataframe_chunks(df_fixture):
+    db = Database("food")
+    types = db._edge_types()
+    assert types == ["biosphere", "technosphere"]
+    chunks = list(db._sqlite_edge_arrays(types, chunksize=3))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert sorted(np.concatenate(chunks)["edge_amount"].tolist()) == [
+        0.05,
+        0.15,
+        0.25,
+        0.5,
+    ]
+
+
+def test_iter_edges_dataframes(df_fixture):
+    db = Database("food")
+    chunks = list(db.iter_edges_dataframes(chunksize=3))
+    assert [len(df) for df in chunks] == [3, 1]
+    for column in chunks[0].columns:
+        assert len({df[column].dtype for df in chunks}) == 1
+    assert chunks[0]["source_categories"].dtype.name == "category"
+
+    df = pd.concat(chunks)
+    assert df["edge_type"].dtype.name == "category"
+    expected = db.edges_to_dataframe()
+    df["source_categories"] = df["source_categories"].cat.remove_unused_categories()
+    assert_frame_equal(
+        df.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+        expected.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+    )
+
+
+def test_iter_edges_dataframes_writes_between_chunks(df_fixture):
+    # No read transaction is kept open between chunks, which would block writes
+    chunks = Database("food").iter_edges_dataframes(chunksize=1)
+    next(chunks)
+    exc = next(iter(get_activity(("food", "1")).technosphere()))
+    exc["comment"] = "changed"
+    exc.save()
+    assert len(list(chunks)) == 3
+
+
+def test_iter_edges_dataframes_not_categorical(df_fixture):
+    db = Database("food")
+    df = pd.concat(db.iter_edges_dataframes(chunksize=2, categorical=False))
+    expected = db.edges_to_dataframe(categorical=False)
+    assert_frame_equal(
+        df.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+        expected.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+    )
+
+
+def test_iter_nodes_dataframes(df_fixture):
+    chunks = list(Database("biosphere").iter_nodes_dataframes(chunksize=1))
+    assert len(chunks) == len(Database("biosphere"))
+    assert all(list(df.columns) == list(chunks[0].columns) for df in chunks)
+    assert len({df["location"].dtype for df in chunks}) == 1
+    assert chunks[0]["database"].dtype.name == "category"
+
+    df = pd.concat(Database("food").iter_nodes_dataframes(columns=["id", "name"]))
+    assert df.to_dict("records") == [
+        {"id": get_id(("food", "1")), "name": "lunch"},
+        {"id": get_id(("food", "2")), "name": "dinner"},
+    ]
+
+
+def test_to_parquet(df_fixture, tmp_path):
+    pytest.importorskip("pyarrow")
+    assert Database("food").to_parquet(tmp_path / "edges.parquet", chunksize=3) == 4
+    df = pd.read_parquet(tmp_path / "edges.parquet")
+    assert len(df) == 4
+    assert df["edge_type"].dtype.name == "category"
+    assert Database("food").to_parquet(tmp_path / "nodes.parquet", nodes=True) == 2
+
+
+@bw2test
+def test_to_parquet_tuple_location(tmp_path):
+    pytest.importorskip("pyarrow")
+    Database("biosphere").write(biosphere)
+    Database("food").write(
+        {
+            ("food", "1"): {
+                "name": "lunch",
+                "location": ("ecoinvent", "RER w/o CH"),
+                "exchanges": [
+                    {"input": ("food", "2"), "amount": 1, "type": "technosphere"},
+                    {"input": ("biosphere", "1"), "amount": 2, "type": "biosphere"},
+                ],
+            },
+            ("food", "2"): {"name": "dinner", "location": "CH", "exchanges": []},
+        }
+    )
+    db = Database("food")
+    assert db.to_parquet(tmp_path / "nodes.parquet", nodes=True, chunksize=1) == 2
+    nodes = pd.read_parquet(tmp_path / "nodes.parquet")
+    assert sorted(nodes["location"].astype(str)) == [
+        "('ecoinvent', 'RER w/o CH')",
+        "CH",
+    ]
+    assert db.to_parquet(tmp_path / "edges.parquet", chunksize=1) == 2
+    edges = pd.read_parquet(tmp_path / "edges.parquet")
+    assert set(edges["target_location"].astype(str)) == {"('ecoinvent', 'RER w/o CH')"}
+    assert edges["source_location"].isna().sum() == 1
+    assert set(edges["source_location"].dropna()) == {"CH"}
+
+
+def test_with_string_values():
+    location = pd.CategoricalDtype([("ecoinvent", "RER"), "CH", "('ecoinvent', 'RER')"])
+    chunks = [
+        pd.DataFrame(
+            {
+                "location": pd.Categorical(values, dtype=location),
+                "code": ["a", ("b", "c")][: len(values)],
+            }
+        )
+        for values in ([("ecoinvent", "RER"), None], ["CH"])
+    ]
+    converted = [backends_base._with_string_values(df) for df in chunks]
+    # Same categories for all chunks, also if a chunk doesn't contain tuples
+    assert converted[0]["location"].dtype == converted[1]["location"].dtype
+    assert list(converted[0]["location"].cat.categories) == [
+        "('ecoinvent', 'RER')",
+        "CH",
+    ]
+    assert converted[0]["location"].tolist()[0] == "('ecoinvent', 'RER')"
+    assert pd.isna(converted[0]["location"].tolist()[1])
+    assert converted[1]["location"].tolist() == ["CH"]
+    assert converted[0]["code"].tolist() == ["a", "('b', 'c')"]
+    assert chunks[0]["location"].tolist()[0] == ("ecoinvent", "RER")
+
+
+def test_to_parquet_requires_pyarrow(df_fixture, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ImportError):
+        Database("food").to_parquet(tmp_path / "edges.parquet")
+
+
 def test_nodes_to_dataframe_simple(df_fixture):
     df = Database("food").nodes_to_dataframe()
     expected = pd.DataFrame(
@@ -1106,3 +1721,117 @@ def test_nodes_to_dataframe_columns(df_fixture):
 def test_nodes_to_dataframe_unsorted(df_fixture):
     df = Database("food").nodes_to_dataframe()
     assert df.shape == (2, 9)
+
+
+def assert_node_ids_consistent():
+    rows = sqlite3_lci_db.execute_sql(
+        """SELECT e.input_id, a.id, e.output_id, b.id FROM exchangedataset AS e
+        LEFT JOIN activitydataset AS a ON a.database = e.input_database AND a.code = e.input_code
+        LEFT JOIN activitydataset AS b ON b.database = e.output_database AND b.code = e.output_code"""
+    ).fetchall()
+    assert rows
+    for input_id, expected_input, output_id, expected_output in rows:
+        assert input_id == expected_input
+        assert output_id == expected_output
+
+
+@bw2test
+def test_exchange_node_ids():
+    Database("biosphere").write(biosphere)
+    db = Database("food")
+    db.write(copy.deepcopy(food_data), process=False)
+    assert_node_ids_consistent()
+
+    node = get_activity(("food", "1"))
+    exc = node.new_exchange(input=("food", "new"), amount=1, type="technosphere")
+    exc.save()
+    assert exc._document.input_id is None
+    assert_node_ids_consistent()
+    db.new_activity("new", name="new").save()
+    assert_node_ids_consistent()
+    exc.input = ("food", "2")
+    exc.save()
+    exc["amount"] = 2
+    exc.save()
+    assert_node_ids_consistent()
+
+    node = get_activity(("food", "2"))
+    node["code"] = "changed"
+    node.save()
+    assert_node_ids_consistent()
+    get_activity(("food", "new")).delete()
+    assert_node_ids_consistent()
+    Database("biosphere").rename("nature")
+    assert_node_ids_consistent()
+    db.copy("lunch")
+    assert_node_ids_consistent()
+    # Small write which doesn't rebuild indices
+    Database("more").write(
+        {
+            ("more", "a"): {
+                "exchanges": [
+                    {"input": ("food", "1"), "amount": 1, "type": "technosphere"}
+                ]
+            }
+        },
+        process=False,
+    )
+    db.write(copy.deepcopy(food_data), process=False)
+    assert_node_ids_consistent()
+    assert [exc.input.key for exc in get_activity(("more", "a")).technosphere()] == [
+        ("food", "1")
+    ]
+
+
+def test_exchanges_without_node_ids(chain, monkeypatch):
+    # Projects opened read-only before ``populate_exchange_node_ids_40`` was applied
+    db = Database("chain")
+
+    def exchanges(node):
+        return sorted(
+            (exc.input.key, exc.output.key, exc["amount"])
+            for exc in itertools.chain(
+                node.exchanges(), node.exchanges(prefetch=True), node.upstream()
+            )
+        )
+
+    nodes = [get_activity(("chain", "3")), get_activity(("biosphere", "1"))]
+    expected = [exchanges(node) for node in nodes]
+    expected_consumers = sorted(
+        exc["amount"] for exc in consumers_of([node.key for node in nodes])
+    )
+    expected_vectors = processed_vectors(db)
+    expected_edges = db.edges_to_dataframe()
+
+    for name in NODE_ID_TRIGGERS:
+        sqlite3_lci_db.execute_sql('DROP TRIGGER "{}"'.format(name))
+    sqlite3_lci_db.execute_sql(
+        "UPDATE exchangedataset SET input_id = NULL, output_id = NULL"
+    )
+
+    assert [exchanges(node) for node in nodes] == expected
+    assert (
+        sorted(exc["amount"] for exc in consumers_of([node.key for node in nodes]))
+        == expected_consumers
+    )
+    assert_frame_equal(db.edges_to_dataframe(), expected_edges)
+    assert_frame_equal(
+        pd.concat(db.iter_edges_dataframes(chunksize=2), ignore_index=True),
+        expected_edges,
+        check_categorical=False,
+    )
+    for array, expected_array in zip(reprocessed_vectors(db), expected_vectors):
+        assert_vectors_equal(array, expected_array)
+
+    exc = next(iter(nodes[0].technosphere()))
+    exc["amount"] = 42
+    exc.save()
+    nodes[0].biosphere().delete()
+    assert not len(nodes[0].biosphere())
+    with monkeypatch.context() as m:
+        m.setattr(Database, "_process_all", no_full_processing)
+        db.process()
+    incremental = processed_vectors(db)
+    assert 42 in incremental[0]["amount"]
+    for array, expected_array in zip(incremental, reprocessed_vectors(db)):
+        assert_vectors_equal(array, expected_array)
@@ -1,8 +1,11 @@
+import copy
+
 from bw2data import databases, projects
 from bw2data.backends import Activity as PWActivity
 from bw2data.backends import ActivityDataset
 from bw2data.backends import Exchange as PWExchange
 from bw2data.backends import ExchangeDataset
+from bw2data.backends.base import _filter_as_sql
 from bw2data.database import DatabaseChooser
 from bw2data.errors import (
     InvalidExchange,
@@ -12,7 +15,8 @@ from bw2data.errors import (
     ValidityError,
 )
 from bw2data.meta import geomapping, methods
-from bw2data.tests import BW2DataTest
+from bw2data.query import NF, Dictionaries, Filter, Query, Result
+from bw2data.tests import BW2DataTest, bw2test
 
 
 class DatabaseQuerysetTest(BW2DataTest):
@@ -146,3 +150,137 @@ class DatabaseQuerysetTest(BW2DataTest):
         db = DatabaseChooser("mysterious")
         with self.assertRaises(UnknownObject):
             db.make_searchable()
+
+
+@bw2test
+def test_query_sql_filters_same_as_python():
+    db = DatabaseChooser("testy")
+    db.write(
+        {
+            ("testy", "a"): {
+                "name": "Widget",
+                "location": "CH",
+                "reference product": "widget",
+                "exchanges": [
+                    {"input": ("testy", "b"), "amount": 2, "type": "technosphere"}
+                ],
+            },
+            ("testy", "b"): {
+                "name": "wiggle",
+                "location": ("foo", "bar"),
+                "reference product": "wiggle",
+                "unit": "kg",
+            },
+            ("testy", "c"): {"name": "lollipop", "location": "FR", "type": "other"},
+            ("testy", "d"): {"unit": "kg", "exchanges": []},
+        }
+    )
+    filters = [
+        Filter("name", "==", "wiggle"),
+        Filter("name", "is", "Widget"),
+        Filter("name", "!=", "wiggle"),
+        Filter("name", "<", "lollipop"),
+        Filter("name", ">=", "lollipop"),
+        Filter("name", "has", "idg"),
+        Filter("name", "in", "a wiggle of sorts"),
+        Filter("name", "in", ["lollipop", "Widget"]),
+        Filter("name", "iis", "widget"),
+        Filter("reference product", "has", "wi"),
+        Filter("location", "==", "CH"),
+        Filter("location", "not", "CH"),
+        Filter("location", "in", ["FR", "CH"]),
+        Filter("location", "has", "bar"),
+        Filter("location", "==", ("foo", "bar")),
+        Filter("type", "==", "process"),
+        Filter("code", "in", ("a", "d")),
+        Filter("unit", "==", "kg"),
+        Filter("name", lambda x, y: x.startswith(y), "w"),
+    ]
+    loaded = db.load()
+    for filter_ in filters:
+        expected = Query(filter_)(copy.deepcopy(loaded))
+        assert dict(db.query(filter_).items()) == dict(expected.items()), filter_.key
+
+    result = db.query(NF("idg"), Filter("location", "==", "CH"))
+    assert list(result) == [("testy", "a")]
+    assert result[("testy", "a")]["exchanges"] == loaded[("testy", "a")]["exchanges"]
+
+
+def test_filter_as_sql():
+    assert _filter_as_sql(Filter("name", "has", "foo")) is not None
+    assert _filter_as_sql(Filter("location", "in", ["foo"])) is not None
+    assert _filter_as_sql(Filter("name", "ihas", "foo")) is None
+    assert _filter_as_sql(Filter("location", "has", "foo")) is None
+    assert _filter_as_sql(Filter("name", "==", 1)) is None
+    assert _filter_as_sql(Filter("unit", "==", "kg")) is None
+
+
+def test_query_is_lazy():
+    consumed = []
+
+    def datasets():
+        for index in range(100):
+            consumed.append(index)
+            yield ("db", str(index)), {"name": "even" if index % 2 else "odd"}
+
+    result = Query(Filter("name", "==", "even"), NF("ev"))(datasets())
+    assert not consumed
+    first = result.limit(2)
+    assert list(first) == [("db", "1"), ("db", "3")]
+    assert consumed == [0, 1, 2, 3]
+    assert len(result) == 50
+    assert list(result)[:2] == list(first)
+
+
+def test_result_sort_with_limit():
+    data = {("db", str(i)): {"name": str(i), "amount": (i * 7) % 10} for i in range(10)}
+    expected = sorted(data.items(), key=lambda t: t[1]["amount"])
+
+    result = Query(Filter("amount", ">=", 0))(data)
+    result.sort("amount", limit=3)
+    assert list(result.items()) == expected[:3]
+
+    result = Query(Filter("amount", ">=", 0))(data)
+    result.sort("amount", reverse=True, limit=3)
+    assert (
+        list(result.items())
+        == sorted(data.items(), key=lambda t: t[1]["amount"], reverse=True)[:3]
+    )
+
+    result = Result(data)
+    result.sort("amount")
+    assert list(result.items()) == expected
+
+
+def test_query_callable_filters():
+    data = {("db", "a"): {"name": "a"}, ("db", "b"): {"name": "b"}}
+    result = Query(
+        lambda data: {k: v for k, v in data.items() if v["name"] == "b"},
+        Filter("name", "has", "b"),
+    )(data)
+    assert list(result) == [("db", "b")]
+
+
+@bw2test
+def test_dictionaries_streams_databases():
+    first = DatabaseChooser("first")
+    first.write(
+        {
+            ("first", str(index)): {
+                "name": "node {}".format(index),
+                "exchanges": [
+                    {"input": ("first", "0"), "amount": index, "type": "technosphere"}
+                ]
+                * (index % 3),
+            }
+            for index in range(20)
+        }
+    )
+    second = DatabaseChooser("second")
+    second.write({("second", "a"): {"name": "node a"}})
+
+    assert dict(first.iter_datasets()) == first.load()
+    result = Query(NF("node 1"))(Dictionaries(first, second.load()))
+    expected = Query(NF("node 1"))({**first.load(), **second.load()})
+    assert dict(result.items()) == dict(expected.items())
+    assert len(result) == 11
@@ -0,0 +1,246 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from bw_processing import INDICES_DTYPE, create_datapackage
+
+from bw2data import Database, Method, config, get_node, projects
+from bw2data.datapackages import (
+    _npy_header,
+    add_column_index,
+    add_persistent_vector_from_blocks,
+    datapackage_cache,
+    iterate_vector_blocks,
+    open_datapackage,
+    processed_filename,
+    processed_filesystem,
+)
+from bw2data.tests import bw2test
+
+from .fixtures import biosphere
+
+
+def _write_food():
+    Database("biosphere").write(biosphere)
+    Database("food").write(
+        {
+            ("food", "1"): {
+                "name": "lunch",
+                "exchanges": [
+                    {"input": ("food", "2"), "amount": 0.5, "type": "technosphere"},
+                    {"input": ("biosphere", "1"), "amount": 2, "type": "biosphere"},
+                ],
+            },
+            ("food", "2"): {"name": "dinner", "exchanges": []},
+        }
+    )
+
+
+def _arrays(dp):
+    return {
+        resource["name"]: np.array(array)
+        for array, resource in zip(dp.data, dp.resources)
+        if isinstance(array, np.ndarray)
+    }
+
+
+@bw2test
+def test_directory_storage():
+    _write_food()
+    zipped = _arrays(Database("food").datapackage())
+
+    config.p["datapackage_storage"] = "directory"
+    db = Database("food")
+    assert not db.filename_processed().endswith(".zip")
+    db.process()
+    fp = db.filepath_processed()
+    assert fp.is_dir()
+    assert (fp / "datapackage.json").is_file()
+    assert list(fp.glob("*.npy"))
+
+    dp = db.datapackage()
+    assert all(
+        isinstance(array, np.memmap)
+        for array in dp.data
+        if isinstance(array, np.ndarray)
+    )
+    arrays = _arrays(dp)
+    assert arrays.keys() == zipped.keys()
+    for name, array in arrays.items():
+        assert np.array_equal(array, zipped[name])
+
+
+@bw2test
+def test_directory_storage_rewrite():
+    config.p["datapackage_storage"] = "directory"
+    _write_food()
+    node = get_node(database="food", code="2")
+    node.new_edge(input=("biosphere", "2"), amount=3, type="biosphere").save()
+    Database("food").process()
+
+    dp = Database("food").datapackage()
+    name = [
+        resource["name"]
+        for resource in dp.resources
+        if resource["name"].endswith("biosphere_matrix.data")
+    ][0]
+    assert sorted(dp.get_resource(name)[0]) == [2, 3]
+    assert (
+        len(list(Database("food").filepath_processed().iterdir()))
+        == len(dp.resources) + 1
+    )
+
+
+@bw2test
+def test_directory_storage_method():
+    config.p["datapackage_storage"] = "directory"
+    Database("biosphere").write(biosphere)
+    method = Method(("a", "method"))
+    method.write([(("biosphere", "1"), 42)])
+    assert method.filepath_processed().is_dir()
+    dp = method.datapackage()
+    assert 42 in dp.get_resource(dp.resources[0]["name"].split(".")[0] + ".data")[0]
+
+
+@bw2test
+def test_storage_change_loads_existing_datapackage():
+    _write_food()
+    zip_fp = Database("food").filepath_processed()
+    config.p["datapackage_storage"] = "directory"
+    assert not Database("food").filepath_processed().exists()
+    assert str(Database("food").datapackage().fs) == str(open_datapackage(zip_fp).fs)
+
+    Database("food").process()
+    assert Database("food").filepath_processed().is_dir()
+
+
+@bw2test
+def test_datapackage_cache():
+    _write_food()
+    first, second = Database("food").datapackage(), Database("food").datapackage()
+    assert first is not second
+    assert first.metadata is not second.metadata
+    assert all(a is b for a, b in zip(first.data, second.data))
+    with pytest.raises(ValueError):
+        first.data[1][0] = 1
+
+    first.filtered = 1
+    assert not hasattr(second, "filtered")
+    first.metadata["name"] = "changed"
+    assert Database("food").datapackage().metadata["name"] != "changed"
+
+    get_node(database="food", code="1").new_edge(
+        input=("biosphere", "2"), amount=3, type="biosphere"
+    ).save()
+    Database("food").process()
+    third = Database("food").datapackage()
+    assert not all(a is b for a, b in zip(first.data, third.data))
+
+
+@bw2test
+def test_datapackage_cache_evicts_least_recently_used(monkeypatch):
+    _write_food()
+    monkeypatch.setattr(datapackage_cache, "maxsize", 1)
+    datapackage_cache.clear()
+    Database("food").datapackage()
+    Database("biosphere").datapackage()
+    assert list(datapackage_cache._datapackages) == [
+        Database("biosphere").filepath_processed().absolute()
+    ]
+
+
+@pytest.mark.parametrize("storage", ["zip", "directory"])
+@bw2test
+def test_add_persistent_vector_from_blocks(storage):
+    config.p["datapackage_storage"] = storage
+    fp = projects.dir / "processed" / processed_filename("blocks")
+    dp = create_datapackage(fs=processed_filesystem(fp), name="blocks")
+    blocks = [
+        {"row": np.arange(5), "col": np.arange(5) + 10, "amount": np.ones(5) / 3},
+        np.array(
+            [(5, 15, 2.0, False), (6, 16, 3.0, False)],
+            dtype=[("row", int), ("col", int), ("amount", float), ("flip", bool)],
+        ),
+    ]
+    progress = []
+    assert (
+        add_persistent_vector_from_blocks(
+            dp,
+            blocks=blocks,
+            matrix="foo_matrix",
+            name="foo",
+            chunksize=1,
+            progress=lambda nrows, elapsed: progress.append(nrows),
+        )
+        == 7
+    )
+    assert progress == [1, 2, 3, 4, 5, 6, 7]
+    dp.finalize_serialization()
+
+    dp = open_datapackage(fp)
+    assert [resource["name"] for resource in dp.resources] == [
+        "foo.indices",
+        "foo.data",
+    ]
+    assert {resource["nrows"] for resource in dp.resources} == {7}
+    indices, data = dp.get_resource("foo.indices")[0], dp.get_resource("foo.data")[0]
+    assert indices.dtype == np.dtype(INDICES_DTYPE)
+    assert indices["row"].tolist() == list(range(7))
+    assert indices["col"].tolist() == list(range(10, 17))
+    assert np.allclose(data, [1 / 3] * 5 + [2, 3])
+
+
+@pytest.mark.parametrize("storage", ["zip", "directory"])
+@bw2test
+def test_add_column_index(storage):
+    config.p["datapackage_storage"] = storage
+    fp = projects.dir / "processed" / processed_filename("columns")
+    dp = create_datapackage(fs=processed_filesystem(fp), name="columns")
+    block = {"row": np.arange(6), "col": [12, 10, 12, 11, 10, 12], "amount": np.ones(6)}
+    add_persistent_vector_from_blocks(
+        dp, blocks=[block], matrix="foo_matrix", name="foo"
+    )
+    add_column_index(dp, "foo")
+    dp.finalize_serialization()
+
+    dp = open_datapackage(fp)
+    assert [
+        (resource["name"], resource["category"])
+        for resource in dp.resources
+        if "matrix" not in resource
+    ] == [
+        ("foo.column_order", "column index"),
+        ("foo.column_columns", "column index"),
+        ("foo.column_offsets", "column index"),
+    ]
+    order = dp.get_resource("foo.column_order")[0]
+    assert order.tolist() == [1, 4, 3, 0, 2, 5]
+    assert dp.get_resource("foo.column_columns")[0].tolist() == [10, 11, 12]
+    assert dp.get_resource("foo.column_offsets")[0].tolist() == [0, 2, 3, 6]
+    assert isinstance(order, np.memmap) == (storage == "directory")
+
+
+def test_iterate_vector_blocks_chunks():
+    block = {"row": np.arange(10), "col": np.arange(10) + 10, "amount": np.ones(10)}
+    for blocks in ([block], [pd.DataFrame(block)], [pd.DataFrame(block).to_records()]):
+        chunks = list(iterate_vector_blocks(blocks, chunksize=3))
+        assert [len(data) for _, data, _ in chunks] == [3, 3, 3, 1]
+        assert np.hstack([indices["row"] for indices, _, _ in chunks]).tolist() == list(
+            range(10)
+        )
+
+    chunks = list(iterate_vector_blocks([{"row": [], "col": [], "amount": []}]))
+    assert [len(data) for _, data, _ in chunks] == [0]
+    with pytest.raises(ValueError):
+        list(iterate_vector_blocks([{"row": [1], "col": [1]}]))
+
+
+def test_npy_header_size():
+    for nrows in (0, 7, 10**6, np.iinfo(np.int64).max):
+        header = _npy_header(INDICES_DTYPE, nrows)
+        assert len(header) == len(_npy_header(INDICES_DTYPE, 0))
+        assert not len(header) % 64
+        stream = io.BytesIO(header)
+        np.lib.format.read_magic(stream)
+        assert np.lib.format.read_array_header_1_0(stream)[0] == (nrows,)
@@ -1,5 +1,6 @@
 from bw2data import (
     Method,
+    consumers_of,
     databases,
     geomapping,
     get_activity,
@@ -7,6 +8,7 @@ from bw2data import (
     methods,
     projects,
 )
+from bw2data.backends import sqlite3_lci_db
 from bw2data.database import DatabaseChooser
 from bw2data.parameters import ActivityParameter, ParameterizedExchange, parameters
 from bw2data.tests import bw2test
@@ -173,6 +175,83 @@ def test_upstream_bio(activity):
     assert len(act.upstream()) == 0
 
 
+def test_upstream_excludes_only_own_production(activity):
+    DatabaseChooser("other").write(
+        {
+            ("other", "a"): {
+                "exchanges": [
+                    {"input": ("other", "a"), "amount": 1, "type": "production"},
+                    {"input": ("db", "a"), "amount": 6, "type": "production"},
+                ]
+            },
+        }
+    )
+    upstream = activity.upstream(kinds=None)
+    assert sorted(exc["amount"] for exc in upstream) == [5, 6]
+    assert len(upstream) == 2
+    assert [exc["amount"] for exc in activity.upstream(kinds=("production",))] == [6]
+
+
+def test_upstream_uses_index(activity):
+    qs = activity.upstream()._get_queryset()
+    sql, params = qs.sql()
+    plan = " ".join(
+        str(row)
+        for row in sqlite3_lci_db.execute_sql("EXPLAIN QUERY PLAN " + sql, params)
+    )
+    assert "exchangedataset_input_id_type" in plan
+
+
+def test_upstream_pagination(activity):
+    act = get_activity(("db", "b"))
+    assert [exc["amount"] for exc in act.upstream(kinds=None)] == [3, -0.1]
+    page = act.upstream(kinds=None, limit=1, offset=1)
+    assert [exc["amount"] for exc in page] == [-0.1]
+    assert len(page) == 1
+    assert [exc["amount"] for exc in act.consumers(kinds=None, limit=1)] == [3]
+    assert [
+        exc.output["name"] for exc in act.upstream(kinds=None, limit=1, prefetch=True)
+    ] == ["a"]
+
+    act.upstream(kinds=None, limit=1).delete()
+    assert [exc["amount"] for exc in act.upstream(kinds=None)] == [-0.1]
+
+
+def test_consumers_of(activity):
+    keys = [("db", "a"), ("db", "b"), ("db", "missing")]
+    assert sorted(exc["amount"] for exc in consumers_of(keys)) == [3, 5]
+    assert sorted(exc["amount"] for exc in consumers_of(keys, kinds=None)) == [
+        -0.1,
+        3,
+        5,
+    ]
+    assert len(consumers_of(keys, kinds=None, limit=2)) == 2
+    assert [
+        (exc.input["name"], exc.output["name"])
+        for exc in consumers_of(keys, prefetch=True)
+    ] == [("b", "a"), ("a", "d")]
+    assert list(consumers_of([])) == []
+
+
+def test_consumers_of_delete(activity):
+    DatabaseChooser("other").write({("other", "x"): {"name": "x"}})
+    assert not DatabaseChooser("db").dirty and not DatabaseChooser("other").dirty
+    # Without edges, the databases of all nodes are marked for reprocessing
+    consumers_of([("other", "x"), ("db", "missing")]).delete()
+    assert DatabaseChooser("db").dirty and DatabaseChooser("other").dirty
+
+    consumers_of([("other", "x"), ("db", "b")], kinds=None).delete()
+    assert not list(consumers_of([("db", "b")], kinds=None))
+    assert [exc["amount"] for exc in consumers_of([("db", "a")])] == [5]
+
+
+def test_consumers_of_unknown_node(activity):
+    get_activity(("db", "d")).new_edge(
+        input=("db", "later"), amount=7, type="technosphere"
+    ).save()
+    assert [exc["amount"] for exc in consumers_of([("db", "later")])] == [7]
+
+
 def test_ordering_consistency(activity):
     ordering = [[exc["amount"] for exc in activity.exchanges()] for _ in range(100)]
     for sample in ordering[1:]:
@@ -16,7 +16,8 @@ from bw2data import (
 )
 from bw2data.backends import Activity
 from bw2data.backends.iotable import IOTableActivity, IOTableExchanges, ReadOnlyExchange
-from bw2data.errors import InvalidDatapackage
+from bw2data.datapackages import open_datapackage
+from bw2data.errors import InvalidDatapackage, UnknownObject
 from bw2data.tests import bw2test
 
 
@@ -481,3 +482,287 @@ def test_iotable_filtered_datapackage(iotable_fixture):
     IOTableExchanges(datapackage=dp, target=get_node(code="b"))
     with pytest.raises(InvalidDatapackage):
         IOTableExchanges(datapackage=dp, target=get_node(code="a"))
+
+
+def test_iotable_activity_datapackage_cached(iotable_fixture):
+    first = get_node(code="a").technosphere()
+    second = get_node(code="b").technosphere()
+    assert first.datapackage is not second.datapackage
+    assert all(x is y for x, y in zip(first.datapackage.data, second.datapackage.data))
+    assert [exc.input["code"] for exc in first] == ["b"]
+    assert [exc.input["code"] for exc in second] == ["c"]
+
+
+def test_iotable_exchanges_as_arrays(iotable_fixture):
+    a, b, c = (get_id(("cat", x)) for x in "abc")
+    d = get_id(("mouse", "d"))
+    rows, cols, amounts, types = IOTableExchanges(
+        datapackage=Database("cat").datapackage()
+    ).as_arrays()
+    amounts = np.round(amounts.astype(float), 6).tolist()
+    assert sorted(zip(rows.tolist(), cols.tolist(), amounts, types)) == sorted(
+        [
+            (a, a, 2, "production"),
+            (a, c, 3, "technosphere"),
+            (b, a, -1, "technosphere"),
+            (b, b, -1, "production"),
+            (c, a, 4, "production"),
+            (c, b, 0.2, "technosphere"),
+            (c, c, 1, "technosphere"),
+            (d, b, -1, "biosphere"),
+            (d, c, 2, "biosphere"),
+        ]
+    )
+
+    rows, cols, amounts, types = get_node(code="c").technosphere().as_arrays()
+    assert rows.tolist() == [a, c]
+    assert cols.tolist() == [c, c]
+    assert amounts.tolist() == [3, 1]
+    assert types.tolist() == ["technosphere", "technosphere"]
+
+    rows, cols, amounts, types = get_node(code="c").biosphere().as_arrays()
+    assert (rows.tolist(), cols.tolist(), amounts.tolist()) == ([d], [c], [2])
+
+
+def test_iotable_exchanges_column_slices(iotable_fixture):
+    dp = Database("cat").datapackage()
+    exchanges = IOTableExchanges(datapackage=dp, target=get_node(code="b"))
+    assert sorted(
+        (exc["type"], exc.input["code"], round(float(exc["amount"]), 6))
+        for exc in exchanges
+    ) == [
+        ("biosphere", "d", -1),
+        ("production", "b", -1),
+        ("technosphere", "c", 0.2),
+    ]
+    other = Database("cat").datapackage()
+    # Column index written with the datapackage, and shared by all copies
+    assert sorted(
+        obj["kind"] for obj in other.resources if obj["category"] == "column index"
+    ) == ["columns", "columns", "offsets", "offsets", "order", "order"]
+    assert other._bw2data_derived is dp._bw2data_derived
+    orders = [
+        dp.get_resource(obj["name"])[0]
+        for obj in dp.resources
+        if obj["category"] == "column index" and obj["kind"] == "order"
+    ]
+    for array in orders:
+        assert any(
+            np.array_equal(index["order"], array)
+            for index in other._bw2data_derived.values()
+        )
+
+    missing = Activity(document=None, database="cat", code="missing")
+    missing._document.id = 10**6
+    assert not len(IOTableExchanges(datapackage=other, target=missing))
+
+
+def test_iotable_exchanges_column_index_not_written(iotable_fixture):
+    dp = open_datapackage(Database("cat").filepath_processed())
+    for position in reversed(range(len(dp.resources))):
+        if dp.resources[position]["category"] == "column index":
+            del dp.resources[position], dp.data[position]
+
+    exchanges = IOTableExchanges(datapackage=dp, target=get_node(code="c"))
+    assert sorted(
+        (exc["type"], exc.input["code"], round(float(exc["amount"]), 6))
+        for exc in exchanges
+    ) == [("biosphere", "d", 2), ("technosphere", "a", 3), ("technosphere", "c", 1)]
+    for index in dp._bw2data_derived.values():
+        assert not index["order"].flags.writeable
+
+
+def test_iotable_exchanges_share_nodes(iotable_fixture):
+    exchanges = list(get_node(code="c").exchanges())
+    assert len(exchanges) == 3
+    outputs = {id(exc.output) for exc in exchanges}
+    assert len(outputs) == 1
+
+
+def _write_cat_nodes():
+    Database.create(name="mouse").write(
+        {("mouse", "d"): {"name": "squeak", "type": "emission"}}
+    )
+    cat = Database.create(name="cat", backend="iotable")
+    cat.write(
+        {
+            ("cat", "a"): {"name": "a", "unit": "meow", "location": "sunshine"},
+            ("cat", "b"): {"name": "b", "unit": "purr", "location": "curled up"},
+            ("cat", "c"): {"name": "c", "unit": "meow", "location": "on lap"},
+        }
+    )
+    return cat
+
+
+def _edge_array(edges):
+    array = np.zeros(
+        len(edges),
+        dtype=[("row", np.int64), ("col", np.int64), ("amount", float), ("flip", bool)],
+    )
+    for index, (row, col, amount, flip) in enumerate(edges):
+        array[index] = (get_id(row), get_id(col), amount, flip)
+    return array
+
+
+@bw2test
+def test_iotable_write_exchanges_blocks(tmp_path, capsys):
+    cat = _write_cat_nodes()
+    tech = _edge_array(
+        [
+            (("cat", "a"), ("cat", "a"), 2, False),
+            (("cat", "a"), ("cat", "c"), 3, True),
+            (("cat", "b"), ("cat", "a"), -1, False),
+            (("cat", "b"), ("cat", "b"), -1, True),
+            (("cat", "c"), ("cat", "a"), 4, False),
+            (("cat", "c"), ("cat", "b"), 0.2, True),
+            (("cat", "c"), ("cat", "c"), 1, True),
+        ]
+    )
+    bio = _edge_array(
+        [
+            (("mouse", "d"), ("cat", "b"), -1, True),
+            (("mouse", "d"), ("cat", "c"), 2, False),
+        ]
+    )
+    np.save(tmp_path / "biosphere.npy", bio)
+
+    def technosphere():
+        yield {name: tech[name][:2] for name in ("row", "col", "amount", "flip")}
+        yield pd.DataFrame(tech[2:5])
+        yield tech[5:]
+
+    cat.write_exchanges(
+        technosphere=technosphere(),
+        biosphere=tmp_path / "biosphere.npy",
+        dependents=["mouse"],
+        chunksize=1,
+    )
+    assert "Wrote 7 technosphere edges" in capsys.readouterr().out
+
+    a, b, c = (get_id(("cat", x)) for x in "abc")
+    d = get_id(("mouse", "d"))
+    rows, cols, amounts, types = IOTableExchanges(
+        datapackage=cat.datapackage()
+    ).as_arrays()
+    assert amounts.dtype == np.float64
+    assert sorted(zip(rows.tolist(), cols.tolist(), amounts.tolist(), types)) == sorted(
+        [
+            (a, a, 2, "production"),
+            (a, c, 3, "technosphere"),
+            (b, a, -1, "technosphere"),
+            (b, b, -1, "production"),
+            (c, a, 4, "production"),
+            (c, b, 0.2, "technosphere"),
+            (c, c, 1, "technosphere"),
+            (d, b, -1, "biosphere"),
+            (d, c, 2, "biosphere"),
+        ]
+    )
+    assert Database("cat").depends == ["mouse"]
+
+    Method(("a method",)).write([(("mouse", "d"), 42)])
+    lca = LCA({("cat", "a"): 1}, ("a method",))
+    lca.lci()
+    assert np.allclose(lca.technosphere_matrix.sum(), 2 - 3 - 1 + 1 + 4 - 0.2 - 1)
+    assert np.allclose(lca.biosphere_matrix.sum(), 3)
+
+
+@bw2test
+def test_iotable_write_exchanges_blocks_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    cat = _write_cat_nodes()
+    pd.DataFrame(_edge_array([(("cat", "a"), ("cat", "a"), 2, False)] * 5)).to_parquet(
+        tmp_path / "technosphere.parquet"
+    )
+    cat.write_exchanges(
+        technosphere=[tmp_path / "technosphere.parquet"],
+        biosphere=[],
+        dependents=[],
+        chunksize=2,
+    )
+    rows, _, amounts, _ = IOTableExchanges(datapackage=cat.datapackage()).as_arrays()
+    assert rows.tolist() == [get_id(("cat", "a"))] * 5
+    assert amounts.sum() == 10
+
+
+@bw2test
+def test_iotable_edges_to_dataframe_metadata():
+    cat = _write_cat_nodes()
+    Database("mouse").write(
+        {
+            ("mouse", "d"): {
+                "name": "squeak",
+                "type": "emission",
+                "unit": "kg",
+                "categories": ("air", "urban"),
+            }
+        }
+    )
+    a, b, d = get_id(("cat", "a")), get_id(("cat", "b")), get_id(("mouse", "d"))
+    cat.write_exchanges(
+        technosphere={
+            "row": [a, b],
+            "col": [a, a],
+            "amount": [1.0, 0.5],
+            "flip": [False, True],
+        },
+        biosphere={"row": [d], "col": [b], "amount": [2.0]},
+        dependents=["mouse"],
+    )
+
+    rows, cols, amounts, codes = IOTableExchanges(
+        datapackage=cat.datapackage()
+    ).as_arrays(type_codes=True)
+    assert codes.dtype == np.int8
+    assert [IOTableExchanges.EDGE_TYPES[code] for code in codes] == [
+        "production",
+        "technosphere",
+        "biosphere",
+    ]
+
+    df = cat.edges_to_dataframe().set_index(["target_id", "source_id"])
+    assert df.loc[(b, d), "source_categories"] == "air::urban"
+    assert df.loc[(b, d), "source_unit"] == "kg"
+    assert df.loc[(b, d), "edge_type"] == "biosphere"
+    assert df.loc[(a, b), "target_location"] == "sunshine"
+    assert df.loc[(a, b), "source_location"] == "curled up"
+    assert df.loc[(a, a), "edge_type"] == "production"
+    assert df.loc[(a, b), "edge_type"] == "technosphere"
+    # Categories only include values on the same side of the edges
+    assert list(df["source_database"].cat.categories) == ["cat", "mouse"]
+    assert list(df["target_name"].cat.categories) == ["a", "b"]
+
+
+@bw2test
+def test_iotable_edges_to_dataframe_unknown_node():
+    cat = _write_cat_nodes()
+    a = get_id(("cat", "a"))
+    cat.write_exchanges(
+        technosphere={"row": [a, 10**6], "col": [a, a], "amount": [1.0, 0.5]},
+        biosphere=[],
+        dependents=[],
+    )
+    with pytest.raises(UnknownObject):
+        cat.edges_to_dataframe()
+
+
+def test_iotable_iter_edges_dataframes(iotable_fixture):
+    chunks = list(Database("cat").iter_edges_dataframes(chunksize=4))
+    assert [len(df) for df in chunks] == [4, 4, 1]
+    for column in chunks[0].columns:
+        assert len({df[column].dtype for df in chunks}) == 1
+    assert list(chunks[0]["edge_type"].cat.categories) == [
+        "biosphere",
+        "production",
+        "technosphere",
+    ]
+
+    df = pd.concat(chunks)
+    df["edge_type"] = df["edge_type"].cat.remove_unused_categories()
+    assert_frame_equal(
+        df.sort_values(["target_id", "source_id"]).reset_index(drop=True),
+        Database("cat")
+        .edges_to_dataframe()
+        .sort_values(["target_id", "source_id"])
+        .reset_index(drop=True),
+    )
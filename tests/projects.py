@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import tempfile
 from pathlib import Path
@@ -14,7 +15,9 @@ from bw2data import (
     preferences,
     projects,
 )
+from bw2data.backends import sqlite3_lci_db
 from bw2data.project import ProjectDataset
+from bw2data.sqlite import WAL_SETTINGS
 from bw2data.tests import bw2test
 
 ###
@@ -344,3 +347,123 @@ def test_copy_project_switch_current():
 
 
 # TODO: purge delete directories
+
+
+###
+### Write-ahead logging
+###
+
+
+def _journal_modes():
+    return {
+        name: substitutable_db.journal_mode
+        for name, substitutable_db in config.sqlite3_databases
+    }
+
+
+@bw2test
+def test_set_wal():
+    assert not projects.wal
+    assert set(_journal_modes().values()) == {"delete"}
+
+    name = projects.current
+    projects.set_wal()
+    assert projects.wal
+    assert set(_journal_modes().values()) == {"wal"}
+    assert (
+        sqlite3_lci_db.execute_sql("PRAGMA wal_autocheckpoint").fetchone()[0]
+        == WAL_SETTINGS["wal_autocheckpoint"]
+    )
+
+    projects.set_current("other")
+    assert not projects.wal
+    assert set(_journal_modes().values()) == {"delete"}
+    projects.set_current(name)
+    assert set(_journal_modes().values()) == {"wal"}
+
+    projects.set_wal(False)
+    assert not projects.wal
+    assert set(_journal_modes().values()) == {"delete"}
+
+
+@bw2test
+def test_wal_bulk_import_pragmas():
+    projects.set_wal()
+    with sqlite3_lci_db.pragmas({"journal_mode": "MEMORY", "synchronous": "OFF"}):
+        assert sqlite3_lci_db.journal_mode == "wal"
+        assert sqlite3_lci_db.execute_sql("PRAGMA synchronous").fetchone()[0] == 0
+    assert sqlite3_lci_db.execute_sql("PRAGMA synchronous").fetchone()[0] == 1
+
+
+def _wal_nodes(name, number):
+    return {
+        (name, str(index)): {
+            "name": "node {}".format(index),
+            "exchanges": [
+                {"input": (name, str(index)), "amount": 1, "type": "production"},
+                {
+                    "input": (name, str((index + 1) % number)),
+                    "amount": 0.5,
+                    "type": "technosphere",
+                },
+            ],
+        }
+        for index in range(number)
+    }
+
+
+def _read_during_write(project_name, started, stop, results):
+    from bw2data.backends import ActivityDataset
+
+    counts, errors = set(), []
+    try:
+        projects.set_current(project_name, writable=False, update=False)
+        for _, substitutable_db in config.sqlite3_databases:
+            substitutable_db.make_read_only()
+        started.set()
+        while not stop.is_set():
+            counts.add(ActivityDataset.select().count())
+            sqlite3_lci_db.read_connection().execute(
+                "SELECT COUNT(*) FROM exchangedataset"
+            ).fetchone()
+    except Exception as error:
+        errors.append(repr(error))
+    finally:
+        started.set()
+        results.put((counts, errors))
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="Readers use the test project of the parent process",
+)
+@bw2test
+def test_wal_parallel_readers_during_bulk_write():
+    context = multiprocessing.get_context("fork")
+    projects.set_wal()
+    Database("first").write(_wal_nodes("first", 100))
+
+    stop, results = context.Event(), context.Queue()
+    started = [context.Event() for _ in range(3)]
+    readers = [
+        context.Process(
+            target=_read_during_write,
+            args=(projects.current, event, stop, results),
+        )
+        for event in started
+    ]
+    for reader in readers:
+        reader.start()
+    for event in started:
+        assert event.wait(30)
+
+    Database("second").write(_wal_nodes("second", 3000))
+    stop.set()
+    outcomes = [results.get(timeout=60) for _ in readers]
+    for reader in readers:
+        reader.join(30)
+
+    for counts, errors in outcomes:
+        assert not errors
+        # Readers always see a consistent snapshot
+        assert counts and counts.issubset({100, 3100})
@@ -1,6 +1,10 @@
+import threading
+
+import pytest
+
 from bw2data import databases
 from bw2data.backends import SQLiteBackend
-from bw2data.search import IndexManager, Searcher
+from bw2data.search import IndexManager, Searcher, SearcherPool, searcher_pool
 from bw2data.tests import bw2test
 
 
@@ -355,3 +359,217 @@ def test_synonym_search():
 
 if __name__ == "__main__":
     test_synonym_search()
+
+
+@bw2test
+def test_add_datasets_multiprocessing_writer():
+    im = IndexManager("foo")
+    im.add_datasets(
+        (
+            {"database": "foo", "code": str(index), "name": "lollipop {}".format(index)}
+            for index in range(250)
+        ),
+        procs=2,
+        limitmb=32,
+        multisegment=True,
+    )
+    with Searcher("foo") as s:
+        assert len(s.search("lollipop", limit=None, proxy=False)) == 250
+
+
+@bw2test
+def test_update_datasets():
+    im = IndexManager("foo")
+    im.add_datasets(
+        [
+            {"database": "foo", "code": "bar", "name": "lollipop"},
+            {"database": "foo", "code": "baz", "name": "lollipop"},
+        ]
+    )
+    im.update_datasets(
+        [
+            {"database": "foo", "code": "bar", "name": "ice cream"},
+            {"database": "foo", "code": "baz", "name": "ice cream"},
+        ]
+    )
+    with Searcher("foo") as s:
+        assert not s.search("lollipop", proxy=False)
+        assert len(s.search("cream", proxy=False)) == 2
+
+
+@bw2test
+def test_write_index_in_background():
+    db = SQLiteBackend("foo")
+    ds = {
+        ("foo", "bar"): {
+            "name": "lollipop",
+            "location": ("foo", "bar"),
+            "categories": ["sweets"],
+            "reference product": "candy",
+        }
+    }
+    db.write(ds, index_in_background=True)
+    assert db.searchable
+    with Searcher(db.filename) as s:
+        assert s.search("lollipop", proxy=False) == [
+            {
+                "comment": "",
+                "product": "candy",
+                "name": "lollipop",
+                "database": "foo",
+                "location": "bar",
+                "code": "bar",
+                "categories": "sweets",
+                "synonyms": "",
+            }
+        ]
+
+
+@bw2test
+def test_background_index_error_raised_on_wait():
+    im = IndexManager("foo")
+    im.add_datasets_in_background([{"database": "foo", "name": "no code"}])
+    with pytest.raises(KeyError):
+        im.wait()
+    # The index is incomplete until it is deleted
+    with pytest.raises(KeyError):
+        im.wait()
+    im.delete_database()
+    im.wait()
+
+
+@bw2test
+def test_make_searchable_background_error(monkeypatch):
+    db = SQLiteBackend("foo")
+    db.write({("foo", "bar"): {"name": "lollipop"}}, process=False)
+
+    def fail(self, ds):
+        raise ValueError("broken")
+
+    with monkeypatch.context() as m:
+        m.setattr(IndexManager, "_format_dataset", fail)
+        db.make_searchable(reset=True, background=True)
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                db.search("lollipop")
+
+    db.make_searchable()
+    assert [obj["name"] for obj in db.search("lollipop")] == ["lollipop"]
+
+
+@bw2test
+def test_searcher_pool_reuses_searcher():
+    im = IndexManager("foo")
+    im.add_dataset({"database": "foo", "code": "bar", "name": "lollipop"})
+    with Searcher("foo") as s:
+        first = s.searcher
+    with Searcher("foo") as s:
+        assert s.searcher is first
+        assert s.search("lollipop", proxy=False)
+
+
+@bw2test
+def test_searcher_pool_refreshes_changed_index():
+    im = IndexManager("foo")
+    im.add_dataset({"database": "foo", "code": "bar", "name": "lollipop"})
+    with Searcher("foo") as s:
+        first = s.searcher
+        assert not s.search("cream", proxy=False)
+    im.add_dataset({"database": "foo", "code": "baz", "name": "ice cream"})
+    with Searcher("foo") as s:
+        assert s.searcher is not first
+        assert s.search("cream", proxy=False)
+
+
+@bw2test
+def test_searcher_pool_evicted_on_delete():
+    im = IndexManager("foo")
+    im.add_dataset({"database": "foo", "code": "bar", "name": "lollipop"})
+    searcher = searcher_pool.get(im)
+    im.create()
+    # Still in use
+    assert not searcher.is_closed
+    searcher_pool.release(searcher)
+    assert searcher.is_closed
+    with Searcher("foo") as s:
+        assert not s.search("lollipop", proxy=False)
+
+
+@bw2test
+def test_searcher_pool_lru():
+    pool = SearcherPool(maxsize=2)
+    managers = [IndexManager(name) for name in "abc"]
+    for im in managers:
+        im.add_dataset({"database": "foo", "code": "bar", "name": "lollipop"})
+    searchers = []
+    for im in managers:
+        searchers.append(pool.get(im))
+        pool.release(searchers[-1])
+    assert searchers[0].is_closed
+    assert not searchers[1].is_closed
+    assert pool.get(managers[2]) is searchers[2]
+    pool.release(pool.get(managers[0]))
+    assert searchers[1].is_closed
+    pool.clear()
+    # Still in use
+    assert not searchers[2].is_closed
+    pool.release(searchers[2])
+    assert searchers[2].is_closed
+
+
+@bw2test
+def test_searcher_pool_concurrent_search_and_reindex(monkeypatch):
+    # Evict the shared searcher on every search of the other index
+    monkeypatch.setattr(searcher_pool, "maxsize", 1)
+    im = IndexManager("foo")
+    im.add_dataset({"database": "foo", "code": "bar", "name": "lollipop"})
+    IndexManager("other").add_dataset(
+        {"database": "other", "code": "bar", "name": "lollipop"}
+    )
+    errors, stop = [], threading.Event()
+
+    def search():
+        try:
+            while not stop.is_set():
+                with Searcher("foo") as s:
+                    assert s.search("lollipop", proxy=False)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for i in range(20):
+            im.add_dataset({"database": "foo", "code": str(i), "name": "ice cream"})
+            with Searcher("other") as s:
+                assert s.search("lollipop", proxy=False)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert not errors
+    with Searcher("foo") as s:
+        assert len(s.search("cream", proxy=False, limit=None)) == 20
+
+
+@bw2test
+def test_search_proxy_keeps_ranking():
+    db = SQLiteBackend("foo")
+    db.write(
+        {
+            ("foo", "a"): {"name": "lollipop", "location": "CH"},
+            ("foo", "b"): {"name": "lollipop lollipop lollipop", "location": "FR"},
+            ("foo", "c"): {"name": "ice cream", "location": "CH"},
+        }
+    )
+    with Searcher(db.filename) as s:
+        expected = [
+            (obj["database"], obj["code"]) for obj in s.search("lollipop", proxy=False)
+        ]
+        assert [node.key for node in s.search("lollipop")] == expected
+        faceted = s.search("lollipop", facet="location")
+    assert {key: [node.key for node in value] for key, value in faceted.items()} == {
+        "ch": [("foo", "a")],
+        "fr": [("foo", "b")],
+    }
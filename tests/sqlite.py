@@ -1,8 +1,20 @@
+import sqlite3
+import threading
 from copy import copy
 
-from bw2data import projects
+import pytest
+from playhouse.pool import PooledSqliteDatabase
+
+from bw2data import config, get_node, projects
 from bw2data.backends import sqlite3_lci_db as db
 from bw2data.database import DatabaseChooser
+from bw2data.sqlite import (
+    CODEC_MAGIC,
+    FIELD_CODECS,
+    decode_blob,
+    encode_blob,
+    register_codec,
+)
 from bw2data.tests import bw2test
 
 
@@ -29,3 +41,129 @@ def test_switch_project_correctly_switches_database_objects():
     projects.set_current("new one")
     assert not table.select().count()
     assert current_db_location != db.db.database
+
+
+def test_encode_blob_pickle_round_trip():
+    value = {"input": ("a", "b"), "amount": 1.5, "properties": {1: [2, 3]}}
+    encoded = encode_blob(value)
+    assert encoded[:1] == b"\x80"
+    assert decode_blob(encoded) == value
+
+
+def test_encode_blob_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    value = {
+        "input": ("a", "b"),
+        "nested": [("c", 1), {"d": (None, True)}],
+        "amount": 1.5,
+        "name": "ü",
+        1: "integer key",
+    }
+    encoded = encode_blob(value, "msgpack")
+    assert encoded.startswith(CODEC_MAGIC)
+    decoded = decode_blob(encoded)
+    assert decoded == value
+    assert isinstance(decoded["input"], tuple)
+    assert isinstance(decoded["nested"][0], tuple)
+
+
+def test_encode_blob_msgpack_falls_back_to_pickle():
+    pytest.importorskip("msgpack")
+    value = {"when": {1, 2}, "big": 2**70}
+    encoded = encode_blob(value, "msgpack")
+    assert not encoded.startswith(CODEC_MAGIC)
+    assert decode_blob(encoded) == value
+
+
+def test_decode_blob_unknown_codec():
+    with pytest.raises(ValueError):
+        decode_blob(CODEC_MAGIC + bytes([255]) + b"foo")
+
+
+def test_register_codec_duplicate_id():
+    pytest.importorskip("msgpack")
+    with pytest.raises(ValueError):
+        register_codec("other", FIELD_CODECS["msgpack"][0], str, str)
+    with pytest.raises(ValueError):
+        register_codec("other", 256, str, str)
+
+
+@bw2test
+def test_codec_field_mixed_codecs():
+    pytest.importorskip("msgpack")
+    database = DatabaseChooser("testy")
+    database.write({("testy", "A"): {"name": "a"}})
+    config.p["field_codec"] = "msgpack"
+    node = database.new_activity(code="B", name="b", tags=("foo", "bar"))
+    node.save()
+    raw = dict(db.execute_sql("SELECT code, data FROM activitydataset").fetchall())
+    assert not bytes(raw["A"]).startswith(CODEC_MAGIC)
+    assert bytes(raw["B"]).startswith(CODEC_MAGIC)
+    assert get_node(code="A")["name"] == "a"
+    assert get_node(code="B")["tags"] == ("foo", "bar")
+
+
+def _reopen_project(settings):
+    config.p["sqlite_connection"] = settings
+    config.p.flush()
+    projects.set_current(projects.current)
+
+
+@bw2test
+def test_connection_settings():
+    _reopen_project({"busy_timeout": 2, "cache_size": -1000, "journal_mode": "wal"})
+    assert db.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.execute_sql("PRAGMA busy_timeout").fetchone()[0] == 2000
+    assert db.execute_sql("PRAGMA cache_size").fetchone()[0] == -1000
+
+    connection = db.read_connection()
+    assert connection.execute("PRAGMA busy_timeout").fetchone()[0] == 2000
+    assert connection.execute("PRAGMA cache_size").fetchone()[0] == -1000
+
+
+@bw2test
+def test_read_connection():
+    DatabaseChooser("testy").write({("testy", "A"): {"name": "a"}})
+    connection = db.read_connection()
+    assert db.read_connection() is connection
+    assert connection.execute("SELECT name FROM activitydataset").fetchall() == [("a",)]
+    with pytest.raises(sqlite3.OperationalError):
+        connection.execute("DELETE FROM activitydataset")
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.read_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not connection
+
+    projects.set_current("new one")
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection.execute("SELECT 1")
+    with pytest.raises(sqlite3.ProgrammingError):
+        other[0].execute("SELECT 1")
+    assert db.read_connection() is not connection
+    assert not db.read_connection().execute("SELECT * FROM activitydataset").fetchall()
+
+
+@bw2test
+def test_pooled_connections():
+    _reopen_project({"pool": 2})
+    assert isinstance(db.db, PooledSqliteDatabase)
+    DatabaseChooser("testy").write({("testy", "A"): {"name": "a"}})
+
+    names, errors = [], []
+
+    def read():
+        try:
+            with db.connection_context():
+                names.append(get_node(code="A")["name"])
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert names == ["a"] * 8
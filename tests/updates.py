@@ -1,7 +1,15 @@
 import random
 
-from bw2data import Updates, config
-from bw2data.tests import BW2DataTest
+from bw2data import Database, Method, Updates, config, get_id
+from bw2data.backends import ExchangeDataset, sqlite3_lci_db
+from bw2data.backends.schema import (
+    EXCHANGE_COLUMN_TRIGGERS,
+    EXISTING_DATA_INDICES,
+    NODE_ID_TRIGGERS,
+)
+from bw2data.tests import BW2DataTest, bw2test
+
+from .fixtures import biosphere
 
 
 class UpdatesTest(BW2DataTest):
@@ -17,3 +25,178 @@ class UpdatesTest(BW2DataTest):
     def test_do_updates(self):
         # Test with mock that overwrites UPDATES?
         pass
+
+
+@bw2test
+def test_reprocess_all_parallel():
+    Database("biosphere").write(biosphere)
+    method = Method(("a", "method"))
+    method.write([(("biosphere", "1"), 42)])
+    for fp in (
+        method.filepath_processed(),
+        Database("biosphere").filepath_processed(clean=False),
+    ):
+        fp.unlink()
+    Database.set_dirty("biosphere")
+
+    Updates._reprocess_all(processes=2)
+
+    assert method.filepath_processed().is_file()
+    assert Database("biosphere").filepath_processed(clean=False).is_file()
+    assert not Database("biosphere").dirty
+
+
+@bw2test
+def test_populate_exchange_columns():
+    Database("biosphere").write(biosphere)
+    Database("testy").write(
+        {
+            ("testy", "A"): {
+                "exchanges": [
+                    {
+                        "input": ("biosphere", str(index)),
+                        "amount": index,
+                        "scale": 0.5,
+                        "type": "biosphere",
+                    }
+                    for index in (1, 2)
+                ]
+            }
+        }
+    )
+    ExchangeDataset.update(amount=None, scale=None, negative=None).execute()
+
+    Updates.populate_exchange_columns_40(chunk_size=1)
+
+    assert sorted(
+        ExchangeDataset.select(
+            ExchangeDataset.amount, ExchangeDataset.scale, ExchangeDataset.negative
+        ).tuples()
+    ) == [(1, 0.5, False), (2, 0.5, False)]
+
+
+def add_duplicate_node_key():
+    # Older projects can have several nodes with the same key
+    sqlite3_lci_db.execute_sql('DROP INDEX IF EXISTS "activitydataset_key"')
+    sqlite3_lci_db.execute_sql(
+        """INSERT INTO activitydataset (database, code, data, type)
+        SELECT database, code, data, type FROM activitydataset
+        WHERE database = 'biosphere' AND code = '1'"""
+    )
+
+
+def index_names():
+    return {
+        name
+        for (name,) in sqlite3_lci_db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+
+
+@bw2test
+def test_add_exchange_indices_duplicate_node_keys():
+    Database("biosphere").write(biosphere)
+    add_duplicate_node_key()
+
+    Updates.add_exchange_indices_40()
+
+    indices = index_names()
+    assert set(EXISTING_DATA_INDICES).issubset(indices)
+    assert "activitydataset_key" not in indices
+
+
+@bw2test
+def test_add_exchange_indices():
+    Database("biosphere").write(biosphere)
+    sqlite3_lci_db.execute_sql(
+        'CREATE INDEX "exchangedataset_output" ON "exchangedataset" ("output_database", "output_code")'
+    )
+
+    Updates.add_exchange_indices_40()
+
+    indices = {
+        name
+        for (name,) in sqlite3_lci_db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    }
+    assert set(EXISTING_DATA_INDICES).issubset(indices)
+    assert "exchangedataset_output" not in indices
+    plan = " ".join(
+        str(row)
+        for row in sqlite3_lci_db.execute_sql(
+            "EXPLAIN QUERY PLAN SELECT id FROM exchangedataset WHERE output_database = ? AND output_code = ? AND type IN ('technosphere', 'substitution')",
+            ("biosphere", "1"),
+        )
+    )
+    assert "exchangedataset_output_code_type" in plan
+
+
+@bw2test
+def test_populate_exchange_node_ids_duplicate_node_keys():
+    Database("biosphere").write(biosphere)
+    Database("food").write(
+        {
+            ("food", "1"): {
+                "exchanges": [
+                    {"input": ("biosphere", "2"), "amount": 1, "type": "biosphere"},
+                ]
+            }
+        },
+        process=False,
+    )
+    add_duplicate_node_key()
+    sqlite3_lci_db.execute_sql(
+        "UPDATE exchangedataset SET input_id = NULL, output_id = NULL"
+    )
+
+    Updates.populate_exchange_node_ids_40()
+
+    exc = ExchangeDataset.get()
+    assert (exc.input_id, exc.output_id) == (
+        get_id(("biosphere", "2")),
+        get_id(("food", "1")),
+    )
+    indices = index_names()
+    assert "activitydataset_key" not in indices
+    assert "activitydataset_node_ids_40" not in indices
+
+
+@bw2test
+def test_populate_exchange_node_ids():
+    Database("biosphere").write(biosphere)
+    Database("food").write(
+        {
+            ("food", "1"): {
+                "exchanges": [
+                    {"input": ("biosphere", "1"), "amount": 1, "type": "biosphere"},
+                    {"input": ("food", "missing"), "amount": 1, "type": "technosphere"},
+                ]
+            }
+        },
+        process=False,
+    )
+    for name in NODE_ID_TRIGGERS:
+        sqlite3_lci_db.execute_sql('DROP TRIGGER "{}"'.format(name))
+    sqlite3_lci_db.execute_sql(
+        "UPDATE exchangedataset SET input_id = NULL, output_id = NULL"
+    )
+
+    Updates.populate_exchange_node_ids_40()
+
+    expected = {
+        ("biosphere", "1"): (get_id(("biosphere", "1")), get_id(("food", "1"))),
+        ("food", "missing"): (None, get_id(("food", "1"))),
+    }
+    assert {
+        (exc.input_database, exc.input_code): (exc.input_id, exc.output_id)
+        for exc in ExchangeDataset.select()
+    } == expected
+    triggers = {
+        name
+        for (name,) in sqlite3_lci_db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        )
+    }
+    assert triggers == set(NODE_ID_TRIGGERS) | set(EXCHANGE_COLUMN_TRIGGERS)
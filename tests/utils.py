@@ -1,10 +1,14 @@
+import sqlite3
+
 import numpy as np
 import pytest
 import stats_arrays as sa
 
-from bw2data import Database, Method, methods
+from bw2data import Database, Method, databases, get_id, methods, projects
 from bw2data.backends import Activity as PWActivity
+from bw2data.backends import get_ids, sqlite3_lci_db
 from bw2data.backends.schema import ActivityDataset as AD
+from bw2data.backends.schema import NodeCache, node_cache
 from bw2data.errors import MultipleResults, UnknownObject, ValidityError
 from bw2data.tests import BW2DataTest, bw2test
 from bw2data.utils import (
@@ -12,6 +16,7 @@ from bw2data.utils import (
     combine_methods,
     get_activity,
     get_node,
+    get_nodes,
     merge_databases,
     natural_sort,
     random_string,
@@ -452,3 +457,163 @@ def test_merge_databases_nonexistent():
 #     array = package["technosphere_matrix.npy"]
 #     assert mapping[("a database", "bar")] in {x["col_value"] for x in array}
 #     assert mapping[("a database", "foo")] in {x["col_value"] for x in array}
+
+
+@bw2test
+def test_get_ids():
+    Database("biosphere").write(biosphere)
+    Database("other").write({("other", str(i)): {"name": str(i)} for i in range(1000)})
+    keys = [("other", str(i)) for i in range(999, -1, -1)] + [
+        ("biosphere", "2"),
+        ["biosphere", "1"],
+        3,
+    ]
+    ids = get_ids(keys)
+    assert ids[:1000] == [get_activity(key).id for key in keys[:1000]]
+    assert ids[1000:] == [2, 1, 3]
+    assert node_cache.get_id(("other", "500")) == get_activity(("other", "500")).id
+
+    with pytest.raises(UnknownObject):
+        get_ids([("biosphere", "1"), ("biosphere", "missing")])
+
+
+@bw2test
+def test_get_nodes():
+    Database("biosphere").write(biosphere)
+    Database("other").write({("other", str(i)): {"name": str(i)} for i in range(600)})
+    keys = [("other", str(i)) for i in range(599, -1, -1)] + [["biosphere", "2"]]
+    nodes = get_nodes(keys)
+    assert [node.key for node in nodes] == [tuple(key) for key in keys]
+    assert all(isinstance(node, PWActivity) for node in nodes)
+    assert nodes[0]["name"] == "599"
+    assert node_cache.get_id(("other", "5")) == nodes[594].id
+
+    with pytest.raises(UnknownObject):
+        get_nodes([("biosphere", "1"), ("biosphere", "missing")])
+
+
+@bw2test
+def test_get_nodes_ids():
+    Database("biosphere").write(biosphere)
+    Database("other").write({("other", str(i)): {"name": str(i)} for i in range(600)})
+    ids = [get_id(("other", str(i))) for i in range(600)]
+    keys = [np.int32(ids[5]), ("biosphere", "1"), ids[599]] + ids
+    nodes = get_nodes(keys)
+    assert [node.key for node in nodes[:3]] == [
+        ("other", "5"),
+        ("biosphere", "1"),
+        ("other", "599"),
+    ]
+    assert [node.id for node in nodes[3:]] == ids
+
+    with pytest.raises(UnknownObject):
+        get_nodes([ids[0], max(ids) + 1000])
+
+
+@bw2test
+def test_get_nodes_repeated_keys():
+    Database("biosphere").write(biosphere)
+    first, second, third = get_nodes(
+        [("biosphere", "1"), ("biosphere", "1"), get_id(("biosphere", "1"))]
+    )
+    assert first.id == second.id == third.id
+    first["name"] = "changed"
+    assert second["name"] == third["name"] != "changed"
+    assert first._document is not second._document
+
+    second["name"] = "saved"
+    second.save()
+    assert get_node(id=first.id)["name"] == "saved"
+
+
+@bw2test
+def test_get_nodes_node_class():
+    class MyNode(PWActivity):
+        pass
+
+    Database("biosphere").write(biosphere)
+    nodes = get_nodes([("biosphere", "1")], node_class=MyNode)
+    assert isinstance(nodes[0], MyNode)
+
+
+@bw2test
+def test_node_cache_invalidation():
+    Database("biosphere").write(biosphere)
+    assert get_id(("biosphere", "1")) == 1
+
+    node = get_activity(("biosphere", "1"))
+    node["code"] = "foo"
+    node.save()
+    with pytest.raises(UnknownObject):
+        get_id(("biosphere", "1"))
+    assert get_id(("biosphere", "foo")) == 1
+
+    node.delete()
+    with pytest.raises(UnknownObject):
+        get_id(("biosphere", "foo"))
+
+    assert get_id(("biosphere", "2")) == 2
+    Database("biosphere").rename("renamed")
+    with pytest.raises(UnknownObject):
+        get_id(("biosphere", "2"))
+    assert get_id(("renamed", "2")) == 2
+
+    Database("renamed").write({("renamed", "2"): {"name": "new"}})
+    assert get_id(("renamed", "2")) == get_activity(name="new").id != 2
+
+    assert node_cache.backend("renamed") == "sqlite"
+    del databases["renamed"]
+    with pytest.raises(UnknownObject):
+        get_id(("renamed", "2"))
+    Database.create(name="renamed", backend="iotable")
+    assert node_cache.backend("renamed") == "iotable"
+
+
+@bw2test
+def test_node_cache_inverse_mappings():
+    cache = NodeCache(maxsize=2)
+    cache.add(("a", "1"), 1)
+    cache.add(("a", "2"), 2)
+    assert cache.get_key(1) == ("a", "1")
+    # Least recently used is ``("a", "2")``, also when looked up by id
+    cache.add(("b", "3"), 3)
+    assert cache.get_id(("a", "2")) is None and cache.get_key(2) is None
+    # Stale entries are replaced
+    cache.add(("a", "1"), 4)
+    assert cache.get_key(1) is None and cache.get_key(4) == ("a", "1")
+    cache.add(("b", "5"), 3)
+    assert cache.get_id(("b", "3")) is None and cache.get_key(3) == ("b", "5")
+    assert cache._ids == {("a", "1"): 4, ("b", "5"): 3}
+    assert cache._keys == {4: ("a", "1"), 3: ("b", "5")}
+
+    cache.invalidate("a", "1")
+    assert cache.get_id(("a", "1")) is None and cache.get_key(4) is None
+    cache.invalidate("b")
+    assert not cache._ids and not cache._keys
+
+
+@bw2test
+def test_node_cache_other_connection():
+    Database("biosphere").write(biosphere)
+    assert get_id(("biosphere", "1")) == 1
+    assert get_ids([("biosphere", "2")]) == [2]
+
+    # E.g. another process writing to the project
+    connection = sqlite3.connect(sqlite3_lci_db.db.database)
+    with connection:
+        connection.execute("UPDATE activitydataset SET code = 'old' WHERE id = 1")
+        connection.execute("UPDATE activitydataset SET code = '1' WHERE id = 2")
+    connection.close()
+    assert get_id(("biosphere", "1")) == 2
+    assert get_ids([("biosphere", "old")]) == [1]
+    with pytest.raises(UnknownObject):
+        get_id(("biosphere", "2"))
+
+
+@bw2test
+def test_node_cache_project_switch():
+    Database("biosphere").write(biosphere)
+    assert get_id(("biosphere", "1")) == 1
+    projects.set_current("other project")
+    with pytest.raises(UnknownObject):
+        get_id(("biosphere", "1"))